@@ -6,100 +6,19 @@ from datetime import datetime, timedelta
 import os
 import base64
 
+import loan_status
+import schema
+
 # Initialize SQLite connection
 conn = sqlite3.connect("loan_statements_v2.db", check_same_thread=False)
 cursor = conn.cursor()
 
-# Ensure that the new columns exist in the customers table
-cursor.execute("PRAGMA table_info(customers)")
-columns = [column[1] for column in cursor.fetchall()]
-
-# Add missing columns if they don't exist
-if 'email' not in columns:
-    cursor.execute("ALTER TABLE customers ADD COLUMN email TEXT")
-if 'address' not in columns:
-    cursor.execute("ALTER TABLE customers ADD COLUMN address TEXT")
-if 'company_registration' not in columns:
-    cursor.execute("ALTER TABLE customers ADD COLUMN company_registration TEXT")
-
-
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS statement_logs (
-        log_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        customer_id INTEGER,
-        loan_id INTEGER,
-        generated_at TEXT,
-        filename TEXT,
-        FOREIGN KEY (customer_id) REFERENCES customers(customer_id),
-        FOREIGN KEY (loan_id) REFERENCES loans(loan_id)
-    )
-""")
-
-conn.commit()
-
-# Create tables if they don't exist
-cursor.execute(""" 
-    CREATE TABLE IF NOT EXISTS customers (
-        customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        customer_name TEXT NOT NULL,
-        email TEXT,
-        address TEXT,
-        company_registration TEXT
-    )
-""")
-
-cursor.execute(""" 
-    CREATE TABLE IF NOT EXISTS loans (
-        loan_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        customer_id INTEGER,
-        account_number TEXT NOT NULL,
-        loan_amount REAL NOT NULL,
-        loan_date TEXT NOT NULL,
-        due_date TEXT NOT NULL,
-        loan_status TEXT DEFAULT 'Active',  
-        interest_rate REAL DEFAULT 0.23,  
-        admin_fee REAL DEFAULT 500.00,
-        payment_frequency TEXT,
-        collateral TEXT,
-        disbursement_method TEXT,
-        FOREIGN KEY (customer_id) REFERENCES customers(customer_id)
-    )
-""")
-
-cursor.execute(""" 
-    CREATE TABLE IF NOT EXISTS transactions (
-        transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        loan_id INTEGER,
-        date TEXT NOT NULL,
-        description TEXT NOT NULL,
-        amount REAL NOT NULL,
-        transaction_type TEXT NOT NULL,
-        payment_method TEXT NOT NULL,
-        FOREIGN KEY (loan_id) REFERENCES loans(loan_id)
-    )
-""")
-
-conn.commit()
-
-def update_loan_statuses():
-    today = datetime.today().date()
-    cursor.execute("SELECT loan_id, due_date FROM loans")
-    loans = cursor.fetchall()
-
-    for loan_id, due_date in loans:
-        transactions = pd.read_sql("SELECT amount FROM transactions WHERE loan_id = ?", conn, params=(loan_id,))
-        balance = transactions['amount'].sum() if not transactions.empty else 0
-        due = datetime.strptime(due_date, "%Y-%m-%d").date()
-
-        if balance <= 0:
-            status = "Paid"
-        elif today > due:
-            status = "Overdue"
-        else:
-            status = "Active"
-
-        cursor.execute("UPDATE loans SET loan_status = ? WHERE loan_id = ?", (status, loan_id))
-    conn.commit()
+# Create or upgrade the schema; a no-op once the database is current
+schema.migrate(conn)
+
+def update_loan_statuses(loan_ids=None):
+    # Reads each loan's balance from loan_balances; pass loan_ids to refresh only those loans
+    loan_status.update_loan_statuses(conn, loan_ids)
 
 # Call on app load
 update_loan_statuses()
@@ -1,211 +1,96 @@
 ﻿import streamlit as st
 import pandas as pd
-import sqlite3
-from fpdf import FPDF
 from datetime import datetime, timedelta
-import os
 import base64
-
-# Initialize SQLite connection
-conn = sqlite3.connect("loan_statements_v2.db", check_same_thread=False)
-cursor = conn.cursor()
-
-# Ensure that the new columns exist in the customers table
-cursor.execute("PRAGMA table_info(customers)")
-columns = [column[1] for column in cursor.fetchall()]
-
-# Add missing columns if they don't exist
-if 'email' not in columns:
-    cursor.execute("ALTER TABLE customers ADD COLUMN email TEXT")
-if 'address' not in columns:
-    cursor.execute("ALTER TABLE customers ADD COLUMN address TEXT")
-if 'company_registration' not in columns:
-    cursor.execute("ALTER TABLE customers ADD COLUMN company_registration TEXT")
-
-
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS statement_logs (
-        log_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        customer_id INTEGER,
-        loan_id INTEGER,
-        generated_at TEXT,
-        filename TEXT,
-        FOREIGN KEY (customer_id) REFERENCES customers(customer_id),
-        FOREIGN KEY (loan_id) REFERENCES loans(loan_id)
-    )
-""")
-
-conn.commit()
-
-# Create tables if they don't exist
-cursor.execute(""" 
-    CREATE TABLE IF NOT EXISTS customers (
-        customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        customer_name TEXT NOT NULL,
-        email TEXT,
-        address TEXT,
-        company_registration TEXT
-    )
-""")
-
-cursor.execute(""" 
-    CREATE TABLE IF NOT EXISTS loans (
-        loan_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        customer_id INTEGER,
-        account_number TEXT NOT NULL,
-        loan_amount REAL NOT NULL,
-        loan_date TEXT NOT NULL,
-        due_date TEXT NOT NULL,
-        loan_status TEXT DEFAULT 'Active',  
-        interest_rate REAL DEFAULT 0.23,  
-        admin_fee REAL DEFAULT 500.00,
-        payment_frequency TEXT,
-        collateral TEXT,
-        disbursement_method TEXT,
-        FOREIGN KEY (customer_id) REFERENCES customers(customer_id)
-    )
-""")
-
-cursor.execute(""" 
-    CREATE TABLE IF NOT EXISTS transactions (
-        transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        loan_id INTEGER,
-        date TEXT NOT NULL,
-        description TEXT NOT NULL,
-        amount REAL NOT NULL,
-        transaction_type TEXT NOT NULL,
-        payment_method TEXT NOT NULL,
-        FOREIGN KEY (loan_id) REFERENCES loans(loan_id)
-    )
-""")
-
-conn.commit()
-
-def update_loan_statuses():
-    today = datetime.today().date()
-    cursor.execute("SELECT loan_id, due_date FROM loans")
-    loans = cursor.fetchall()
-
-    for loan_id, due_date in loans:
-        transactions = pd.read_sql("SELECT amount FROM transactions WHERE loan_id = ?", conn, params=(loan_id,))
-        balance = transactions['amount'].sum() if not transactions.empty else 0
-        due = datetime.strptime(due_date, "%Y-%m-%d").date()
-
-        if balance <= 0:
-            status = "Paid"
-        elif today > due:
-            status = "Overdue"
-        else:
-            status = "Active"
-
-        cursor.execute("UPDATE loans SET loan_status = ? WHERE loan_id = ?", (status, loan_id))
-    conn.commit()
-
-# Call on app load
-update_loan_statuses()
-
-# PDF generation function
-class PDF(FPDF):
-    def header(self):
-        self.set_font('Helvetica', 'B', 12)
-        self.cell(200, 10, "Loan Statement", ln=True, align='C')
-        
-    def footer(self):
-        self.set_y(-15)
-        self.set_font('Helvetica', 'I', 8)
-        self.cell(0, 10, f"Page {self.page_no()}", 0, 0, 'C')
-
-def generate_pdf(customer_name, account_number, transactions, company_name, loan_date, loan_amount, finance_charge, admin_fee):
-    pdf = PDF()
-    pdf.add_page()
-    pdf.set_auto_page_break(auto=True, margin=15)
-    pdf.set_font("Helvetica", size=10)
-
-    try:
-        pdf.image("logo.png", x=10, y=8, w=50, h=15)
-    except:
-        st.warning("Logo not found.")
-    
-    statement_date = datetime.now().strftime("%Y/%m/%d")
-    pdf.cell(0, 5, f"Account Number: {account_number}", ln=True, align='R')
-    pdf.cell(0, 5, f"Statement Date: {statement_date}", ln=True, align='R')
-    pdf.ln(12)
-
-    pdf.cell(0, 6, "98 Spaanriet Street, The Reeds Ext 45, 0156", ln=True)
-    pdf.cell(0, 6, "(012) 006 0019", ln=True)
-    pdf.cell(0, 6, "info@ntirhisano.com", ln=True)
-    pdf.ln(10)
-
-    if os.path.exists("transparent_watermark.png"):
-        try:
-            pdf.image("transparent_watermark.png", x=30, y=60, w=150, h=150, type="PNG")
-        except:
-            st.warning("Watermark unreadable.")
-    
-    pdf.set_font("Helvetica", "B", 16)
-    pdf.cell(200, 12, "STATEMENT OF ACCOUNT", ln=True, align='C')
-    pdf.set_draw_color(204, 85, 0)
-    pdf.set_line_width(1.0)
-    pdf.line(10, pdf.get_y(), 200, pdf.get_y())
-
-    pdf.set_font("Helvetica", size=12)
-    pdf.cell(200, 10, customer_name, ln=True, align='C')
-    pdf.ln(10)
-
-    pdf.set_font("Helvetica", "B", 11)
-    pdf.set_fill_color(220, 220, 220)
-    pdf.set_draw_color(0, 0, 0)
-    pdf.set_line_width(0.25)
-    pdf.cell(30, 10, "Date", border=1, align='C', fill=True)
-    pdf.cell(65, 10, "Description", border=1, align='C', fill=True)
-    pdf.cell(30, 10, "Charges", border=1, align='C', fill=True)
-    pdf.cell(30, 10, "Credits", border=1, align='C', fill=True)
-    pdf.cell(35, 10, "Balance", border=1, align='C', fill=True)
-    pdf.ln()
-
-    pdf.set_font("Helvetica", size=10)
-    balance = 0
-    fmt = lambda x: f"{x:,.2f}R".replace(",", " ").replace(".", ",")
-    
-    for idx, row in transactions.iterrows():
-        date = pd.to_datetime(row['date']).strftime('%Y/%m/%d')
-        desc = str(row['description'])
-        amount = row['amount']
-        charge = amount if amount > 0 else 0
-        credit = -amount if amount < 0 else 0
-        balance += amount
-
-        pdf.cell(30, 8, date, border=1)
-        pdf.cell(65, 8, desc[:32], border=1)
-        pdf.cell(30, 8, fmt(charge) if charge else "", border=1, align='R')
-        pdf.cell(30, 8, fmt(credit) if credit else "", border=1, align='R')
-        pdf.cell(35, 8, fmt(balance), border=1, align='R')
-        pdf.ln()
-
-    pdf.set_font("Helvetica", "B", 10)
-    pdf.set_fill_color(220, 220, 220)
-    pdf.cell(155, 8, "Outstanding Balance", border=1, align='R', fill=True)
-    pdf.cell(35, 8, fmt(balance), border=1, align='R', fill=True)
-    pdf.ln(10)
-
-    pdf.set_font("Helvetica", "I", 9)
-    pdf.multi_cell(0, 5, "*Penalty fee charged at 10% per month of the total outstanding")
-
-    pdf.ln(5)
-    pdf.set_font("Helvetica", "B", size=10)
-    pdf.cell(0, 8, "Payment Instruction", ln=True)
-
-    pdf.set_font("Helvetica", size=10)
-    pdf.set_x(15)
-    pdf.cell(0, 8, "Bank: First National Bank", ln=True)
-    pdf.set_x(15)
-    pdf.cell(0, 8, "Account number: 62875263221", ln=True)
-    pdf.set_x(15)
-    pdf.cell(0, 8, "Branch number: 255355", ln=True)
-
-    pdf_filename = f"Statement_{customer_name.replace(' ', '_')}_{account_number}.pdf"
-    pdf.output(pdf_filename)
-    return pdf_filename
+import io
+from collections import deque
+
+import arrears
+import instrumentation
+import schema
+import statement_export
+import transaction_import
+from connections import ConnectionManager
+from loan_repository import LoanRepository
+from statement_archive import StatementArchive
+from statement_jobs import PENDING_STATUSES, StatementJobQueue
+
+# One connection manager and one set of caches per server process, shared by
+# all sessions: each session thread reads on its own WAL reader connection
+@st.cache_resource
+def get_repository():
+    db = ConnectionManager("loan_statements_v2.db")
+    # Create or upgrade the schema; a no-op once the database is current
+    with db.write() as conn:
+        schema.migrate(conn)
+    return LoanRepository(db)
+
+@st.cache_resource
+def get_job_queue():
+    return StatementJobQueue(get_repository(), StatementArchive())
+
+repo = get_repository()
+jobs = get_job_queue()
+archive = jobs.archive
+
+# Stage timings for the hot paths, per session: the checkbox records this
+# session's reruns into its own buffer and leaves other sessions untouched
+st.session_state.setdefault("traces", deque(maxlen=200))
+show_diagnostics = st.sidebar.checkbox("Performance diagnostics", value=instrumentation.enabled)
+instrumentation.record_to(st.session_state.traces if show_diagnostics else None)
+
+# Call on app load (recomputes the book at most once per day)
+repo.refresh_statuses()
+
+SEARCH_PAGE_SIZE = 20
+CUSTOMER_LIST_LIMIT = 200
+
+
+def show_portfolio_analytics():
+    # Served from the portfolio rollup tables, so the page cost does not grow with the book
+    st.title("Portfolio Analytics")
+    col_date, col_months = st.columns(2)
+    as_of = col_date.date_input("Aging As Of", datetime.today())
+    months = col_months.slider("Months of Activity", 3, 36, 12)
+    summary = repo.portfolio_summary(as_of, months)
+
+    by_status = summary["by_status"]
+    open_loans = by_status[by_status['loan_status'].isin(["Active", "Overdue"])]
+    overdue = by_status.loc[by_status['loan_status'] == "Overdue", 'outstanding'].sum()
+    col_book, col_overdue, col_loans = st.columns(3)
+    col_book.metric("Outstanding", f"R {open_loans['outstanding'].sum():,.2f}")
+    col_overdue.metric("Overdue", f"R {overdue:,.2f}")
+    col_loans.metric("Open Loans", f"{int(open_loans['loans'].sum()):,}")
+
+    st.subheader("Outstanding by Status")
+    st.dataframe(by_status, hide_index=True)
+
+    st.subheader(f"Aging as of {as_of:%Y-%m-%d} (days past due)")
+    aging = summary["aging"]
+    st.bar_chart(aging.set_index('bucket')['outstanding'])
+    st.dataframe(aging, hide_index=True)
+
+    st.subheader("Monthly Activity")
+    monthly = summary["monthly"].set_index('month')
+    st.bar_chart(monthly[['disbursed', 'repaid']])
+    st.line_chart(monthly[['fee_income', 'finance_charge_income']])
+    st.dataframe(monthly, use_container_width=True)
+
+    # Per-loan pass over the whole book, so only run on request
+    st.subheader("Arrears and Penalty Exposure")
+    if st.toggle("Run arrears report"):
+        report = repo.arrears(as_of)
+        st.dataframe(arrears.summarize(report), hide_index=True)
+        in_arrears = report[report['days_past_due'] > 0]
+        st.caption(f"{len(in_arrears):,} of {len(report):,} loans past due as of {as_of:%Y-%m-%d}; largest exposures:")
+        st.dataframe(in_arrears.nlargest(20, 'penalty_exposure'), hide_index=True)
+        st.download_button("Download Arrears Report (CSV)", in_arrears.to_csv(index=False),
+                           file_name=f"arrears_{as_of:%Y-%m-%d}.csv", mime="text/csv")
+
+
+if st.sidebar.radio("Page", ["Statements", "Portfolio Analytics"]) == "Portfolio Analytics":
+    show_portfolio_analytics()
+    st.stop()
 
 # Streamlit App UI
 st.title("Loan Statement Generator (Multi-Loan DB Version)")
@@ -218,19 +103,60 @@ with st.expander("➕ Add New Customer"):
     company_registration = st.text_input("Company Registration (Format: yyyy/######/##)")
 
     if st.button("Save Customer"):
-        cursor.execute(""" 
-            INSERT INTO customers (customer_name, email, address, company_registration) 
-            VALUES (?, ?, ?, ?) 
-        """, (name, email, address, company_registration))
-        conn.commit()
+        repo.add_customer(name, email, address, company_registration)
         st.success("Customer added.")
 
-# Fetch customers
-customers_df = pd.read_sql("SELECT * FROM customers ORDER BY customer_name", conn)
-selected_customer = st.selectbox("Select Customer:", customers_df['customer_name'].tolist())
+# Bulk Import Form
+with st.expander("📥 Bulk Import Transactions (CSV/Excel)"):
+    st.write("Columns required: Company, Date, Amount, Description. Optional: Account, Transaction Type, Payment Method. "
+             "Rows are posted to existing customers' loans; add new customers and loans first.")
+    import_file = st.file_uploader("Upload File", type=["csv", "xlsx"], key="bulk_import_file")
+
+    if import_file is not None and st.button("Import Transactions"):
+        try:
+            result = repo.import_transactions(import_file, import_file.name)
+        except transaction_import.TransactionImportError as e:
+            st.error(f"Error: {e}")
+        else:
+            st.success(
+                f"Imported {result['inserted']} transactions into {len(result['loan_ids'])} loans "
+                f"({result['rejected']} rows rejected, {result['rows_per_sec']:.0f} rows/sec)."
+            )
+
+# Global search: ranked matches across customers, loans and transactions
+with st.expander("🔎 Search Everything"):
+    global_query = st.text_input("Search names, emails, registrations, account numbers and descriptions")
+    if st.session_state.get("global_search_query") != global_query:
+        st.session_state.global_search_query = global_query
+        st.session_state.global_search_page = 0
+    if global_query:
+        page = st.session_state.global_search_page
+        results = repo.search(global_query, limit=SEARCH_PAGE_SIZE + 1, offset=page * SEARCH_PAGE_SIZE)
+        st.dataframe(results.head(SEARCH_PAGE_SIZE), hide_index=True)
+        col_prev, col_page, col_next = st.columns(3)
+        if col_prev.button("◀ Previous", disabled=page == 0):
+            st.session_state.global_search_page -= 1
+            st.rerun()
+        col_page.caption(f"Page {page + 1}")
+        if col_next.button("Next ▶", disabled=len(results) <= SEARCH_PAGE_SIZE):
+            st.session_state.global_search_page += 1
+            st.rerun()
+
+# Select a customer: type-ahead through the search index, so the selectbox
+# never has to hold the whole customer book
+customer_query = st.text_input("Find Customer (name, email, registration or account number):")
+if customer_query:
+    customer_options = dict(repo.suggest_customers(customer_query, limit=CUSTOMER_LIST_LIMIT))
+else:
+    customers_df = repo.customers().head(CUSTOMER_LIST_LIMIT)
+    customer_options = dict(zip(customers_df['customer_id'].astype(int), customers_df['customer_name']))
+    if len(customers_df) == CUSTOMER_LIST_LIMIT:
+        st.caption(f"Showing the first {CUSTOMER_LIST_LIMIT} customers; type above to find others.")
+cust_id = st.selectbox("Select Customer:", list(customer_options), format_func=customer_options.get)
+selected_customer = customer_options.get(cust_id)
+loans_df = pd.DataFrame(columns=['loan_id'])
 
 if selected_customer:
-    cust_id = customers_df[customers_df['customer_name'] == selected_customer]['customer_id'].values[0]
     st.markdown("---")
 
     # Add Loan Form
@@ -248,43 +174,18 @@ if selected_customer:
 
         # After loan creation
         if st.button("Save Loan"):
-            cursor.execute("""
-                INSERT INTO loans (account_number, customer_id, loan_amount, interest_rate, admin_fee, loan_date, due_date, payment_frequency, collateral, disbursement_method, loan_status)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                account_number, cust_id, loan_amount, interest_rate, admin_fee,
-                loan_date.strftime('%Y-%m-%d'), due_date,
-                payment_frequency, collateral, disbursement_method, "Active"
-            ))
-            conn.commit()
-
-            # Get the inserted loan ID
-            loan_id = cursor.lastrowid
-
-            # Prepare transactions
-            finance_charge = loan_amount * (interest_rate / 100)
-            disbursal_date = loan_date.strftime('%Y-%m-%d')
-
-            transactions = [
-                (loan_id, disbursal_date, "Loan Disbursed", loan_amount, "disbursal", "bank transfer"),
-                (loan_id, disbursal_date, "Finance Charge", finance_charge, "finance charge", "bank transfer"),
-                (loan_id, disbursal_date, "Admin Fee", admin_fee, "fees", "bank transfer")
-            ]
-
-            cursor.executemany("""
-                INSERT INTO transactions (loan_id, date, description, amount, transaction_type, payment_method)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, transactions)
-            conn.commit()
+            # Inserts the loan plus its disbursal, finance charge and admin fee transactions
+            repo.add_loan(
+                cust_id, account_number, loan_amount, interest_rate, admin_fee, loan_date, due_date,
+                payment_frequency, collateral, disbursement_method
+            )
 
             st.success("Loan and standard transactions recorded successfully!")
 
 
 
     # Display Loan Information
-    loans_df = pd.read_sql(""" 
-        SELECT * FROM loans WHERE customer_id = ? ORDER BY loan_date DESC
-    """, conn, params=(cust_id,))
+    loans_df = repo.loans_for_customer(cust_id)
     
     with st.expander("📄 View Recent Loans (Latest 4)"):
         st.dataframe(loans_df.head(4))
@@ -292,123 +193,221 @@ if selected_customer:
 
 # Add Transaction Form
 loan_id = st.selectbox("Select Loan for Transaction", loans_df['loan_id'].tolist())
+if loan_id is None:
+    # A new customer, or none selected: nothing below applies until a loan exists
+    st.info("Add a loan for this customer to record transactions and generate statements.")
+else:
+    with st.expander("➕ Add New Transaction"):
+        transaction_date = st.date_input("Transaction Date", datetime.today())
+        description = st.text_input("Transaction Description")
+        amount = st.number_input("Amount (negative for payment)")
+        transaction_type = st.selectbox("Transaction Type", ["Repayment", "Interest", "Penalty"])
+        payment_method = st.selectbox("Payment Method", ["Bank Transfer", "Cash", "Cheque"])
+
+        if st.button("Save Transaction"):
+            repo.add_transaction(loan_id, transaction_date, description, amount, transaction_type, payment_method)
+            st.success("Transaction added.")
 
-with st.expander("➕ Add New Transaction"):
-    transaction_date = st.date_input("Transaction Date", datetime.today())
-    description = st.text_input("Transaction Description")
-    amount = st.number_input("Amount (negative for payment)")
-    transaction_type = st.selectbox("Transaction Type", ["Repayment", "Interest", "Penalty"])
-    payment_method = st.selectbox("Payment Method", ["Bank Transfer", "Cash", "Cheque"])
-
-    if st.button("Save Transaction"):
-        cursor.execute("""
-            INSERT INTO transactions (loan_id, date, description, amount, transaction_type, payment_method)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (loan_id, transaction_date.strftime("%Y-%m-%d"), description, amount, transaction_type, payment_method))
-        conn.commit()
-        update_loan_statuses()
-        st.success("Transaction added.")
-
-    transactions_df = pd.read_sql("""
-        SELECT * FROM transactions WHERE loan_id = ? ORDER BY date DESC
-    """, conn, params=(loan_id,))
-
-with st.expander("💸 View Recent Transactions (Latest 4)"):
-        st.dataframe(transactions_df.head(4))
+        # Newest first
+        transactions_df = repo.transactions_for_loan(loan_id).iloc[::-1]
 
-        if loan_id:
-            transaction_date = st.date_input("Transaction Date", datetime.today(), key="new_transaction_date")
-            description = st.text_input("Transaction Description", key = "new_transaction_description")
-            amount = st.number_input("Amount (negative for payment)", key = "new_amount(negative for payment)")
-            transaction_type = st.selectbox("Transaction Type", ["Repayment", "Interest", "Penalty"], key ="new_transaction_type")
-            payment_method = st.selectbox("Payment Method", ["Bank Transfer", "Cash", "Cheque"], key = "new_payment_method")
-
-        if st.button("Add Transaction"):
-            cursor.execute("""
-                INSERT INTO transactions (loan_id, date, description, amount, transaction_type, payment_method)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (loan_id, transaction_date.strftime("%Y-%m-%d"), description, amount, transaction_type, payment_method))
-            conn.commit()
-            st.success("Transaction added.")
+    with st.expander("💸 View Recent Transactions (Latest 4)"):
+            st.dataframe(transactions_df.head(4))
+
+            if loan_id:
+                transaction_date = st.date_input("Transaction Date", datetime.today(), key="new_transaction_date")
+                description = st.text_input("Transaction Description", key = "new_transaction_description")
+                amount = st.number_input("Amount (negative for payment)", key = "new_amount(negative for payment)")
+                transaction_type = st.selectbox("Transaction Type", ["Repayment", "Interest", "Penalty"], key ="new_transaction_type")
+                payment_method = st.selectbox("Payment Method", ["Bank Transfer", "Cash", "Cheque"], key = "new_payment_method")
 
-        # Display Transactions
-        transactions_df = pd.read_sql("""
-            SELECT * FROM transactions WHERE loan_id = ?
-        """, conn, params=(loan_id,))
-        st.dataframe(transactions_df)
+            if st.button("Add Transaction"):
+                repo.add_transaction(loan_id, transaction_date, description, amount, transaction_type, payment_method)
+                st.success("Transaction added.")
+
+            # Display Transactions
+            transactions_df = repo.transactions_for_loan(loan_id)
+            st.dataframe(transactions_df)
+
+    with st.expander("📅 Repayment Schedule"):
+        if loan_id:
+            schedule = repo.schedule(loan_id)
+            comparison = repo.payment_comparison(loan_ids=[loan_id])
+            if not comparison.empty:
+                position = comparison.iloc[0]
+                col_expected, col_paid, col_variance = st.columns(3)
+                col_expected.metric("Expected to Date", f"R {position['expected_to_date']:,.2f}")
+                col_paid.metric("Paid to Date", f"R {position['paid_to_date']:,.2f}")
+                col_variance.metric("Variance", f"R {position['variance']:,.2f}", position['position'], delta_color="off")
+            st.dataframe(schedule.drop(columns='loan_id'), hide_index=True)
        
         
 # 🔍 Search & Manage Transactions
-st.markdown("### 🔍 Search & Manage Transactions")
-
-search_term = st.text_input("Search transactions by description...")
-txn_df = pd.read_sql("SELECT * FROM transactions WHERE loan_id = ? ORDER BY date", conn, params=(loan_id,))
-txn_filtered = txn_df[txn_df['description'].str.contains(search_term, case=False, na=False)] if search_term else txn_df
-
-st.dataframe(txn_filtered)
-
-if not txn_filtered.empty:
-    txn_choices = txn_filtered.apply(lambda row: f"{row['transaction_id']} - {row['date']} | {row['description']} | {row['amount']}", axis=1).tolist()
-    selected_txn = st.selectbox("Select a transaction to edit or delete:", txn_choices)
-
-    if selected_txn:
-        txn_id = int(selected_txn.split(" - ")[0])
-        txn_row = txn_filtered[txn_filtered["transaction_id"] == txn_id].iloc[0]
-
-        with st.expander("✏️ Edit Transaction"):
-            with st.form("edit_transaction_form"):
-                new_date = st.date_input("Date", pd.to_datetime(txn_row['date']))
-                new_desc = st.text_input("Description", txn_row['description'])
-                new_amount = st.number_input("Amount", value=txn_row['amount'], step=0.01)
-                new_type = st.text_input("Transaction Type", txn_row.get('transaction_type', ''))
-                new_method = st.text_input("Payment Method", txn_row.get('payment_method', ''))
-
-                update = st.form_submit_button("Update Transaction")
-                if update:
-                    cursor.execute("""
-                        UPDATE transactions 
-                        SET date = ?, description = ?, amount = ?, transaction_type = ?, payment_method = ?
-                        WHERE transaction_id = ?
-                    """, (new_date.strftime("%Y-%m-%d"), new_desc, new_amount, new_type, new_method, txn_id))
-                    conn.commit()
-                    st.success("Transaction updated.")
-
-    if st.button("❌ Delete Selected Transaction"):
-        cursor.execute("DELETE FROM transactions WHERE transaction_id = ?", (txn_id,))
-        conn.commit()
-        st.warning("Transaction deleted.")
+TXN_PAGE_SIZE = 50
+
+if loan_id is not None:
+    st.markdown("### 🔍 Search & Manage Transactions")
+    search_term = st.text_input("Search transactions by description...")
+
+    # Searched and paged in SQLite; the cursors are the last (date, transaction_id)
+    # of each earlier page, reset whenever the loan or the search changes
+    search_key = (int(loan_id), search_term)
+    if st.session_state.get("txn_search_key") != search_key:
+        st.session_state.txn_search_key = search_key
+        st.session_state.txn_cursors = []
+    txn_cursors = st.session_state.txn_cursors
+
+    txn_page = repo.search_transactions(loan_id, search_term, TXN_PAGE_SIZE + 1, txn_cursors[-1] if txn_cursors else None)
+    has_older = len(txn_page) > TXN_PAGE_SIZE
+    txn_filtered = txn_page.head(TXN_PAGE_SIZE)
+
+    st.dataframe(txn_filtered)
+
+    col_newer, col_page, col_older = st.columns(3)
+    if col_newer.button("◀ Newer", disabled=not txn_cursors):
+        txn_cursors.pop()
+        st.rerun()
+    col_page.caption(f"Page {len(txn_cursors) + 1}")
+    if col_older.button("Older ▶", disabled=not has_older):
+        last_txn = txn_filtered.iloc[-1]
+        txn_cursors.append((last_txn['date'], int(last_txn['transaction_id'])))
+        st.rerun()
+
+    if not txn_filtered.empty:
+        txn_labels = {
+            int(txn_id): f"{txn_id} - {date} | {desc} | {amount}"
+            for txn_id, date, desc, amount in zip(
+                txn_filtered['transaction_id'], txn_filtered['date'], txn_filtered['description'], txn_filtered['amount']
+            )
+        }
+        txn_id = st.selectbox("Select a transaction to edit or delete:", list(txn_labels), format_func=txn_labels.get)
+
+        if txn_id is not None:
+            txn_row = txn_filtered[txn_filtered["transaction_id"] == txn_id].iloc[0]
+
+            with st.expander("✏️ Edit Transaction"):
+                with st.form("edit_transaction_form"):
+                    new_date = st.date_input("Date", pd.to_datetime(txn_row['date']))
+                    new_desc = st.text_input("Description", txn_row['description'])
+                    new_amount = st.number_input("Amount", value=txn_row['amount'], step=0.01)
+                    new_type = st.text_input("Transaction Type", txn_row.get('transaction_type', ''))
+                    new_method = st.text_input("Payment Method", txn_row.get('payment_method', ''))
+
+                    update = st.form_submit_button("Update Transaction")
+                    if update:
+                        repo.update_transaction(txn_id, loan_id, new_date, new_desc, new_amount, new_type, new_method)
+                        st.success("Transaction updated.")
+
+        if st.button("❌ Delete Selected Transaction"):
+            repo.delete_transaction(txn_id, loan_id)
+            st.warning("Transaction deleted.")
 
 
 # Generate Loan Statement
-if st.button("Generate Statement"):
-    loan_info = loans_df[loans_df['loan_id'] == loan_id].iloc[0]
-    transactions = pd.read_sql("""
-        SELECT * FROM transactions WHERE loan_id = ? ORDER BY date
-    """, conn, params=(loan_id,))
-    pdf_filename = generate_pdf(
-        selected_customer, 
-        loan_info['account_number'], 
-        transactions, 
-        selected_customer, 
-        loan_info['loan_date'], 
-        loan_info['loan_amount'], 
-        loan_info['loan_amount'] * loan_info['interest_rate'], 
-        loan_info['admin_fee']
-    )
-        
-    # Log the download
-    cursor.execute("""
-        INSERT INTO statement_logs (customer_id, loan_id, generated_at, filename)
-        VALUES (?, ?, ?, ?)
-    """, (cust_id, loan_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), pdf_filename))
-    conn.commit()
-
-    st.success(f"Statement generated: {pdf_filename}")
-
-    # Open the generated PDF file automatically in pdf application
-    with open(pdf_filename, "rb") as f:
-        base64_pdf = base64.b64encode(f.read()).decode('utf-8')
-        pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="100%" height="800px" type="application/pdf"></iframe>'
-        st.markdown(pdf_display, unsafe_allow_html=True)
-        
-        st.download_button("Download Statement PDF", f, file_name=pdf_filename, mime="application/pdf")
+# Rendering runs on the job queue's threads; this run only enqueues and polls
+if loan_id is not None:
+    st.session_state.setdefault("statement_jobs", [])
+    statement_period = None
+    if st.radio("Statement Covers", ["Full history", "A period"], horizontal=True) == "A period":
+        col_start, col_end = st.columns(2)
+        today = datetime.today().date()
+        period_start = col_start.date_input("Period Start", today.replace(day=1))
+        period_end = col_end.date_input("Period End", today)
+        if period_end < period_start:
+            st.error("The period must end on or after its start date.")
+        else:
+            # Only the period's rows are rendered, opening with the balance brought forward
+            statement_period = (period_start, period_end)
+
+    col_one, col_all, col_consolidated = st.columns(3)
+    if col_one.button("Generate Statement"):
+        st.session_state.statement_jobs.append(jobs.enqueue(cust_id, loan_id, statement_period))
+    if col_all.button("Generate Statements for All of This Customer's Loans"):
+        st.session_state.statement_jobs.extend(jobs.enqueue_many(cust_id, loans_df['loan_id'].tolist(), statement_period))
+    # One PDF with a summary page and a section per loan (always the full history)
+    if col_consolidated.button("Generate One Consolidated Statement"):
+        st.session_state.statement_jobs.append(jobs.enqueue_consolidated(cust_id))
+
+
+    @st.fragment(run_every="2s")
+    def poll_statement_jobs(job_ids):
+        session_jobs = jobs.jobs(job_ids)
+        pending = session_jobs[session_jobs['status'].isin(PENDING_STATUSES)]
+        if pending.empty:
+            # Everything finished: rerun the page once to show the results
+            st.rerun()
+        st.info(f"Rendering {len(pending)} statement(s) in the background. You can keep working.")
+        st.dataframe(pending[['job_id', 'loan_id', 'status', 'requested_at']], hide_index=True)
+
+
+    session_jobs = jobs.jobs(st.session_state.statement_jobs)
+    if session_jobs['status'].isin(PENDING_STATUSES).any():
+        poll_statement_jobs(st.session_state.statement_jobs)
+
+    for job in session_jobs[session_jobs['status'] == 'failed'].itertuples():
+        subject = "consolidated statement" if job.consolidated else f"statement for loan {int(job.loan_id)}"
+        st.error(f"The {subject} failed: {job.error}")
+
+    finished = session_jobs[session_jobs['status'] == 'done']
+    if not finished.empty:
+        latest = finished.iloc[0]
+        pdf_bytes = archive.get(latest['content_hash'])
+        if latest['reused']:
+            st.success(f"Statement unchanged since it was last generated today; served from the archive: {latest['filename']}")
+        else:
+            st.success(f"Statement generated: {latest['filename']}")
+
+        if pdf_bytes is not None:
+            # Preview the PDF inline
+            base64_pdf = base64.b64encode(pdf_bytes).decode('utf-8')
+            pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="100%" height="800px" type="application/pdf"></iframe>'
+            st.markdown(pdf_display, unsafe_allow_html=True)
+
+            st.download_button("Download Statement PDF", pdf_bytes, file_name=latest['filename'], mime="application/pdf")
+
+
+    # Spreadsheet export of the selected loan (or all of the customer's loans),
+    # streamed into memory with running balances
+    with st.expander("📤 Export Transactions"):
+        export_scope = st.radio("Export", ["Selected loan", "All of this customer's loans"], horizontal=True)
+        export_fmt = st.selectbox("Format", list(statement_export.FORMATS),
+                                  format_func=lambda fmt: {"xlsx": "Excel (.xlsx)", "csv": "CSV", "parquet": "Parquet"}[fmt])
+        if st.button("Prepare Export"):
+            buffer = io.BytesIO()
+            if export_scope == "Selected loan":
+                repo.export(buffer, export_fmt, loan_ids=[loan_id])
+                export_name = f"Transactions_loan_{loan_id}.{export_fmt}"
+            else:
+                repo.export(buffer, export_fmt, customer_id=cust_id)
+                export_name = f"Transactions_{selected_customer.replace(' ', '_')}.{export_fmt}"
+            st.download_button(f"Download {export_name}", buffer.getvalue(), file_name=export_name)
+
+
+# Recent statements (from statement_logs); PDFs are served from the archive
+with st.expander("🗂️ Recent Statements"):
+    recent = repo.recent_statements(limit=20)
+    st.dataframe(recent.drop(columns=['content_hash']), hide_index=True)
+    available = recent[recent['content_hash'].notna()]
+    if not available.empty:
+        recent_choices = available.apply(lambda row: f"{row['log_id']} - {row['generated_at']} | {row['customer_name']} | {row['filename']}", axis=1).tolist()
+        selected_recent = st.selectbox("Select a statement to download:", recent_choices)
+        recent_row = available[available['log_id'] == int(selected_recent.split(" - ")[0])].iloc[0]
+        recent_bytes = archive.get(recent_row['content_hash'])
+        if recent_bytes is None:
+            st.warning("This statement has been pruned from the archive; generate it again.")
+        else:
+            st.download_button("Download Selected Statement", recent_bytes, file_name=recent_row['filename'],
+                               mime="application/pdf", key="download_recent_statement")
+
+
+# Diagnostics: most recent traces first
+if show_diagnostics:
+    with st.expander("⏱️ Performance Diagnostics"):
+        timings = pd.DataFrame(instrumentation.flatten(reversed(st.session_state.traces)))
+        if timings.empty:
+            st.info("No timings recorded yet. Generate a statement or change the selected loan.")
+        else:
+            timings['ms'] = (timings['seconds'] * 1000).round(1)
+            st.dataframe(timings.drop(columns=['seconds']), use_container_width=True)
+        if st.button("Clear Timings"):
+            st.session_state.traces.clear()
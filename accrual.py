@@ -0,0 +1,179 @@
+"""Nightly penalty and interest accrual.
+
+For a run date, every loan with a positive balance on that date is charged
+one of these, each at most once per calendar month:
+
+- a "Penalty" of 10% of the balance when the loan is past due (the rate in
+  the statement footer; see arrears.py), or
+- an "Interest" charge of interest_rate / 12 percent of the balance while it
+  is not yet due, interest_rate being the loan's annual rate in percent (as
+  the app enters it and add_loan books its finance charge).
+
+Penalties are simple, not compounded: the penalty base is the balance less
+the penalties already charged on or before the run date.
+
+Each charge is a normal transaction dated on the run date and is recorded in
+the accruals table under (loan_id, period, kind). A second run in the same
+month skips loans already charged, so the job can run every night and be
+re-run after a failure. Eligibility comes from one arrears pass over the
+book. The charges are written with executemany, and current statuses of the
+loans charged are refreshed in the same transaction, which commits once.
+
+Example:
+    python accrual.py --date 2025-06-30
+"""
+import argparse
+import sqlite3
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import arrears
+import connections
+import instrumentation
+import loan_status
+import portfolio
+import search_index
+
+DB_PATH = "loan_statements_v2.db"
+KINDS = ("penalty", "interest")
+TRANSACTION_TYPES = {"penalty": "Penalty", "interest": "Interest"}
+PAYMENT_METHOD = "accrual"
+
+# Penalties charged so far per loan, taken off the penalty base
+PENALTIES_QUERY = """
+    SELECT loan_id, SUM(amount) AS penalties FROM transactions
+    WHERE transaction_type = 'Penalty' AND date <= ?
+    GROUP BY loan_id
+"""
+
+
+def period_of(run_date):
+    return run_date.strftime("%Y-%m")
+
+
+def compute_accruals(conn: sqlite3.Connection, run_date, kinds=KINDS):
+    """DataFrame of loan_id, kind and amount for the charges due on run_date.
+
+    Loans already charged for run_date's month are left out.
+    """
+    report = arrears.arrears_report(conn, run_date)
+    report = report[report['balance'] > 0]
+    past_due = report['days_past_due'].to_numpy() > 0
+    penalties = pd.read_sql(PENALTIES_QUERY, conn, params=(run_date.strftime("%Y-%m-%d"),), index_col="loan_id")
+    penalty_base = (report['balance'] - report['loan_id'].map(penalties['penalties']).fillna(0.0)).clip(lower=0)
+    charges = pd.DataFrame({
+        "loan_id": report['loan_id'].to_numpy(),
+        "kind": np.where(past_due, "penalty", "interest"),
+        "amount": np.where(
+            past_due,
+            penalty_base * arrears.PENALTY_RATE,
+            report['balance'] * report['interest_rate'].fillna(0.0) / 100 / 12,
+        ).round(2),
+    })
+    charges = charges[charges['kind'].isin(kinds) & (charges['amount'] > 0)]
+
+    done = pd.read_sql("SELECT loan_id, kind FROM accruals WHERE period = ?", conn,
+                       params=(period_of(run_date),))
+    if not done.empty:
+        charges = charges.merge(done, on=["loan_id", "kind"], how="left", indicator=True)
+        charges = charges[charges['_merge'] == "left_only"].drop(columns="_merge")
+    return charges.reset_index(drop=True)
+
+
+def run_accruals(conn: sqlite3.Connection, run_date=None, kinds=KINDS, dry_run=False):
+    """Charge the penalties and interest due on run_date (default today).
+
+    Everything is written in one transaction; with dry_run nothing is. Returns
+    a summary dict with the period, penalties, penalty_total, interest,
+    interest_total, status_changes and seconds.
+    """
+    run_date = run_date or datetime.today().date()
+    period = period_of(run_date)
+    start = time.perf_counter()
+
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        with instrumentation.trace("run_accruals", period=period):
+            with instrumentation.stage("compute") as stage:
+                charges = compute_accruals(conn, run_date, kinds)
+                stage.set(rows=len(charges))
+            if dry_run:
+                conn.rollback()
+            else:
+                with instrumentation.stage("write"):
+                    status_changes = _write_accruals(conn, charges, run_date, period)
+                conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    by_kind = charges.groupby('kind')['amount']
+    return {
+        "period": period,
+        "penalties": int(by_kind.count().get("penalty", 0)),
+        "penalty_total": float(by_kind.sum().get("penalty", 0.0)),
+        "interest": int(by_kind.count().get("interest", 0)),
+        "interest_total": float(by_kind.sum().get("interest", 0.0)),
+        "status_changes": 0 if dry_run else status_changes,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def _write_accruals(conn, charges, run_date, period):
+    if charges.empty:
+        return 0
+    date = run_date.strftime("%Y-%m-%d")
+    last_id = conn.execute("SELECT COALESCE(MAX(transaction_id), 0) FROM transactions").fetchone()[0]
+    with search_index.deferred_indexing(conn), portfolio.deferred_rollups(conn):
+        conn.executemany("""
+            INSERT INTO transactions (loan_id, date, description, amount, transaction_type, payment_method)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, zip(
+            charges['loan_id'].tolist(),
+            [date] * len(charges),
+            [f"{TRANSACTION_TYPES[kind]} for {period}" for kind in charges['kind']],
+            charges['amount'].tolist(),
+            [TRANSACTION_TYPES[kind] for kind in charges['kind']],
+            [PAYMENT_METHOD] * len(charges),
+        ))
+    # The primary key makes a concurrent duplicate run fail instead of double charging
+    conn.execute("""
+        INSERT INTO accruals (loan_id, period, kind, transaction_id, amount, run_date)
+        SELECT loan_id, ?, CASE transaction_type WHEN 'Penalty' THEN 'penalty' ELSE 'interest' END,
+               transaction_id, amount, ?
+        FROM transactions
+        WHERE transaction_id > ? AND payment_method = ?
+    """, (period, date, last_id, PAYMENT_METHOD))
+    # Statuses describe the loans today, whatever date the run is for
+    return loan_status.update_loan_statuses(conn, charges['loan_id'].tolist(), commit=False)
+
+
+def main(argv=None):
+    import schema
+
+    parser = argparse.ArgumentParser(description="Charge this month's penalties and interest.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--date", type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(),
+                        help="Run date YYYY-MM-DD (default: today)")
+    parser.add_argument("--kind", action="append", choices=KINDS, help="Only this kind of charge (repeatable)")
+    parser.add_argument("--dry-run", action="store_true", help="Show what would be charged without writing")
+    args = parser.parse_args(argv)
+
+    conn = connections.connect(args.db)
+    schema.migrate(conn)
+    result = run_accruals(conn, args.date, tuple(args.kind or KINDS), args.dry_run)
+    conn.close()
+
+    verb = "Would charge" if args.dry_run else "Charged"
+    print(f"{verb} {result['penalties']} penalties ({result['penalty_total']:,.2f}) and "
+          f"{result['interest']} interest charges ({result['interest_total']:,.2f}) for {result['period']}; "
+          f"{result['status_changes']} statuses changed in {result['seconds']:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
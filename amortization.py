@@ -0,0 +1,293 @@
+"""Amortization schedules and expected vs actual repayments.
+
+A loan is repaid in equal installments from loan_date to due_date, one per
+payment_frequency period (Monthly, Quarterly or Annually) with the last one
+on the due date; a loan shorter than one period is a single bullet payment.
+Each installment repays an equal share of the three amounts booked at
+disbursement: principal (loan_amount), the finance charge and the admin fee.
+They are taken from the loan's own opening transactions, so a loan that
+keeps to its schedule ends on a zero balance whatever rate convention it
+was booked with. Cents are rounded on every installment but the last, which
+takes the remainder.
+
+Schedules for the whole book are computed at once with numpy: every loan's
+candidate installment dates are laid out in one array, the ones on or after
+the due date are dropped, and the amounts follow from per-loan counts and
+cumulative sums. The result is stored in loan_schedules, one row per
+installment, and compared with the repayments actually received with one
+aggregate per table.
+
+Example:
+    python amortization.py build && python amortization.py compare --as-of 2024-06-30
+"""
+import argparse
+import sqlite3
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from portfolio import DISBURSAL_TYPES, FEE_TYPES, FINANCE_CHARGE_TYPES, OPEN_STATUSES
+
+DB_PATH = "loan_statements_v2.db"
+PERIOD_MONTHS = {"Monthly": 1, "Quarterly": 3, "Annually": 12}
+# Loans without a recognised payment_frequency are scheduled monthly
+DEFAULT_PERIOD_MONTHS = 1
+# A payment within this of the amount due counts as on schedule
+TOLERANCE = 0.005
+
+SCHEDULE_COLUMNS = ["loan_id", "installment", "due_date", "payment", "principal", "finance_charge", "fees",
+                    "balance"]
+
+
+def finance_charge(loan_amount, interest_rate):
+    """The flat finance charge booked at disbursement; interest_rate is a percentage."""
+    return loan_amount * interest_rate / 100
+
+
+LOANS_QUERY = """
+    SELECT l.loan_id, l.loan_date, l.due_date, l.payment_frequency,
+           COALESCE(b.disbursed, l.loan_amount) AS principal,
+           COALESCE(b.finance_charge, l.loan_amount * l.interest_rate / 100) AS finance_charge,
+           COALESCE(b.fees, l.admin_fee, 0) AS fees
+    FROM loans l
+    LEFT JOIN (
+        SELECT loan_id,
+               SUM(CASE WHEN transaction_type IN ({disbursal}) THEN amount END) AS disbursed,
+               SUM(CASE WHEN transaction_type IN ({finance_charge}) THEN amount END) AS finance_charge,
+               SUM(CASE WHEN transaction_type IN ({fees}) THEN amount END) AS fees
+        FROM transactions
+        WHERE transaction_type IN ({disbursal}, {finance_charge}, {fees}) {transaction_filter}
+        GROUP BY loan_id
+    ) b ON b.loan_id = l.loan_id
+    WHERE 1 = 1 {loan_filter}
+    ORDER BY l.loan_id
+"""
+
+COMPARE_QUERY = """
+    WITH expected AS (
+        SELECT loan_id,
+               SUM(payment) AS scheduled_total,
+               SUM(CASE WHEN due_date <= :as_of THEN payment ELSE 0 END) AS expected_to_date,
+               SUM(due_date <= :as_of) AS installments_due,
+               MIN(CASE WHEN due_date > :as_of THEN due_date END) AS next_due_date,
+               COUNT(*) AS installments
+        FROM loan_schedules
+        GROUP BY loan_id
+    ),
+    paid AS (
+        SELECT loan_id, -SUM(amount) AS paid_to_date
+        FROM transactions
+        WHERE amount < 0 AND date <= :as_of
+        GROUP BY loan_id
+    )
+    SELECT l.loan_id, l.customer_id, l.account_number, l.payment_frequency, l.loan_status, e.installments,
+           e.installments_due, ROUND(e.scheduled_total, 2) AS scheduled_total,
+           ROUND(e.expected_to_date, 2) AS expected_to_date, ROUND(COALESCE(p.paid_to_date, 0), 2) AS paid_to_date,
+           e.next_due_date, s.payment AS next_payment
+    FROM expected e
+    JOIN loans l ON l.loan_id = e.loan_id
+    LEFT JOIN paid p ON p.loan_id = e.loan_id
+    LEFT JOIN loan_schedules s ON s.loan_id = e.loan_id AND s.due_date = e.next_due_date
+    WHERE 1 = 1 {loan_filter}
+    ORDER BY l.loan_id
+"""
+
+
+def _sql_list(values):
+    return ", ".join(f"'{value}'" for value in values)
+
+
+def _in_filter(column, values, prefix):
+    # Named parameters, so the filter can be combined with the queries' own
+    params = {f"{prefix}{i}": value for i, value in enumerate(values)}
+    return f" AND {column} IN ({', '.join(f':{name}' for name in params) or 'NULL'})", params
+
+
+def load_loans(conn: sqlite3.Connection, loan_ids=None, statuses=OPEN_STATUSES):
+    """Schedule inputs per loan: dates, frequency, principal, finance_charge and fees.
+
+    statuses=None includes loans of every status.
+    """
+    loan_filter, transaction_filter, params = "", "", {}
+    if loan_ids is not None:
+        loan_filter, params = _in_filter("l.loan_id", [int(loan_id) for loan_id in loan_ids], "loan")
+        transaction_filter = loan_filter.replace("l.loan_id", "loan_id")
+    if statuses is not None:
+        status_filter, status_params = _in_filter("l.loan_status", statuses, "status")
+        loan_filter += status_filter
+        params.update(status_params)
+    query = LOANS_QUERY.format(
+        disbursal=_sql_list(DISBURSAL_TYPES), finance_charge=_sql_list(FINANCE_CHARGE_TYPES),
+        fees=_sql_list(FEE_TYPES), transaction_filter=transaction_filter, loan_filter=loan_filter,
+    )
+    return pd.read_sql(query, conn, params=params)
+
+
+def add_months(dates, months):
+    """datetime64[D] dates moved by whole months, clamped to the end of shorter months."""
+    month = dates.astype("datetime64[M]") + months
+    day = dates - dates.astype("datetime64[M]").astype("datetime64[D]")
+    month_start = month.astype("datetime64[D]")
+    month_length = (month + 1).astype("datetime64[D]") - month_start
+    return month_start + np.minimum(day, month_length - np.timedelta64(1, "D"))
+
+
+def _split(total, counts, last):
+    # Equal rounded shares, the last installment taking what rounding left over
+    share = np.round(total / counts, 2)
+    return np.where(last, np.round(total - share * (counts - 1), 2), share)
+
+
+def amortization_schedule(loans: pd.DataFrame):
+    """Installments for every loan in loans (as returned by load_loans), as a SCHEDULE_COLUMNS DataFrame."""
+    if loans.empty:
+        return pd.DataFrame(columns=SCHEDULE_COLUMNS)
+    start = pd.to_datetime(loans["loan_date"]).to_numpy().astype("datetime64[D]")
+    end = pd.to_datetime(loans["due_date"]).to_numpy().astype("datetime64[D]")
+    end = np.maximum(end, start)
+    step = loans["payment_frequency"].map(PERIOD_MONTHS).fillna(DEFAULT_PERIOD_MONTHS).to_numpy(dtype=np.int64)
+
+    # Every period boundary up to the due date is a candidate; the due date
+    # itself is always the last installment
+    span = (end.astype("datetime64[M]") - start.astype("datetime64[M]")).astype(np.int64)
+    candidates = span // step + 1
+    owner = np.repeat(np.arange(len(loans)), candidates)
+    k = np.arange(owner.size) - np.searchsorted(owner, owner) + 1
+    dates = add_months(start[owner], k * step[owner])
+    keep = dates < end[owner]
+    owner = np.concatenate([owner[keep], np.arange(len(loans))])
+    dates = np.concatenate([dates[keep], end])
+    order = np.lexsort((dates, owner))
+    owner, dates = owner[order], dates[order]
+
+    # owner is sorted, so a loan's first row is where searchsorted finds it
+    installment = np.arange(owner.size) - np.searchsorted(owner, owner) + 1
+    counts = np.bincount(owner, minlength=len(loans))[owner]
+    last = installment == counts
+    parts = {
+        name: _split(loans[name].to_numpy(dtype=float)[owner], counts, last)
+        for name in ("principal", "finance_charge", "fees")
+    }
+    payment = np.round(parts["principal"] + parts["finance_charge"] + parts["fees"], 2)
+    total = (loans["principal"] + loans["finance_charge"] + loans["fees"]).to_numpy(dtype=float)[owner]
+    paid = pd.Series(payment).groupby(owner).cumsum().to_numpy()
+
+    return pd.DataFrame({
+        "loan_id": loans["loan_id"].to_numpy()[owner],
+        "installment": installment,
+        "due_date": np.datetime_as_string(dates, unit="D"),
+        "payment": payment,
+        "principal": parts["principal"],
+        "finance_charge": parts["finance_charge"],
+        "fees": parts["fees"],
+        "balance": np.round(total - paid, 2),
+    })
+
+
+def save_schedules(conn: sqlite3.Connection, schedule: pd.DataFrame, loan_ids=None):
+    """Replace the stored schedules of loan_ids (default: every loan) with schedule."""
+    if loan_ids is None:
+        conn.execute("DELETE FROM loan_schedules")
+    else:
+        conn.executemany("DELETE FROM loan_schedules WHERE loan_id = ?", [(int(loan_id),) for loan_id in loan_ids])
+    conn.executemany(
+        f"INSERT INTO loan_schedules ({', '.join(SCHEDULE_COLUMNS)}) VALUES ({', '.join('?' * len(SCHEDULE_COLUMNS))})",
+        schedule[SCHEDULE_COLUMNS].itertuples(index=False, name=None),
+    )
+
+
+def build_schedules(conn: sqlite3.Connection, loan_ids=None, statuses=OPEN_STATUSES, commit=True):
+    """Compute and store schedules for loan_ids, or for every loan with one of statuses.
+
+    A full build replaces the whole table, so loans that have since closed
+    lose their schedule. Returns a summary dict with loans, installments and
+    seconds.
+    """
+    start = time.perf_counter()
+    loans = load_loans(conn, loan_ids, statuses)
+    schedule = amortization_schedule(loans)
+    save_schedules(conn, schedule, loan_ids)
+    if commit:
+        conn.commit()
+    return {"loans": len(loans), "installments": len(schedule), "seconds": time.perf_counter() - start}
+
+
+def schedule_for(conn: sqlite3.Connection, loan_id):
+    """One loan's stored schedule, computed on the fly if it has none yet."""
+    schedule = pd.read_sql(
+        f"SELECT {', '.join(SCHEDULE_COLUMNS)} FROM loan_schedules WHERE loan_id = ? ORDER BY installment",
+        conn, params=(int(loan_id),),
+    )
+    if schedule.empty:
+        schedule = amortization_schedule(load_loans(conn, [loan_id], statuses=None))
+    return schedule
+
+
+def compare_payments(conn: sqlite3.Connection, as_of=None, loan_ids=None):
+    """Expected vs actual repayments as of a date (default today), per scheduled loan.
+
+    Payments are every credit (negative amount) dated on or before as_of.
+    variance is paid_to_date less expected_to_date, so a loan behind
+    schedule has a negative variance; position is "ahead", "on schedule" or
+    "behind".
+    """
+    as_of = (as_of or datetime.today().date()).strftime("%Y-%m-%d")
+    loan_filter, params = "", {}
+    if loan_ids is not None:
+        loan_filter, params = _in_filter("l.loan_id", [int(loan_id) for loan_id in loan_ids], "loan")
+    report = pd.read_sql(COMPARE_QUERY.format(loan_filter=loan_filter), conn, params={"as_of": as_of, **params})
+
+    report["variance"] = (report["paid_to_date"] - report["expected_to_date"]).round(2)
+    report["position"] = np.select(
+        [report["variance"] > TOLERANCE, report["variance"] < -TOLERANCE], ["ahead", "behind"], "on schedule",
+    )
+    return report
+
+
+def main(argv=None):
+    import schema
+
+    parser = argparse.ArgumentParser(description="Build amortization schedules and compare them with repayments.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Compute and store schedules")
+    build.add_argument("--loan", type=int, action="append", help="Only this loan id (repeatable)")
+    build.add_argument("--all-statuses", action="store_true", help="Include Paid loans, not just open ones")
+    compare = commands.add_parser("compare", help="Expected vs actual repayments")
+    compare.add_argument("--as-of", type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(),
+                         help="Comparison date YYYY-MM-DD (default: today)")
+    compare.add_argument("--loan", type=int, action="append", help="Only this loan id (repeatable)")
+    compare.add_argument("--out", help="Write the per-loan comparison to a .csv file")
+    show = commands.add_parser("show", help="Print one loan's schedule")
+    show.add_argument("loan_id", type=int)
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    schema.migrate(conn)
+    if args.command == "build":
+        result = build_schedules(conn, args.loan, None if args.all_statuses else OPEN_STATUSES)
+        print(f"Scheduled {result['installments']} installments for {result['loans']} loans "
+              f"in {result['seconds']:.2f}s")
+    elif args.command == "compare":
+        start = time.perf_counter()
+        report = compare_payments(conn, args.as_of, args.loan)
+        elapsed = time.perf_counter() - start
+        print(report.groupby("position").agg(
+            loans=("loan_id", "count"), expected=("expected_to_date", "sum"), paid=("paid_to_date", "sum"),
+            variance=("variance", "sum"),
+        ).round(2).to_string())
+        print(f"{len(report)} loans compared in {elapsed:.2f}s")
+        if args.out:
+            report.to_csv(args.out, index=False)
+            print(f"Wrote {len(report)} loans to {args.out}")
+    else:
+        with pd.option_context("display.width", 200):
+            print(schedule_for(conn, args.loan_id).to_string(index=False))
+    conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,132 @@
+"""Arrears report: days past due, aging bucket and penalty exposure per loan.
+
+One SQL pass gives every loan disbursed by the report date its balance on
+that date and its days past due. Today's balances come from loan_balances.
+Historical balances come from one aggregate over idx_transactions_loan_date
+(loan_id, date, amount), which covers the query, so no table rows are read.
+Buckets and penalties are then computed for the whole book at once in
+pandas.
+
+The penalty follows the statement footer: 10% of the outstanding balance for
+every month, or part month, a loan is past due (simple, not compounded).
+monthly_penalty is what the next month adds; penalty_exposure is the total
+for the months already in arrears.
+
+Example:
+    python arrears.py --as-of 2024-06-30 --min-days 1 --out arrears_2024-06-30.xlsx
+"""
+import argparse
+import sqlite3
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from portfolio import AGING_BUCKETS
+
+DB_PATH = "loan_statements_v2.db"
+PENALTY_RATE = 0.10
+DAYS_PER_MONTH = 30
+
+CURRENT_BALANCES = "SELECT loan_id, balance FROM loan_balances"
+HISTORICAL_BALANCES = """
+    SELECT loan_id, SUM(amount) AS balance FROM transactions WHERE date <= :as_of GROUP BY loan_id
+"""
+
+ARREARS_QUERY = """
+    SELECT l.loan_id, l.customer_id, c.customer_name, l.account_number, l.loan_date, l.due_date, l.loan_status,
+           l.interest_rate,
+           ROUND(COALESCE(b.balance, 0), 2) AS balance,
+           CASE WHEN ROUND(COALESCE(b.balance, 0), 2) > 0
+                THEN MAX(CAST(julianday(:as_of) - julianday(l.due_date) AS INTEGER), 0)
+                ELSE 0
+           END AS days_past_due
+    FROM loans l
+    LEFT JOIN ({balances}) b ON b.loan_id = l.loan_id
+    LEFT JOIN customers c ON c.customer_id = l.customer_id
+    WHERE l.loan_date <= :as_of
+    ORDER BY l.loan_id
+"""
+
+
+def _bucket_edges():
+    # pd.cut bins from AGING_BUCKETS' (label, low, high) rows: (-inf, 0], (0, 30], ...
+    edges = [-np.inf] + [high if high is not None else np.inf for _, _, high in AGING_BUCKETS]
+    return edges, [label for label, _, _ in AGING_BUCKETS]
+
+
+def arrears_report(conn: sqlite3.Connection, as_of=None):
+    """One row per loan disbursed on or before as_of (default today).
+
+    Columns: loan_id, customer_id, customer_name, account_number, loan_date,
+    due_date, loan_status, interest_rate, balance, days_past_due, bucket,
+    penalty_months, monthly_penalty and penalty_exposure. Only loans with a
+    positive balance are ever past due. Balances for as_of before today only
+    count transactions dated on or before it.
+    """
+    today = datetime.today().date()
+    as_of = as_of or today
+    balances = CURRENT_BALANCES if as_of >= today else HISTORICAL_BALANCES
+    report = pd.read_sql(ARREARS_QUERY.format(balances=balances), conn,
+                         params={"as_of": as_of.strftime("%Y-%m-%d")})
+
+    days = report['days_past_due'].to_numpy()
+    edges, labels = _bucket_edges()
+    report['bucket'] = pd.cut(days, edges, labels=labels)
+    report['penalty_months'] = np.ceil(days / DAYS_PER_MONTH).astype(int)
+    in_arrears = days > 0
+    report['monthly_penalty'] = np.where(in_arrears, report['balance'] * PENALTY_RATE, 0.0).round(2)
+    report['penalty_exposure'] = (report['monthly_penalty'] * report['penalty_months']).round(2)
+    return report
+
+
+def summarize(report: pd.DataFrame):
+    """Loans, balance and penalty figures per bucket, every bucket listed."""
+    return report.groupby('bucket', observed=False).agg(
+        loans=('loan_id', 'count'),
+        balance=('balance', 'sum'),
+        monthly_penalty=('monthly_penalty', 'sum'),
+        penalty_exposure=('penalty_exposure', 'sum'),
+    ).round(2).reset_index()
+
+
+def write_report(report: pd.DataFrame, path):
+    if path.endswith(".xlsx"):
+        report.to_excel(path, index=False, sheet_name="Arrears")
+    elif path.endswith(".parquet"):
+        report.to_parquet(path, index=False)
+    else:
+        report.to_csv(path, index=False)
+
+
+def main(argv=None):
+    import schema
+
+    parser = argparse.ArgumentParser(description="Days past due, aging buckets and penalty exposure for the book.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--as-of", type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(),
+                        help="Report date YYYY-MM-DD (default: today)")
+    parser.add_argument("--min-days", type=int, default=0, help="Only list loans at least this many days past due")
+    parser.add_argument("--out", help="Write the per-loan report to a .csv, .xlsx or .parquet file")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    schema.migrate(conn)
+    start = time.perf_counter()
+    report = arrears_report(conn, args.as_of)
+    elapsed = time.perf_counter() - start
+    conn.close()
+
+    with pd.option_context("display.width", 200):
+        print(summarize(report).to_string(index=False))
+    print(f"{len(report)} loans as of {(args.as_of or datetime.today().date()):%Y-%m-%d} in {elapsed:.2f}s")
+    if args.out:
+        listed = report[report['days_past_due'] >= args.min_days]
+        write_report(listed, args.out)
+        print(f"Wrote {len(listed)} loans to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
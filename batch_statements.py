@@ -0,0 +1,278 @@
+"""Headless month-end statement run over loan_statements_v2.db.
+
+Example:
+    python batch_statements.py --status Overdue --out statements/ --workers 8
+"""
+import argparse
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import date, datetime
+
+import pandas as pd
+
+import connections
+import instrumentation
+import schema
+from amortization import finance_charge
+from statement_archive import ARCHIVE_DIR, StatementArchive
+from consolidated_statements import load_customer_statement
+from statement_pdf import consolidated_filename, generate_pdf, render_consolidated_pdf, save_pdf, statement_filename
+from statement_periods import iter_period_statements, month_periods
+
+DB_PATH = "loan_statements_v2.db"
+
+# Loans are paged out of SQLite and only this many renders are kept in flight
+# per worker, so memory stays flat regardless of the size of the run.
+PAGE_SIZE = 1000
+IN_FLIGHT_PER_WORKER = 4
+LOG_BATCH_SIZE = 200
+
+# Customers with at least one selected loan, for --consolidated runs
+CUSTOMER_QUERY = """
+    SELECT DISTINCT c.customer_id
+    FROM loans l
+    JOIN customers c ON c.customer_id = l.customer_id
+    WHERE c.customer_id > ? {filters}
+    ORDER BY c.customer_id
+    LIMIT ?
+"""
+
+LOAN_QUERY = """
+    SELECT l.loan_id, l.customer_id, c.customer_name, l.account_number, l.loan_date,
+           l.loan_amount, l.interest_rate, l.admin_fee
+    FROM loans l
+    JOIN customers c ON c.customer_id = l.customer_id
+    WHERE l.loan_id > ? {filters}
+    ORDER BY l.loan_id
+    LIMIT ?
+"""
+
+# Per-process state set up by _init_worker()
+_worker_conn = None
+_worker_output_dir = None
+_worker_archive = None
+_worker_periods = None
+
+
+def build_filters(status=None, customer=None, date_from=None, date_to=None):
+    clauses, params = [], []
+    if status:
+        clauses.append("l.loan_status = ?")
+        params.append(status)
+    if customer:
+        if str(customer).isdigit():
+            clauses.append("l.customer_id = ?")
+            params.append(int(customer))
+        else:
+            clauses.append("c.customer_name = ?")
+            params.append(customer)
+    if date_from:
+        clauses.append("l.loan_date >= ?")
+        params.append(date_from)
+    if date_to:
+        clauses.append("l.loan_date <= ?")
+        params.append(date_to)
+    filters = "".join(f" AND {clause}" for clause in clauses)
+    return filters, params
+
+
+def iter_loans(conn, status=None, customer=None, date_from=None, date_to=None, page_size=PAGE_SIZE,
+               query=LOAN_QUERY):
+    # Keyset pagination on the first column: never holds more than one page of rows
+    filters, params = build_filters(status, customer, date_from, date_to)
+    query = query.format(filters=filters)
+    last_id = 0
+    while True:
+        rows = conn.execute(query, [last_id, *params, page_size]).fetchall()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1][0]
+
+
+def _init_worker(db_path, output_dir, profile_log=None, archive_dir=None, periods=None):
+    global _worker_conn, _worker_output_dir, _worker_archive, _worker_periods
+    _worker_conn = connections.connect_readonly(db_path)
+    _worker_output_dir = output_dir
+    # The parent prunes once at the end, so workers don't walk the archive concurrently
+    _worker_archive = StatementArchive(archive_dir, prune_every=None) if archive_dir else None
+    _worker_periods = periods
+    if profile_log:
+        instrumentation.enable(profile_log)
+
+
+def _loan_statements(loan_id):
+    """(transactions, period, opening_balance) for each statement of the run."""
+    if _worker_periods is None:
+        transactions = pd.read_sql(
+            "SELECT * FROM transactions WHERE loan_id = ? ORDER BY date", _worker_conn, params=(loan_id,)
+        )
+        return [(transactions, None, 0.0)]
+    return [
+        (statement["transactions"], (statement["start"], statement["end"]), statement["opening_balance"])
+        for statement in iter_period_statements(_worker_conn, loan_id, _worker_periods)
+    ]
+
+
+def render_loan(loan):
+    loan_id, customer_id, customer_name, account_number, loan_date, loan_amount, interest_rate, admin_fee = loan
+    log_rows = []
+    with instrumentation.trace("render_loan", loan_id=loan_id):
+        with instrumentation.stage("read_sql") as stage:
+            statements = _loan_statements(loan_id)
+            stage.set(rows=sum(len(transactions) for transactions, _, _ in statements))
+        for transactions, period, opening in statements:
+            statement_args = (
+                customer_name,
+                account_number,
+                transactions,
+                customer_name,
+                loan_date,
+                loan_amount,
+                finance_charge(loan_amount, interest_rate),
+                admin_fee,
+            )
+            # Several loans can share an account number, so keep batch files apart by loan_id
+            pdf_filename = statement_filename(customer_name, f"{account_number}_{loan_id}", period)
+            content_hash = None
+            if _worker_archive is None:
+                generate_pdf(*statement_args, pdf_filename=pdf_filename, output_dir=_worker_output_dir,
+                             period=period, opening_balance=opening)
+            else:
+                data, content_hash, _ = _worker_archive.get_or_render(*statement_args, period=period,
+                                                                      opening_balance=opening)
+                save_pdf(data, pdf_filename, _worker_output_dir)
+            generated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            log_rows.append((customer_id, loan_id, generated_at, pdf_filename, content_hash))
+    return log_rows
+
+
+def render_customer(customer):
+    """Render one consolidated statement for all of a customer's loans."""
+    customer_id = customer[0]
+    with instrumentation.trace("render_customer", customer_id=customer_id):
+        with instrumentation.stage("read_sql") as stage:
+            customer_name, loans = load_customer_statement(_worker_conn, customer_id)
+            stage.set(loans=len(loans), rows=sum(len(loan['transactions']) for loan in loans))
+        # Customer names need not be unique, so keep batch files apart by customer_id
+        pdf_filename = consolidated_filename(f"{customer_name}_{customer_id}")
+        content_hash = None
+        if _worker_archive is None:
+            data = render_consolidated_pdf(customer_name, loans)
+        else:
+            data, content_hash, _ = _worker_archive.get_or_render_consolidated(customer_name, loans)
+        with instrumentation.stage("write"):
+            save_pdf(data, pdf_filename, _worker_output_dir)
+    generated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return [(customer_id, loan['loan_id'], generated_at, pdf_filename, content_hash) for loan in loans]
+
+
+def _flush_logs(conn, log_rows):
+    if log_rows:
+        conn.executemany("""
+            INSERT INTO statement_logs (customer_id, loan_id, generated_at, filename, content_hash)
+            VALUES (?, ?, ?, ?, ?)
+        """, log_rows)
+        conn.commit()
+        log_rows.clear()
+
+
+def run_batch(db_path=DB_PATH, output_dir=".", workers=None, status=None, customer=None,
+              date_from=None, date_to=None, profile_log=None, archive_dir=None, periods=None, consolidated=False):
+    """Render statements for the selected loans in parallel and log each one.
+
+    With profile_log set, every worker appends one JSON line of stage timings
+    per statement to that file (see instrumentation.py). With archive_dir set,
+    statements are taken from (or added to) that StatementArchive, so loans
+    unchanged since an earlier run today are copied instead of re-rendered,
+    and the archive is pruned to its default limits once the run is done.
+    With periods, a list of consecutive (start, end) dates, each loan gets one
+    statement per period, each opening with the previous one's closing balance.
+    With consolidated, each customer with a selected loan gets one PDF covering
+    all of their loans, logged once per loan.
+    Returns (rendered, failed, elapsed_seconds); rendered counts PDFs.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * IN_FLIGHT_PER_WORKER
+
+    conn = connections.connect(db_path)
+    schema.migrate(conn)
+    rendered, failed, log_rows = 0, 0, []
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(os.path.abspath(db_path), output_dir, profile_log, archive_dir, periods)) as pool:
+        pending = {}
+
+        def drain(return_when):
+            nonlocal rendered, failed
+            done, _ = wait(pending, return_when=return_when)
+            for future in done:
+                item_id = pending.pop(future)
+                try:
+                    statement_logs = future.result()
+                    log_rows.extend(statement_logs)
+                    rendered += 1 if consolidated else len(statement_logs)
+                except Exception as exc:
+                    failed += 1
+                    print(f"{'Customer' if consolidated else 'Loan'} {item_id}: statement failed ({exc})")
+            if len(log_rows) >= LOG_BATCH_SIZE:
+                _flush_logs(conn, log_rows)
+
+        render, query = (render_customer, CUSTOMER_QUERY) if consolidated else (render_loan, LOAN_QUERY)
+        for row in iter_loans(conn, status, customer, date_from, date_to, query=query):
+            if len(pending) >= max_in_flight:
+                drain(FIRST_COMPLETED)
+            pending[pool.submit(render, row)] = row[0]
+
+        while pending:
+            drain(FIRST_COMPLETED)
+
+    _flush_logs(conn, log_rows)
+    conn.close()
+    if archive_dir:
+        StatementArchive(archive_dir).prune()
+    return rendered, failed, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate loan statements for the whole loan book.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--out", default=".", help="Directory the PDFs are written to")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--status", choices=["Active", "Overdue", "Paid"], help="Only loans with this status")
+    parser.add_argument("--customer", help="Only loans for this customer id or exact customer name")
+    parser.add_argument("--from", dest="date_from", help="Loan date on or after YYYY-MM-DD")
+    parser.add_argument("--to", dest="date_to", help="Loan date on or before YYYY-MM-DD")
+    parser.add_argument("--profile-log", help="Append per-statement stage timings to this JSON-lines file")
+    parser.add_argument("--archive", nargs="?", const=ARCHIVE_DIR, help="Reuse/store statements in this archive directory")
+    parser.add_argument("--period-start", type=date.fromisoformat, help="Period statements from YYYY-MM-DD")
+    parser.add_argument("--period-end", type=date.fromisoformat, help="Period statements to YYYY-MM-DD")
+    parser.add_argument("--monthly", action="store_true", help="Split the period into one statement per month")
+    parser.add_argument("--consolidated", action="store_true",
+                        help="One PDF per customer covering all of their loans (full history only)")
+    args = parser.parse_args(argv)
+
+    if args.consolidated and (args.period_start or args.period_end):
+        parser.error("--consolidated statements cover the full history and cannot take a period")
+
+    periods = None
+    if args.period_start or args.period_end:
+        if not (args.period_start and args.period_end) or args.period_end < args.period_start:
+            parser.error("--period-start and --period-end must both be given, start first")
+        periods = (month_periods(args.period_start, args.period_end) if args.monthly
+                   else [(args.period_start, args.period_end)])
+
+    rendered, failed, elapsed = run_batch(
+        args.db, args.out, args.workers, args.status, args.customer, args.date_from, args.date_to, args.profile_log,
+        args.archive, periods, args.consolidated,
+    )
+    rate = rendered / elapsed if elapsed else 0.0
+    print(f"Rendered {rendered} statements ({failed} failed) in {elapsed:.2f}s - {rate:.1f} statements/sec")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
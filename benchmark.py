@@ -0,0 +1,240 @@
+"""Time the hot paths against a synthetic loan book and write JSON results.
+
+Each benchmark reports min/median/max wall time over its runs, so two result
+files can be compared run-to-run (same --loans and --seed) to spot
+regressions.
+
+Example:
+    python benchmark.py --loans 10000 --json bench_10k.json
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+import connections
+import loan_status
+import schema
+import synthetic_loan_book
+from amortization import finance_charge
+from statement_pdf import generate_pdf
+
+
+def timed(fn, runs):
+    timings = []
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+def summarize(timings, **extra):
+    summary = {
+        "runs": len(timings),
+        "min_s": min(timings),
+        "median_s": statistics.median(timings),
+        "max_s": max(timings),
+    }
+    summary.update(extra)
+    return summary
+
+
+def bench_update_loan_statuses(conn, runs):
+    def reset_and_update():
+        conn.execute("UPDATE loans SET loan_status = 'Active'")
+        conn.commit()
+        return loan_status.update_loan_statuses(conn)
+
+    cold, changed = timed(reset_and_update, runs)
+    # Second pass finds nothing stale: the steady state of an app rerun
+    warm, _ = timed(lambda: loan_status.update_loan_statuses(conn), runs)
+    return {
+        "update_loan_statuses": summarize(cold, rows=changed),
+        "update_loan_statuses_no_changes": summarize(warm),
+    }
+
+
+def bench_per_loan_queries(conn, sample):
+    loan_ids = [row[0] for row in conn.execute("SELECT loan_id FROM loans ORDER BY RANDOM() LIMIT ?", (sample,))]
+    timings, rows = [], 0
+    for loan_id in loan_ids:
+        start = time.perf_counter()
+        df = pd.read_sql("SELECT * FROM transactions WHERE loan_id = ? ORDER BY date", conn, params=(loan_id,))
+        timings.append(time.perf_counter() - start)
+        rows += len(df)
+    return {"read_sql_transactions_per_loan": summarize(timings, rows=rows)}
+
+
+def _loan_for_statement(conn, longest):
+    order = "DESC" if longest else "ASC"
+    statement_loans = """
+        FROM loan_balances b
+        JOIN loans l ON l.loan_id = b.loan_id
+        JOIN customers c ON c.customer_id = l.customer_id
+    """
+    # Median-length history for the small case, the longest one for the large case
+    offset = 0 if longest else conn.execute(f"SELECT COUNT(*) / 2 {statement_loans}").fetchone()[0]
+    loan_id, *loan = conn.execute(f"""
+        SELECT l.loan_id, c.customer_name, l.account_number, l.loan_date, l.loan_amount, l.interest_rate, l.admin_fee
+        {statement_loans}
+        ORDER BY b.transaction_count {order}
+        LIMIT 1 OFFSET ?
+    """, (offset,)).fetchone()
+    transactions = pd.read_sql("SELECT * FROM transactions WHERE loan_id = ? ORDER BY date", conn, params=(loan_id,))
+    return loan, transactions
+
+
+def bench_generate_pdf(conn, runs, output_dir):
+    results = {}
+    for label, longest in (("generate_pdf_small", False), ("generate_pdf_long", True)):
+        (name, account, loan_date, amount, rate, fee), transactions = _loan_for_statement(conn, longest)
+        path = os.path.join(output_dir, f"{label}.pdf")
+        timings, _ = timed(lambda: generate_pdf(
+            name, account, transactions, name, loan_date, amount, finance_charge(amount, rate), fee,
+            pdf_filename=os.path.basename(path), output_dir=output_dir,
+        ), runs)
+        results[label] = summarize(timings, rows=len(transactions), bytes=os.path.getsize(path))
+    return results
+
+
+def bench_excel_export(conn, runs, output_dir):
+    _, transactions = _loan_for_statement(conn, longest=True)
+    path = os.path.join(output_dir, "export.xlsx")
+    timings, _ = timed(lambda: transactions.to_excel(path, index=False), runs)
+    return {"excel_export_long": summarize(timings, rows=len(transactions), bytes=os.path.getsize(path))}
+
+
+def bench_concurrent_sessions(db_path, sessions=20, ops_per_session=50):
+    """Operators reading loans with an occasional statement log write.
+
+    Compares one shared connection behind a lock (every session serializes)
+    with ConnectionManager (per-thread WAL readers, one short-transaction writer).
+    Reads fetch raw rows so the timing reflects SQLite, not DataFrame building.
+    """
+    conn = sqlite3.connect(db_path)
+    loan_ids = [row[0] for row in conn.execute(
+        "SELECT loan_id FROM loans ORDER BY RANDOM() LIMIT ?", (sessions * ops_per_session,))]
+    conn.close()
+    log_sql = "INSERT INTO statement_logs (customer_id, loan_id, generated_at, filename) VALUES (0, ?, 'bench', 'bench')"
+    read_sql = "SELECT * FROM transactions WHERE loan_id = ? ORDER BY date"
+
+    def drive(read, write):
+        def session(worker):
+            for i in range(ops_per_session):
+                loan_id = loan_ids[(worker * ops_per_session + i) % len(loan_ids)]
+                read(loan_id)
+                if i % 10 == 0:
+                    write(loan_id)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(sessions) as pool:
+            list(pool.map(session, range(sessions)))
+        return time.perf_counter() - start
+
+    shared = sqlite3.connect(db_path, check_same_thread=False)
+    lock = threading.Lock()
+
+    def shared_read(loan_id):
+        with lock:
+            shared.execute(read_sql, (loan_id,)).fetchall()
+
+    def shared_write(loan_id):
+        with lock:
+            shared.execute(log_sql, (loan_id,))
+            shared.commit()
+
+    shared_seconds = drive(shared_read, shared_write)
+    shared.close()
+
+    db = connections.ConnectionManager(db_path)
+
+    def managed_write(loan_id):
+        with db.write() as conn:
+            conn.execute(log_sql, (loan_id,))
+
+    def managed_read(loan_id):
+        with db.reader() as conn:
+            conn.execute(read_sql, (loan_id,)).fetchall()
+
+    managed_seconds = drive(managed_read, managed_write)
+    db.close()
+
+    ops = sessions * ops_per_session
+    return {
+        "concurrent_sessions_shared_connection": summarize([shared_seconds], sessions=sessions, ops_per_sec=ops / shared_seconds),
+        "concurrent_sessions_connection_manager": summarize([managed_seconds], sessions=sessions, ops_per_sec=ops / managed_seconds),
+    }
+
+
+def run(db_path, runs=3, sample=200):
+    conn = sqlite3.connect(db_path)
+    schema.migrate(conn)
+    counts = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ("customers", "loans", "transactions", "statement_logs")}
+    results = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        results.update(bench_update_loan_statuses(conn, runs))
+        results.update(bench_per_loan_queries(conn, sample))
+        results.update(bench_generate_pdf(conn, runs, output_dir))
+        results.update(bench_excel_export(conn, runs, output_dir))
+    conn.close()
+    results.update(bench_concurrent_sessions(db_path))
+    return counts, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark statement generation hot paths.")
+    parser.add_argument("--loans", type=int, default=1000, help="Size of the synthetic book to generate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", help="Benchmark this database instead of generating one (it is modified)")
+    parser.add_argument("--keep-db", help="Generate the synthetic book at this path and keep it")
+    parser.add_argument("--runs", type=int, default=3, help="Repetitions per benchmark")
+    parser.add_argument("--sample", type=int, default=200, help="Loans sampled for per-loan query timings")
+    parser.add_argument("--json", default="bench_results.json", help="Where to write the results")
+    args = parser.parse_args(argv)
+
+    generated = None
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db
+        if not db_path:
+            db_path = args.keep_db or os.path.join(tmp, "synthetic.db")
+            start = time.perf_counter()
+            generated = synthetic_loan_book.generate(db_path, args.loans, args.seed)
+            generated["seconds"] = time.perf_counter() - start
+        counts, results = run(db_path, args.runs, args.sample)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "db": args.db,
+            "generated": generated,
+            "counts": counts,
+        },
+        "results": results,
+    }
+    with open(args.json, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for name, result in results.items():
+        print(f"{name:36s} median {result['median_s'] * 1000:10.1f} ms  ({result['runs']} runs)")
+    print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
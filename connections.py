@@ -0,0 +1,117 @@
+"""Tuned SQLite connections for concurrent Streamlit sessions and batch workers.
+
+The database runs in WAL mode, so readers never block the writer or each
+other. Reads check a read-only connection out of a small per-process pool and
+hand it back afterwards, so it stays warm across Streamlit reruns (each of
+which runs on a fresh thread); all writes in a process go through one writer
+connection, one short transaction at a time, and other processes are waited
+on via busy_timeout rather than failing with "database is locked".
+
+    db = ConnectionManager("loan_statements_v2.db")
+    with db.reader() as conn:
+        df = pd.read_sql("SELECT ...", conn)
+    with db.write() as conn:
+        conn.execute("INSERT ...")
+"""
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_PATH = "loan_statements_v2.db"
+
+# Wait this long for another connection's write lock before giving up
+BUSY_TIMEOUT_S = 10.0
+# Negative cache_size is in KiB: 64 MiB page cache per connection
+CACHE_SIZE_KIB = 64 * 1024
+MMAP_SIZE = 256 * 1024 * 1024
+# Read-only connections kept open per ConnectionManager
+DEFAULT_READERS = 8
+
+
+def configure(conn: sqlite3.Connection):
+    """Per-connection pragmas shared by readers and the writer."""
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+def connect(db_path=DB_PATH, check_same_thread=True):
+    """Open a tuned read-write connection, switching the file to WAL."""
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_S, check_same_thread=check_same_thread)
+    # journal_mode is persistent in the file; synchronous=NORMAL is durable
+    # against application crashes in WAL mode and avoids an fsync per commit
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return configure(conn)
+
+
+def connect_readonly(db_path=DB_PATH, check_same_thread=True):
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=BUSY_TIMEOUT_S,
+                           check_same_thread=check_same_thread)
+    return configure(conn)
+
+
+class ConnectionManager:
+    """One writer connection per process plus a pool of up to max_readers read-only connections."""
+
+    def __init__(self, db_path=DB_PATH, max_readers=DEFAULT_READERS):
+        self.db_path = db_path
+        self._write_lock = threading.RLock()
+        # Opened first so the file exists and is in WAL mode before any reader
+        self._writer = connect(db_path, check_same_thread=False)
+        # Idle readers; None marks a slot with no connection open yet
+        self._readers = queue.LifoQueue()
+        for _ in range(max_readers):
+            self._readers.put(None)
+
+    @contextmanager
+    def reader(self):
+        """Check a read-only connection out of the pool for the block.
+
+        Connections are opened on first use and returned afterwards, whichever
+        thread asks next; when all are checked out the caller waits for one.
+        Do not hold one while checking out another.
+        """
+        conn = self._readers.get()
+        try:
+            if conn is None:
+                conn = connect_readonly(self.db_path, check_same_thread=False)
+            yield conn
+        except sqlite3.Error:
+            # Don't hand a connection in an unknown state to the next reader
+            if conn is not None:
+                conn.close()
+                conn = None
+            raise
+        finally:
+            if conn is not None and conn.in_transaction:
+                conn.rollback()
+            self._readers.put(conn)
+
+    @contextmanager
+    def write(self):
+        """Serialize writers and commit (or roll back) when the block ends.
+
+        Keep the block to the statements that must be atomic; reads that feed
+        the write belong on reader() before entering it.
+        """
+        with self._write_lock:
+            try:
+                yield self._writer
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+
+    def close(self):
+        with self._write_lock:
+            self._writer.close()
+        while True:
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                return
+            if conn is not None:
+                conn.close()
@@ -0,0 +1,90 @@
+"""Consolidated statements: every loan of a customer in one PDF.
+
+All of the customer's loans and their transactions come back from a single
+query (loans LEFT JOIN transactions, in loan then date order) and are split
+per loan in memory, so a customer with ten loans costs one query and one
+document setup instead of ten of each. The document opens with a summary
+page and has a section per loan; statement_logs still gets one row per loan,
+all pointing at the same file.
+
+Example:
+    python consolidated_statements.py 42 --out statements/
+"""
+import argparse
+import os
+import sqlite3
+
+import pandas as pd
+
+import connections
+import schema
+from amortization import finance_charge
+from statement_pdf import consolidated_filename, render_consolidated_pdf, save_pdf
+
+DB_PATH = "loan_statements_v2.db"
+
+CUSTOMER_STATEMENT_QUERY = """
+    SELECT c.customer_name, l.loan_id, l.account_number, l.loan_date, l.loan_amount, l.interest_rate,
+           l.admin_fee, t.transaction_id, t.date, t.description, t.amount
+    FROM loans l
+    JOIN customers c ON c.customer_id = l.customer_id
+    LEFT JOIN transactions t ON t.loan_id = l.loan_id
+    WHERE l.customer_id = ?
+    ORDER BY l.loan_date, l.loan_id, t.date
+"""
+
+LOAN_COLUMNS = ["loan_id", "account_number", "loan_date", "loan_amount", "interest_rate", "admin_fee"]
+TRANSACTION_COLUMNS = ["transaction_id", "date", "description", "amount"]
+
+
+def load_customer_statement(conn: sqlite3.Connection, customer_id):
+    """(customer_name, loans) for a consolidated statement.
+
+    loans is a list of dicts, oldest loan first, with the loan's columns, its
+    finance_charge and its transactions as a DataFrame. Returns (None, [])
+    for a customer without loans.
+    """
+    frame = pd.read_sql(CUSTOMER_STATEMENT_QUERY, conn, params=(int(customer_id),))
+    if frame.empty:
+        return None, []
+    loans = []
+    for _, group in frame.groupby("loan_id", sort=False):
+        loan = group.iloc[0][LOAN_COLUMNS].to_dict()
+        loan["loan_id"] = int(loan["loan_id"])
+        loan["finance_charge"] = finance_charge(loan["loan_amount"], loan["interest_rate"])
+        # A loan without transactions comes back as one row of NULLs
+        loan["transactions"] = group.loc[group["transaction_id"].notna(), TRANSACTION_COLUMNS].reset_index(drop=True)
+        loans.append(loan)
+    return frame["customer_name"].iloc[0], loans
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render one statement covering all of a customer's loans.")
+    parser.add_argument("customer_id", type=int)
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--out", default=".", help="Directory the PDF is written to")
+    args = parser.parse_args(argv)
+
+    conn = connections.connect(args.db)
+    schema.migrate(conn)
+    customer_name, loans = load_customer_statement(conn, args.customer_id)
+    if not loans:
+        conn.close()
+        print(f"Customer {args.customer_id} has no loans")
+        return 1
+
+    os.makedirs(args.out, exist_ok=True)
+    filename = consolidated_filename(customer_name)
+    save_pdf(render_consolidated_pdf(customer_name, loans), filename, args.out)
+    conn.executemany("""
+        INSERT INTO statement_logs (customer_id, loan_id, generated_at, filename)
+        VALUES (?, ?, datetime('now', 'localtime'), ?)
+    """, [(args.customer_id, loan["loan_id"], filename) for loan in loans])
+    conn.commit()
+    conn.close()
+    print(f"Wrote {filename} covering {len(loans)} loans")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
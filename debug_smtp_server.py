@@ -0,0 +1,146 @@
+"""A local SMTP server for exercising statement delivery without sending mail.
+
+It speaks just enough SMTP for smtplib (EHLO/HELO, MAIL, RCPT, DATA, RSET,
+NOOP, QUIT), one thread per connection, and either discards each message or
+writes it to a directory as a .eml file. --fail-every makes every Nth
+message fail with a transient 451, and --latency-ms delays each reply, so
+retries and throughput can be tried against something that behaves like a
+slow or flaky relay. The standard library's smtpd, which used to serve this
+purpose, is gone from Python 3.12.
+
+Example:
+    python debug_smtp_server.py --port 1025 --out sent_mail/ --fail-every 20
+"""
+import argparse
+import itertools
+import os
+import socketserver
+import threading
+import time
+
+DEFAULT_HOST = "localhost"
+DEFAULT_PORT = 1025
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+    def handle(self):
+        self.reply(f"220 {self.server.hostname} debugging SMTP server ready")
+        sender, recipients = None, []
+        for raw in self.rfile:
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            verb = line[:4].upper()
+            if verb == "EHLO":
+                self.wfile.write(f"250-{self.server.hostname}\r\n".encode("ascii"))
+                self.reply("250 8BITMIME")
+            elif verb == "HELO":
+                self.reply(f"250 {self.server.hostname}")
+            elif verb == "MAIL":
+                sender, recipients = line[10:].strip(), []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(line[8:].strip().strip("<>"))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                if sender is None or not recipients:
+                    self.reply("503 Need MAIL and RCPT first")
+                    continue
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = self._read_data()
+                if self.server.should_fail():
+                    self.reply("451 Temporary failure, try again later")
+                else:
+                    self.server.store(sender, recipients, data)
+                    self.reply("250 OK: queued")
+                sender, recipients = None, []
+            elif verb == "RSET":
+                sender, recipients = None, []
+                self.reply("250 OK")
+            elif verb == "NOOP":
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+    def _read_data(self):
+        lines = []
+        for raw in self.rfile:
+            if raw in (b".\r\n", b".\n"):
+                break
+            # Undo dot-stuffing
+            lines.append(raw[1:] if raw.startswith(b"..") else raw)
+        return b"".join(lines)
+
+
+class DebugSMTPServer(socketserver.ThreadingTCPServer):
+    """SMTP sink on (host, port); messages counts what was accepted."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, out_dir=None, fail_every=0, latency_ms=0, verbose=False):
+        super().__init__((host, port), _SMTPHandler)
+        self.hostname = host
+        self.out_dir = out_dir
+        self.fail_every = fail_every
+        self.latency = latency_ms / 1000
+        self.verbose = verbose
+        self.messages = 0
+        self.failures = 0
+        self._attempts = itertools.count(1)
+        self._lock = threading.Lock()
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+
+    def should_fail(self):
+        with self._lock:
+            fail = bool(self.fail_every) and next(self._attempts) % self.fail_every == 0
+            self.failures += fail
+        return fail
+
+    def store(self, sender, recipients, data):
+        with self._lock:
+            self.messages += 1
+            number = self.messages
+        if self.out_dir:
+            with open(os.path.join(self.out_dir, f"{number:07d}.eml"), "wb") as f:
+                f.write(data)
+        if self.verbose:
+            print(f"#{number} {sender} -> {', '.join(recipients)} ({len(data):,} bytes)")
+
+    def start(self):
+        """Serve on a daemon thread (for use from tests and benchmarks); returns the thread."""
+        thread = threading.Thread(target=self.serve_forever, name="debug-smtp", daemon=True)
+        thread.start()
+        return thread
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Accept and record mail locally instead of sending it.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--out", help="Directory to write received messages to as .eml files")
+    parser.add_argument("--fail-every", type=int, default=0, help="Answer every Nth message with a transient 451")
+    parser.add_argument("--latency-ms", type=int, default=0, help="Delay before each reply")
+    args = parser.parse_args(argv)
+
+    server = DebugSMTPServer(args.host, args.port, args.out, args.fail_every, args.latency_ms, verbose=True)
+    print(f"Listening on {args.host}:{args.port}; Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    print(f"{server.messages} messages accepted, {server.failures} failed on purpose")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,169 @@
+"""Optional per-stage timing for statement generation and the SQL hot paths.
+
+Code marks work with trace() and stage() blocks:
+
+    with instrumentation.trace("render_pdf", account=account_number):
+        with instrumentation.stage("output") as stage:
+            data = bytes(pdf.output())
+            stage.set(bytes=len(data))
+
+When disabled (the default) both return one shared no-op object, so the cost
+is a global lookup and an empty with-block. When enabled, each finished trace
+is kept in recent_traces and, if a log path is set, appended to a JSON-lines
+file. record_to() switches recording on for the calling thread only, into
+the caller's own buffer: the Streamlit app gives every session its buffer,
+so one user's diagnostics checkbox neither slows nor shows other sessions.
+Stages nested inside a stage or inside another trace are recorded on the
+outer trace as "outer.inner".
+
+Set LOAN_STATEMENT_PROFILE=1 (and optionally LOAN_STATEMENT_PROFILE_LOG=path)
+or call enable() to switch it on.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+enabled = os.environ.get("LOAN_STATEMENT_PROFILE") == "1"
+log_path = os.environ.get("LOAN_STATEMENT_PROFILE_LOG")
+
+# Most recent finished traces, newest last
+recent_traces = deque(maxlen=200)
+
+_local = threading.local()
+_log_lock = threading.Lock()
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, trace, name, fields):
+        self.trace = trace
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.prefix = getattr(_local, "prefix", "")
+        self.full_name = self.prefix + self.name
+        _local.prefix = self.full_name + "."
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        seconds = time.perf_counter() - self.start
+        _local.prefix = self.prefix
+        entry = {"stage": self.full_name, "seconds": seconds}
+        entry.update(self.fields)
+        if exc_type is not None:
+            entry["error"] = exc_type.__name__
+        self.trace.stages.append(entry)
+        return False
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+
+class _Trace:
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.stages = []
+
+    def __enter__(self):
+        _local.trace = self
+        _local.prefix = ""
+        self.started_at = datetime.now().isoformat(timespec="milliseconds")
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        seconds = time.perf_counter() - self.start
+        _local.trace = None
+        record = {"trace": self.name, "started_at": self.started_at, "seconds": seconds, "pid": os.getpid()}
+        record.update(self.fields)
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        record["stages"] = self.stages
+        sink = getattr(_local, "sink", None)
+        (recent_traces if sink is None else sink).append(record)
+        if log_path:
+            line = json.dumps(record, default=str)
+            with _log_lock, open(log_path, "a") as f:
+                f.write(line + "\n")
+        return False
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+
+def trace(name, **fields):
+    """Time a unit of work (one statement, one status refresh).
+
+    Inside an active trace this is recorded as a stage of the outer one.
+    """
+    if not enabled and getattr(_local, "sink", None) is None:
+        return _NULL_STAGE
+    current = getattr(_local, "trace", None)
+    if current is not None:
+        return _Stage(current, name, fields)
+    return _Trace(name, fields)
+
+
+def stage(name, **fields):
+    """Time one step of the active trace, or a trace of its own outside one."""
+    if not enabled and getattr(_local, "sink", None) is None:
+        return _NULL_STAGE
+    current = getattr(_local, "trace", None)
+    if current is None:
+        return _Trace(name, fields)
+    return _Stage(current, name, fields)
+
+
+def enable(path=None):
+    global enabled, log_path
+    enabled = True
+    if path is not None:
+        log_path = path
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def record_to(sink):
+    """Record this thread's traces into sink (e.g. a deque); None stops.
+
+    Independent of enable(): other threads keep their own setting.
+    """
+    _local.sink = sink
+
+
+def current_sink():
+    """This thread's record_to() sink, to hand on to worker threads."""
+    return getattr(_local, "sink", None)
+
+
+def flatten(traces=None):
+    """One row per stage (plus one per trace total), for display as a table."""
+    rows = []
+    for record in recent_traces if traces is None else traces:
+        base = {key: value for key, value in record.items() if key != "stages"}
+        rows.append(dict(base, stage="(total)"))
+        for entry in record["stages"]:
+            rows.append(dict(base, **entry))
+    return rows
@@ -0,0 +1,98 @@
+"""Materialized per-loan balance summary.
+
+loan_balances holds each loan's current balance, total charges, total
+credits, last transaction date and transaction count. Triggers on
+transactions (see schema.py) apply every insert, update and delete as a delta,
+so readers get a loan's totals with one primary-key lookup instead of summing
+its history. rebuild_loan_balances() recomputes the table from transactions
+to reconcile any drift.
+
+Example:
+    python loan_balances.py check
+    python loan_balances.py rebuild
+"""
+import argparse
+import sqlite3
+
+DB_PATH = "loan_statements_v2.db"
+
+# Legacy rows with a non-integer loan_id cannot belong to a loan and are skipped
+SUMMARY_QUERY = """
+    SELECT loan_id,
+           SUM(amount) AS balance,
+           SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) AS total_charges,
+           SUM(CASE WHEN amount < 0 THEN -amount ELSE 0 END) AS total_credits,
+           MAX(date) AS last_transaction_date,
+           COUNT(*) AS transaction_count
+    FROM transactions
+    WHERE typeof(loan_id) = 'integer'
+    GROUP BY loan_id
+"""
+
+# Tolerance for comparing float totals accumulated in a different order
+DRIFT_TOLERANCE = 0.005
+
+
+def rebuild_loan_balances(conn: sqlite3.Connection, commit=True):
+    """Recompute loan_balances from scratch; returns the number of loans summarized."""
+    conn.execute("DELETE FROM loan_balances")
+    cursor = conn.execute(f"""
+        INSERT INTO loan_balances (loan_id, balance, total_charges, total_credits, last_transaction_date, transaction_count)
+        {SUMMARY_QUERY}
+    """)
+    if commit:
+        conn.commit()
+    return cursor.rowcount
+
+
+def find_drift(conn: sqlite3.Connection):
+    """Return loan_ids whose stored summary no longer matches their transactions."""
+    rows = conn.execute(f"""
+        SELECT s.loan_id
+        FROM ({SUMMARY_QUERY}) s
+        LEFT JOIN loan_balances b ON b.loan_id = s.loan_id
+        WHERE b.loan_id IS NULL
+           OR ABS(s.balance - b.balance) > :tolerance
+           OR ABS(s.total_charges - b.total_charges) > :tolerance
+           OR ABS(s.total_credits - b.total_credits) > :tolerance
+           OR s.last_transaction_date IS NOT b.last_transaction_date
+           OR s.transaction_count != b.transaction_count
+        UNION
+        SELECT b.loan_id
+        FROM loan_balances b
+        WHERE b.transaction_count != 0
+          AND NOT EXISTS (SELECT 1 FROM transactions t WHERE t.loan_id = b.loan_id)
+    """, {"tolerance": DRIFT_TOLERANCE}).fetchall()
+    return [loan_id for (loan_id,) in rows]
+
+
+def get_loan_balance(conn: sqlite3.Connection, loan_id):
+    row = conn.execute("SELECT balance FROM loan_balances WHERE loan_id = ?", (int(loan_id),)).fetchone()
+    return row[0] if row else 0.0
+
+
+def main(argv=None):
+    import schema
+
+    parser = argparse.ArgumentParser(description="Check or rebuild the loan_balances summary table.")
+    parser.add_argument("command", choices=["check", "rebuild"])
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    schema.migrate(conn)
+    if args.command == "rebuild":
+        print(f"Rebuilt balances for {rebuild_loan_balances(conn)} loans")
+        return 0
+
+    drift = find_drift(conn)
+    if drift:
+        print(f"{len(drift)} loans out of sync: {', '.join(map(str, drift[:20]))}{' ...' if len(drift) > 20 else ''}")
+        print("Run 'python loan_balances.py rebuild' to reconcile.")
+        return 1
+    print("loan_balances is in sync with transactions")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,332 @@
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+import amortization
+import arrears
+import consolidated_statements
+import instrumentation
+import loan_status
+import portfolio
+import search_index
+import statement_export
+import statement_periods
+import transaction_import
+from connections import ConnectionManager
+
+
+class LoanRepository:
+    """Read-through caches for the Streamlit app, invalidated by its own writes.
+
+    Streamlit re-executes the whole script on every widget interaction, so the
+    app reads customers, a customer's loans and a loan's transactions many
+    times per rerun. Reads are served from per-entity caches; every write goes
+    through this class, commits, and drops exactly the entries it made stale.
+    One instance is shared by all sessions of a server process.
+
+    Cache misses query on a pooled read-only connection outside the lock, so
+    sessions only serialize on writes (see connections.py).
+    """
+
+    def __init__(self, db: ConnectionManager):
+        self.db = db
+        self._lock = threading.RLock()
+        # Bumped by every invalidation; a read that raced a write is not cached
+        self._generation = 0
+        self._customers = {}
+        self._loans_by_customer = {}
+        self._transactions_by_loan = {}
+        self._loan_customer = {}
+        self._statuses_as_of = None
+
+    def _cached(self, cache, key, load):
+        with self._lock:
+            if key in cache:
+                return cache[key]
+            generation = self._generation
+        with self.db.reader() as conn:
+            value = load(conn)
+        with self._lock:
+            if self._generation == generation:
+                cache[key] = value
+        return value
+
+    # Reads
+
+    def customers(self):
+        def load(conn):
+            with instrumentation.stage("read_sql.customers") as stage:
+                customers = pd.read_sql("SELECT * FROM customers ORDER BY customer_name", conn)
+                stage.set(rows=len(customers))
+            return customers
+
+        return self._cached(self._customers, None, load)
+
+    def loans_for_customer(self, customer_id):
+        customer_id = int(customer_id)
+
+        def load(conn):
+            with instrumentation.stage("read_sql.loans_for_customer", customer_id=customer_id) as stage:
+                loans = pd.read_sql("""
+                    SELECT l.*,
+                           COALESCE(b.balance, 0) AS balance,
+                           COALESCE(b.total_charges, 0) AS total_charges,
+                           COALESCE(b.total_credits, 0) AS total_credits,
+                           b.last_transaction_date,
+                           COALESCE(b.transaction_count, 0) AS transaction_count
+                    FROM loans l
+                    LEFT JOIN loan_balances b ON b.loan_id = l.loan_id
+                    WHERE l.customer_id = ?
+                    ORDER BY l.loan_date DESC
+                """, conn, params=(customer_id,))
+                stage.set(rows=len(loans))
+            with self._lock:
+                self._loan_customer.update((int(loan_id), customer_id) for loan_id in loans['loan_id'])
+            return loans
+
+        return self._cached(self._loans_by_customer, customer_id, load)
+
+    def transactions_for_loan(self, loan_id):
+        """All of a loan's transactions, oldest first (none for loan_id None)."""
+        loan_id = None if loan_id is None else int(loan_id)
+
+        def load(conn):
+            with instrumentation.stage("read_sql.transactions_for_loan", loan_id=loan_id) as stage:
+                transactions = pd.read_sql("""
+                    SELECT * FROM transactions WHERE loan_id = ? ORDER BY date
+                """, conn, params=(loan_id,))
+                stage.set(rows=len(transactions))
+            return transactions
+
+        return self._cached(self._transactions_by_loan, loan_id, load)
+
+    def statement_period(self, loan_id, start, end):
+        """(opening_balance, transactions dated in [start, end]) for a period statement."""
+        with self.db.reader() as conn, instrumentation.stage("read_sql.statement_period", loan_id=int(loan_id)) as stage:
+            opening = statement_periods.opening_balance(conn, loan_id, start)
+            transactions = statement_periods.period_transactions(conn, loan_id, start, end)
+            stage.set(rows=len(transactions))
+        return opening, transactions
+
+    def customer_statement(self, customer_id):
+        """(customer_name, loans) for a consolidated statement, in one query."""
+        customer_id = int(customer_id)
+        with self.db.reader() as conn, instrumentation.stage("read_sql.customer_statement", customer_id=customer_id) as stage:
+            customer_name, loans = consolidated_statements.load_customer_statement(conn, customer_id)
+            stage.set(loans=len(loans), rows=sum(len(loan['transactions']) for loan in loans))
+        return customer_name, loans
+
+    def search_transactions(self, loan_id, term="", limit=50, before=None):
+        """One page of a loan's transactions, newest first, optionally filtered.
+
+        term is a case-insensitive substring of the description. Pages are
+        keyset-paginated: pass the (date, transaction_id) of the last row of
+        the previous page as before. The loan's rows are read newest first
+        off its date index and the scan stops after limit matches; a rare
+        term still reads the rest of the loan's history.
+        """
+        clauses, params = ["loan_id = ?"], [int(loan_id)]
+        if term:
+            escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            clauses.append("description LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+        if before is not None:
+            clauses.append("(date, transaction_id) < (?, ?)")
+            params.extend([before[0], int(before[1])])
+        with self.db.reader() as conn, instrumentation.stage("read_sql.search_transactions", loan_id=int(loan_id)) as stage:
+            page = pd.read_sql(f"""
+                SELECT * FROM transactions
+                WHERE {" AND ".join(clauses)}
+                ORDER BY date DESC, transaction_id DESC
+                LIMIT ?
+            """, conn, params=[*params, limit])
+            stage.set(rows=len(page))
+        return page
+
+    def search(self, text, kinds=None, limit=20, offset=0):
+        """Ranked global search; see search_index.search()."""
+        with self.db.reader() as conn, instrumentation.stage("read_sql.search") as stage:
+            results = search_index.search(conn, text, kinds, limit, offset)
+            stage.set(rows=len(results))
+        return results
+
+    def suggest_customers(self, text, limit=10):
+        with self.db.reader() as conn:
+            return search_index.suggest(conn, text, limit)
+
+    def recent_statements(self, customer_id=None, limit=20):
+        """Latest statement_logs entries, newest first (not cached: they change on every render)."""
+        where, params = "", []
+        if customer_id is not None:
+            where, params = "WHERE s.customer_id = ?", [int(customer_id)]
+        with self.db.reader() as conn:
+            return pd.read_sql(f"""
+                SELECT s.log_id, s.generated_at, c.customer_name, l.account_number, s.loan_id, s.filename, s.content_hash
+                FROM statement_logs s
+                LEFT JOIN customers c ON c.customer_id = s.customer_id
+                LEFT JOIN loans l ON l.loan_id = s.loan_id
+                {where}
+                ORDER BY s.log_id DESC
+                LIMIT ?
+            """, conn, params=[*params, limit])
+
+    def portfolio_summary(self, as_of=None, months=12):
+        """Dashboard figures from the portfolio rollups (not cached: a few hundred summary rows)."""
+        with self.db.reader() as conn, instrumentation.stage("read_sql.portfolio_summary"):
+            return portfolio.portfolio_summary(conn, as_of, months)
+
+    def arrears(self, as_of=None):
+        """Per-loan arrears report as of a date (see arrears.py); a full-book pass, not cached."""
+        with self.db.reader() as conn, instrumentation.stage("read_sql.arrears") as stage:
+            report = arrears.arrears_report(conn, as_of)
+            stage.set(rows=len(report))
+        return report
+
+    def schedule(self, loan_id):
+        """A loan's stored repayment schedule (see amortization.py)."""
+        with self.db.reader() as conn, instrumentation.stage("read_sql.schedule"):
+            return amortization.schedule_for(conn, loan_id)
+
+    def payment_comparison(self, as_of=None, loan_ids=None):
+        """Expected vs actual repayments per scheduled loan; not cached."""
+        with self.db.reader() as conn, instrumentation.stage("read_sql.payment_comparison") as stage:
+            report = amortization.compare_payments(conn, as_of, loan_ids)
+            stage.set(rows=len(report))
+        return report
+
+    def export(self, target, fmt=None, loan_ids=None, customer_id=None, date_from=None, date_to=None):
+        """Stream matching transactions to a spreadsheet (see statement_export.export_ledger)."""
+        with self.db.reader() as conn, instrumentation.stage("export", fmt=fmt) as stage:
+            result = statement_export.export_ledger(conn, target, fmt, loan_ids, customer_id, date_from, date_to)
+            stage.set(rows=result["rows"])
+        return result
+
+    # Writes
+
+    def add_customer(self, name, email, address, company_registration):
+        with self.db.write() as conn:
+            conn.execute("""
+                INSERT INTO customers (customer_name, email, address, company_registration)
+                VALUES (?, ?, ?, ?)
+            """, (name, email, address, company_registration))
+        with self._lock:
+            self._generation += 1
+            self._customers.clear()
+
+    def add_loan(self, customer_id, account_number, loan_amount, interest_rate, admin_fee, loan_date, due_date,
+                 payment_frequency, collateral, disbursement_method):
+        """Insert a loan with its disbursal, finance charge and admin fee rows, and its repayment schedule."""
+        customer_id = int(customer_id)
+        disbursal_date = loan_date.strftime('%Y-%m-%d')
+        with self.db.write() as conn:
+            cursor = conn.execute("""
+                INSERT INTO loans (account_number, customer_id, loan_amount, interest_rate, admin_fee, loan_date, due_date, payment_frequency, collateral, disbursement_method, loan_status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                account_number, customer_id, loan_amount, interest_rate, admin_fee,
+                disbursal_date, due_date.strftime('%Y-%m-%d'),
+                payment_frequency, collateral, disbursement_method, "Active"
+            ))
+            loan_id = cursor.lastrowid
+
+            finance_charge = amortization.finance_charge(loan_amount, interest_rate)
+            transactions = [
+                (loan_id, disbursal_date, "Loan Disbursed", loan_amount, "disbursal", "bank transfer"),
+                (loan_id, disbursal_date, "Finance Charge", finance_charge, "finance charge", "bank transfer"),
+                (loan_id, disbursal_date, "Admin Fee", admin_fee, "fees", "bank transfer")
+            ]
+            conn.executemany("""
+                INSERT INTO transactions (loan_id, date, description, amount, transaction_type, payment_method)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, transactions)
+            amortization.build_schedules(conn, [loan_id], statuses=None, commit=False)
+
+        with self._lock:
+            self._generation += 1
+            self._loan_customer[loan_id] = customer_id
+            self._loans_by_customer.pop(customer_id, None)
+            self._transactions_by_loan.pop(loan_id, None)
+        return loan_id
+
+    def add_transaction(self, loan_id, date, description, amount, transaction_type, payment_method):
+        loan_id = int(loan_id)
+        with self.db.write() as conn:
+            conn.execute("""
+                INSERT INTO transactions (loan_id, date, description, amount, transaction_type, payment_method)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (loan_id, date.strftime("%Y-%m-%d"), description, amount, transaction_type, payment_method))
+            self._transactions_changed(conn, loan_id)
+
+    def update_transaction(self, transaction_id, loan_id, date, description, amount, transaction_type, payment_method):
+        loan_id = int(loan_id)
+        with self.db.write() as conn:
+            conn.execute("""
+                UPDATE transactions
+                SET date = ?, description = ?, amount = ?, transaction_type = ?, payment_method = ?
+                WHERE transaction_id = ?
+            """, (date.strftime("%Y-%m-%d"), description, amount, transaction_type, payment_method, int(transaction_id)))
+            self._transactions_changed(conn, loan_id)
+
+    def delete_transaction(self, transaction_id, loan_id):
+        loan_id = int(loan_id)
+        with self.db.write() as conn:
+            conn.execute("DELETE FROM transactions WHERE transaction_id = ?", (int(transaction_id),))
+            self._transactions_changed(conn, loan_id)
+
+    def import_transactions(self, source, filename=None):
+        """Bulk import a CSV/XLSX export; see transaction_import.import_transactions()."""
+        with self.db.write() as conn:
+            result = transaction_import.import_transactions(conn, source, filename)
+        with self._lock:
+            self._generation += 1
+            for loan_id in result["loan_ids"]:
+                self._transactions_by_loan.pop(loan_id, None)
+            # Statuses of the touched loans were refreshed as part of the import
+            self._loans_by_customer.clear()
+        return result
+
+    def log_statement(self, customer_id, loan_id, filename, content_hash=None):
+        self.log_statements(customer_id, [loan_id], filename, content_hash)
+
+    def log_statements(self, customer_id, loan_ids, filename, content_hash=None):
+        """One statement_logs row per loan covered by the file."""
+        generated_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.db.write() as conn:
+            conn.executemany("""
+                INSERT INTO statement_logs (customer_id, loan_id, generated_at, filename, content_hash)
+                VALUES (?, ?, ?, ?, ?)
+            """, [(int(customer_id), int(loan_id), generated_at, filename, content_hash) for loan_id in loan_ids])
+
+    # Statuses
+
+    def refresh_statuses(self):
+        """Recompute the whole book's statuses at most once per day.
+
+        Statuses only change through transaction writes, which refresh their
+        own loan, or through the calendar passing a due date.
+        """
+        today = datetime.today().date()
+        with self._lock:
+            if self._statuses_as_of == today:
+                return
+        with self.db.write() as conn:
+            changed = loan_status.update_loan_statuses(conn, today=today)
+        with self._lock:
+            if changed:
+                self._generation += 1
+                self._loans_by_customer.clear()
+            self._statuses_as_of = today
+
+    def _transactions_changed(self, conn, loan_id):
+        # Runs inside the write, so the status update commits with the change
+        changed = loan_status.update_loan_statuses(conn, [loan_id], commit=False)
+        with self._lock:
+            self._generation += 1
+            self._transactions_by_loan.pop(loan_id, None)
+            if changed:
+                customer_id = self._loan_customer.get(loan_id)
+                if customer_id is None:
+                    self._loans_by_customer.clear()
+                else:
+                    self._loans_by_customer.pop(customer_id, None)
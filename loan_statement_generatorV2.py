@@ -5,6 +5,8 @@ from fpdf.enums import XPos, YPos
 from datetime import datetime
 import os
 
+from statement_assets import WATERMARK_DPI, prepare_image
+
 class PDF(FPDF):
     pass
 
@@ -19,7 +21,7 @@ def generate_pdf(customer_name, transactions, company_name, loan_date):
     # Static logo
     logo_path = "logo.png"
     try:
-        pdf.image(logo_path, x=10, y=8, w=50, h=15)
+        pdf.image(prepare_image(logo_path, 50, 15), x=10, y=8, w=50, h=15)
     except:
         st.warning("Static logo file not found or unreadable.")
 
@@ -44,21 +46,21 @@ def generate_pdf(customer_name, transactions, company_name, loan_date):
     label_x = 20
     icon_x = 10
 
-    # Contact details with icons
+    # Contact details with icons (downscaled from the ~450 KB sources to their 5 mm print size)
     y = pdf.get_y()
-    try: pdf.image(icon_address, x=icon_x, y=y, w=icon_w)
+    try: pdf.image(prepare_image(icon_address, icon_w), x=icon_x, y=y, w=icon_w)
     except: pass
     pdf.set_xy(label_x, y)
     pdf.cell(0, line_h, "98 Spaanriet Street, The Reeds Ext 45, 0156", ln=True)
 
     y = pdf.get_y()
-    try: pdf.image(icon_phone, x=icon_x, y=y, w=icon_w)
+    try: pdf.image(prepare_image(icon_phone, icon_w), x=icon_x, y=y, w=icon_w)
     except: pass
     pdf.set_xy(label_x, y)
     pdf.cell(0, line_h, "(012) 006 0019", ln=True)
 
     y = pdf.get_y()
-    try: pdf.image(icon_email, x=icon_x, y=y, w=icon_w)
+    try: pdf.image(prepare_image(icon_email, icon_w), x=icon_x, y=y, w=icon_w)
     except: pass
     pdf.set_xy(label_x, y)
     pdf.cell(0, line_h, "info@ntirhisano.com", ln=True)
@@ -70,7 +72,7 @@ def generate_pdf(customer_name, transactions, company_name, loan_date):
     if os.path.exists(watermark_path):
         try:
             # Add transparent watermark using alpha support (only with PNG transparency)
-            pdf.image(watermark_path, x=30, y=60, w=150, h=150, type="PNG")
+            pdf.image(prepare_image(watermark_path, 150, 150, WATERMARK_DPI), x=30, y=60, w=150, h=150)
         except:
             st.warning("Watermark image file not found or unreadable.")
 
@@ -0,0 +1,64 @@
+import sqlite3
+from datetime import datetime
+
+import instrumentation
+
+# SQLite caps the number of "?" parameters per statement on older builds
+MAX_SQL_PARAMS = 500
+
+# Balance comes from the loan_balances summary (one primary-key lookup per loan).
+# Dates are stored as 'YYYY-MM-DD' text so they compare correctly as strings.
+STATUS_QUERY = """
+    SELECT loan_id, status FROM (
+        SELECT l.loan_id,
+               l.loan_status,
+               CASE
+                   WHEN ROUND(COALESCE(b.balance, 0), 2) <= 0 THEN 'Paid'
+                   WHEN :today > l.due_date THEN 'Overdue'
+                   ELSE 'Active'
+               END AS status
+        FROM loans l
+        LEFT JOIN loan_balances b ON b.loan_id = l.loan_id
+        {where}
+    )
+    WHERE loan_status IS NOT status
+"""
+
+
+def compute_status_changes(conn: sqlite3.Connection, loan_ids=None, today=None):
+    """Return [(status, loan_id), ...] for loans whose stored status is stale."""
+    today = (today or datetime.today().date()).strftime("%Y-%m-%d")
+
+    if loan_ids is None:
+        rows = conn.execute(STATUS_QUERY.format(where=""), {"today": today}).fetchall()
+        return [(status, loan_id) for loan_id, status in rows]
+
+    loan_ids = list(dict.fromkeys(int(i) for i in loan_ids))
+    changes = []
+    for start in range(0, len(loan_ids), MAX_SQL_PARAMS):
+        chunk = loan_ids[start:start + MAX_SQL_PARAMS]
+        params = {"today": today}
+        params.update({f"id{i}": loan_id for i, loan_id in enumerate(chunk)})
+        placeholders = ", ".join(f":id{i}" for i in range(len(chunk)))
+        query = STATUS_QUERY.format(where=f"WHERE l.loan_id IN ({placeholders})")
+        changes.extend((status, loan_id) for loan_id, status in conn.execute(query, params))
+    return changes
+
+
+def update_loan_statuses(conn: sqlite3.Connection, loan_ids=None, today=None, commit=True):
+    """Recompute Paid/Overdue/Active and write back only the rows that changed.
+
+    Pass loan_ids to refresh just the loans touched by a write instead of the
+    whole book, and commit=False to leave the caller's transaction open.
+    Returns the number of loans whose status was updated.
+    """
+    with instrumentation.trace("update_loan_statuses", scope="book" if loan_ids is None else "loans"):
+        with instrumentation.stage("compute") as stage:
+            changes = compute_status_changes(conn, loan_ids, today)
+            stage.set(rows=len(changes))
+        with instrumentation.stage("write"):
+            if changes:
+                conn.executemany("UPDATE loans SET loan_status = ? WHERE loan_id = ?", changes)
+            if commit:
+                conn.commit()
+    return len(changes)
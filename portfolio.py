@@ -0,0 +1,391 @@
+"""Portfolio rollups and the analytics read off them.
+
+Two summary tables are kept current by triggers, in the same delta style as
+loan_balances:
+
+- portfolio_monthly: per calendar month and transaction type, the charges,
+  credits and count of transactions. Disbursements, repayments and fee and
+  finance-charge income per month are read from it directly.
+- portfolio_due: per due date and loan status, the number of loans and their
+  outstanding balance. It follows loan_balances (balance changes) and loans
+  (new loans, status and due date changes). Outstanding by status is a sum
+  over it, and aging buckets are the same sum grouped by days past due as of
+  the requested date, so the calendar moving on needs no refresh.
+
+The dashboard therefore reads a few hundred summary rows however large the
+transactions table grows. rebuild_rollups() recomputes both tables and
+find_drift() checks them against the source tables.
+
+Example:
+    python portfolio.py summary --as-of 2025-06-30
+    python portfolio.py check
+"""
+import argparse
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+DB_PATH = "loan_statements_v2.db"
+
+# Days past due: (label, lowest day, highest day); None is open-ended
+AGING_BUCKETS = (
+    ("Current", None, 0),
+    ("1-30", 1, 30),
+    ("31-60", 31, 60),
+    ("61-90", 61, 90),
+    ("90+", 91, None),
+)
+# Loans that still owe money; Paid loans can carry a small credit balance
+OPEN_STATUSES = ("Active", "Overdue")
+
+# Transaction types, as written by the app and the synthetic book, per dashboard column
+DISBURSAL_TYPES = ("disbursal",)
+FEE_TYPES = ("fees",)
+FINANCE_CHARGE_TYPES = ("finance charge",)
+
+# Tolerance for comparing float totals accumulated in a different order
+DRIFT_TOLERANCE = 0.005
+
+MONTHLY_QUERY = """
+    SELECT substr(date, 1, 7) AS month,
+           transaction_type,
+           SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END) AS charges,
+           SUM(CASE WHEN amount < 0 THEN -amount ELSE 0 END) AS credits,
+           COUNT(*) AS transaction_count
+    FROM transactions
+    WHERE typeof(loan_id) = 'integer'
+    GROUP BY month, transaction_type
+"""
+
+DUE_QUERY = """
+    SELECT l.due_date,
+           COALESCE(l.loan_status, 'Active') AS loan_status,
+           COUNT(*) AS loan_count,
+           COALESCE(SUM(b.balance), 0) AS outstanding
+    FROM loans l
+    LEFT JOIN loan_balances b ON b.loan_id = l.loan_id
+    GROUP BY l.due_date, COALESCE(l.loan_status, 'Active')
+"""
+
+
+def _monthly_delta(row, sign):
+    # Upsert applying one transaction row (NEW or OLD) with sign +1 or -1
+    return f"""
+        INSERT INTO portfolio_monthly (month, transaction_type, charges, credits, transaction_count)
+        SELECT substr({row}.date, 1, 7), {row}.transaction_type,
+               {sign} * MAX({row}.amount, 0), {sign} * MAX(-{row}.amount, 0), {sign}
+        WHERE typeof({row}.loan_id) = 'integer'
+        ON CONFLICT (month, transaction_type) DO UPDATE SET
+            charges = charges + excluded.charges,
+            credits = credits + excluded.credits,
+            transaction_count = transaction_count + excluded.transaction_count;
+    """
+
+
+def _due_delta(due_date, status, loans, outstanding, where="1"):
+    return f"""
+        INSERT INTO portfolio_due (due_date, loan_status, loan_count, outstanding)
+        SELECT {due_date}, COALESCE({status}, 'Active'), {loans}, {outstanding}
+        WHERE {where}
+        ON CONFLICT (due_date, loan_status) DO UPDATE SET
+            loan_count = loan_count + excluded.loan_count,
+            outstanding = outstanding + excluded.outstanding;
+    """
+
+
+def _loan_balance_delta(loan_id, amount):
+    # The loan's current (due_date, status) row gets amount; rows of
+    # transactions without a loan are skipped
+    return _due_delta(
+        f"(SELECT due_date FROM loans WHERE loan_id = {loan_id})",
+        f"(SELECT loan_status FROM loans WHERE loan_id = {loan_id})",
+        0, amount, f"EXISTS (SELECT 1 FROM loans WHERE loan_id = {loan_id})",
+    )
+
+
+def create_rollups(conn: sqlite3.Connection):
+    """Create the rollup tables with their triggers and fill them (schema migration step)."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS portfolio_monthly (
+            month TEXT NOT NULL,
+            transaction_type TEXT NOT NULL,
+            charges REAL NOT NULL DEFAULT 0,
+            credits REAL NOT NULL DEFAULT 0,
+            transaction_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (month, transaction_type)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS portfolio_due (
+            due_date TEXT NOT NULL,
+            loan_status TEXT NOT NULL,
+            loan_count INTEGER NOT NULL DEFAULT 0,
+            outstanding REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (due_date, loan_status)
+        )
+    """)
+
+    # A row here pauses the insert-driven triggers for the writer's own
+    # transaction; see deferred_rollups()
+    conn.execute("CREATE TABLE IF NOT EXISTS portfolio_suspended (suspended INTEGER)")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_portfolio_insert AFTER INSERT ON transactions
+        WHEN NOT EXISTS (SELECT 1 FROM portfolio_suspended)
+        BEGIN
+            {_monthly_delta("NEW", 1)}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_portfolio_delete AFTER DELETE ON transactions
+        BEGIN
+            {_monthly_delta("OLD", -1)}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_portfolio_update
+        AFTER UPDATE OF loan_id, date, amount, transaction_type ON transactions
+        BEGIN
+            {_monthly_delta("OLD", -1)}
+            {_monthly_delta("NEW", 1)}
+        END
+    """)
+
+    # Balances reach portfolio_due through loan_balances, which the
+    # transactions triggers already keep as per-loan deltas
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_loan_balances_portfolio_insert AFTER INSERT ON loan_balances
+        WHEN NOT EXISTS (SELECT 1 FROM portfolio_suspended)
+        BEGIN
+            {_loan_balance_delta("NEW.loan_id", "NEW.balance")}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_loan_balances_portfolio_delete AFTER DELETE ON loan_balances
+        BEGIN
+            {_loan_balance_delta("OLD.loan_id", "-OLD.balance")}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_loan_balances_portfolio_update AFTER UPDATE OF balance ON loan_balances
+        WHEN NEW.balance IS NOT OLD.balance AND NOT EXISTS (SELECT 1 FROM portfolio_suspended)
+        BEGIN
+            {_loan_balance_delta("NEW.loan_id", "NEW.balance - OLD.balance")}
+        END
+    """)
+
+    balance = "COALESCE((SELECT balance FROM loan_balances WHERE loan_id = {}.loan_id), 0)"
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_loans_portfolio_insert AFTER INSERT ON loans
+        BEGIN
+            {_due_delta("NEW.due_date", "NEW.loan_status", 1, balance.format("NEW"))}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_loans_portfolio_delete AFTER DELETE ON loans
+        BEGIN
+            {_due_delta("OLD.due_date", "OLD.loan_status", -1, "-" + balance.format("OLD"))}
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_loans_portfolio_update AFTER UPDATE OF due_date, loan_status ON loans
+        WHEN NEW.due_date IS NOT OLD.due_date OR NEW.loan_status IS NOT OLD.loan_status
+        BEGIN
+            {_due_delta("OLD.due_date", "OLD.loan_status", -1, "-" + balance.format("OLD"))}
+            {_due_delta("NEW.due_date", "NEW.loan_status", 1, balance.format("NEW"))}
+        END
+    """)
+
+    rebuild_rollups(conn, commit=False)
+
+
+def rebuild_rollups(conn: sqlite3.Connection, commit=True):
+    """Recompute both rollup tables from transactions, loans and loan_balances."""
+    conn.execute("DELETE FROM portfolio_monthly")
+    conn.execute(f"""
+        INSERT INTO portfolio_monthly (month, transaction_type, charges, credits, transaction_count)
+        {MONTHLY_QUERY}
+    """)
+    conn.execute("DELETE FROM portfolio_due")
+    conn.execute(f"INSERT INTO portfolio_due (due_date, loan_status, loan_count, outstanding) {DUE_QUERY}")
+    if commit:
+        conn.commit()
+
+
+@contextmanager
+def deferred_rollups(conn: sqlite3.Connection):
+    """Apply the transactions inserted inside the block to the rollups in one pass at the end.
+
+    For bulk inserts only, inside the caller's write transaction (updates and
+    deletes made inside the block would be missed). The suspension row is
+    removed before the transaction ends, so no other connection sees it.
+    """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'portfolio_suspended'").fetchone() is None:
+        yield
+        return
+    last_id = conn.execute("SELECT COALESCE(MAX(transaction_id), 0) FROM transactions").fetchone()[0]
+    conn.execute("INSERT INTO portfolio_suspended VALUES (1)")
+    try:
+        yield
+    finally:
+        conn.execute("DELETE FROM portfolio_suspended")
+    conn.execute(f"""
+        INSERT INTO portfolio_monthly (month, transaction_type, charges, credits, transaction_count)
+        {MONTHLY_QUERY.replace("WHERE", "WHERE transaction_id > ? AND")}
+        ON CONFLICT (month, transaction_type) DO UPDATE SET
+            charges = charges + excluded.charges,
+            credits = credits + excluded.credits,
+            transaction_count = transaction_count + excluded.transaction_count
+    """, (last_id,))
+    conn.execute("""
+        INSERT INTO portfolio_due (due_date, loan_status, loan_count, outstanding)
+        SELECT l.due_date, COALESCE(l.loan_status, 'Active'), 0, SUM(t.amount)
+        FROM transactions t
+        JOIN loans l ON l.loan_id = t.loan_id
+        WHERE t.transaction_id > ?
+        GROUP BY l.due_date, COALESCE(l.loan_status, 'Active')
+        ON CONFLICT (due_date, loan_status) DO UPDATE SET
+            outstanding = outstanding + excluded.outstanding
+    """, (last_id,))
+
+
+def find_drift(conn: sqlite3.Connection):
+    """Rollup keys whose stored totals no longer match the source tables."""
+    monthly = conn.execute(f"""
+        SELECT 'portfolio_monthly', s.month || ' ' || s.transaction_type
+        FROM ({MONTHLY_QUERY}) s
+        LEFT JOIN portfolio_monthly p ON p.month = s.month AND p.transaction_type = s.transaction_type
+        WHERE p.month IS NULL
+           OR ABS(s.charges - p.charges) > :tolerance
+           OR ABS(s.credits - p.credits) > :tolerance
+           OR s.transaction_count != p.transaction_count
+        UNION ALL
+        SELECT 'portfolio_monthly', p.month || ' ' || p.transaction_type
+        FROM portfolio_monthly p
+        LEFT JOIN ({MONTHLY_QUERY}) s ON s.month = p.month AND s.transaction_type = p.transaction_type
+        WHERE s.month IS NULL AND p.transaction_count != 0
+    """, {"tolerance": DRIFT_TOLERANCE}).fetchall()
+    due = conn.execute(f"""
+        SELECT 'portfolio_due', s.due_date || ' ' || s.loan_status
+        FROM ({DUE_QUERY}) s
+        LEFT JOIN portfolio_due p ON p.due_date = s.due_date AND p.loan_status = s.loan_status
+        WHERE p.due_date IS NULL
+           OR ABS(s.outstanding - p.outstanding) > :tolerance
+           OR s.loan_count != p.loan_count
+        UNION ALL
+        SELECT 'portfolio_due', p.due_date || ' ' || p.loan_status
+        FROM portfolio_due p
+        LEFT JOIN ({DUE_QUERY}) s ON s.due_date = p.due_date AND s.loan_status = p.loan_status
+        WHERE s.due_date IS NULL AND p.loan_count != 0
+    """, {"tolerance": DRIFT_TOLERANCE}).fetchall()
+    return monthly + due
+
+
+# Reads
+
+def outstanding_by_status(conn: sqlite3.Connection):
+    """DataFrame of loan_status, loans and outstanding balance."""
+    return pd.read_sql("""
+        SELECT loan_status, SUM(loan_count) AS loans, ROUND(SUM(outstanding), 2) AS outstanding
+        FROM portfolio_due
+        GROUP BY loan_status
+        HAVING SUM(loan_count) > 0
+        ORDER BY loan_status
+    """, conn)
+
+
+def aging(conn: sqlite3.Connection, as_of=None):
+    """Open loans and their outstanding balance per days-past-due bucket as of as_of (default today)."""
+    as_of = (as_of or datetime.today().date()).strftime("%Y-%m-%d")
+    cases = []
+    for label, low, high in AGING_BUCKETS:
+        bounds = [f"days_past_due >= {low}"] if low is not None else []
+        bounds += [f"days_past_due <= {high}"] if high is not None else []
+        cases.append(f"WHEN {' AND '.join(bounds)} THEN '{label}'")
+    placeholders = ", ".join("?" * len(OPEN_STATUSES))
+    rows = pd.read_sql(f"""
+        SELECT CASE {" ".join(cases)} END AS bucket, SUM(loan_count) AS loans, ROUND(SUM(outstanding), 2) AS outstanding
+        FROM (
+            SELECT CAST(julianday(?) - julianday(due_date) AS INTEGER) AS days_past_due, loan_count, outstanding
+            FROM portfolio_due
+            WHERE loan_status IN ({placeholders}) AND loan_count > 0
+        )
+        GROUP BY bucket
+    """, conn, params=[as_of, *OPEN_STATUSES])
+    # Every bucket, in order, even when empty
+    buckets = pd.DataFrame({"bucket": [label for label, _, _ in AGING_BUCKETS]})
+    aged = buckets.merge(rows, on="bucket", how="left").fillna({"loans": 0, "outstanding": 0.0})
+    return aged.astype({"loans": int})
+
+
+def monthly_flows(conn: sqlite3.Connection, months=12):
+    """The last months calendar months with disbursed, repaid, fee_income,
+    finance_charge_income and transactions, oldest first.
+    """
+    def total(column, types):
+        quoted = ", ".join(f"'{transaction_type}'" for transaction_type in types)
+        return f"SUM(CASE WHEN transaction_type IN ({quoted}) THEN {column} ELSE 0 END)"
+
+    return pd.read_sql(f"""
+        SELECT * FROM (
+            SELECT month,
+                   ROUND({total("charges", DISBURSAL_TYPES)}, 2) AS disbursed,
+                   ROUND(SUM(credits), 2) AS repaid,
+                   ROUND({total("charges", FEE_TYPES)}, 2) AS fee_income,
+                   ROUND({total("charges", FINANCE_CHARGE_TYPES)}, 2) AS finance_charge_income,
+                   SUM(transaction_count) AS transactions
+            FROM portfolio_monthly
+            GROUP BY month
+            HAVING SUM(transaction_count) > 0
+            ORDER BY month DESC
+            LIMIT ?
+        )
+        ORDER BY month
+    """, conn, params=(months,))
+
+
+def portfolio_summary(conn: sqlite3.Connection, as_of=None, months=12):
+    """Everything the dashboard shows, as a dict of DataFrames."""
+    return {
+        "by_status": outstanding_by_status(conn),
+        "aging": aging(conn, as_of),
+        "monthly": monthly_flows(conn, months),
+    }
+
+
+def main(argv=None):
+    import schema
+
+    parser = argparse.ArgumentParser(description="Portfolio analytics from the rollup tables.")
+    parser.add_argument("command", choices=["summary", "check", "rebuild"])
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--as-of", type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(),
+                        help="Aging date YYYY-MM-DD (default: today)")
+    parser.add_argument("--months", type=int, default=12, help="Months of flows to show")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    schema.migrate(conn)
+    if args.command == "rebuild":
+        rebuild_rollups(conn)
+        print("Portfolio rollups rebuilt")
+        return 0
+    if args.command == "check":
+        drift = find_drift(conn)
+        if drift:
+            print(f"{len(drift)} rollup rows out of sync: {', '.join(f'{table} {key}' for table, key in drift[:20])}")
+            print("Run 'python portfolio.py rebuild' to reconcile.")
+            return 1
+        print("Portfolio rollups are in sync")
+        return 0
+
+    with pd.option_context("display.width", 200):
+        for title, frame in portfolio_summary(conn, args.as_of, args.months).items():
+            print(f"\n{title}\n{frame.to_string(index=False)}")
+    conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
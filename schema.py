@@ -0,0 +1,373 @@
+"""Versioned schema for loan_statements_v2.db.
+
+The applied version is kept in PRAGMA user_version. migrate() is cheap when
+the database is current (one PRAGMA read), so the apps can call it on every
+Streamlit rerun instead of repeating CREATE TABLE / ALTER TABLE checks.
+New schema changes go at the end of MIGRATIONS; never edit an applied one.
+"""
+import sqlite3
+
+import amortization
+import loan_balances
+import portfolio
+import search_index
+
+
+def _create_base_tables(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS customers (
+            customer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_name TEXT NOT NULL,
+            email TEXT,
+            address TEXT,
+            company_registration TEXT
+        )
+    """)
+
+    # Databases created by the first app version predate these columns
+    columns = [column[1] for column in conn.execute("PRAGMA table_info(customers)")]
+    for column in ("email", "address", "company_registration"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE customers ADD COLUMN {column} TEXT")
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS loans (
+            loan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id INTEGER,
+            account_number TEXT NOT NULL,
+            loan_amount REAL NOT NULL,
+            loan_date TEXT NOT NULL,
+            due_date TEXT NOT NULL,
+            loan_status TEXT DEFAULT 'Active',
+            interest_rate REAL DEFAULT 0.23,
+            admin_fee REAL DEFAULT 500.00,
+            payment_frequency TEXT,
+            collateral TEXT,
+            disbursement_method TEXT,
+            FOREIGN KEY (customer_id) REFERENCES customers(customer_id)
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS transactions (
+            transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            loan_id INTEGER,
+            date TEXT NOT NULL,
+            description TEXT NOT NULL,
+            amount REAL NOT NULL,
+            transaction_type TEXT NOT NULL,
+            payment_method TEXT NOT NULL,
+            FOREIGN KEY (loan_id) REFERENCES loans(loan_id)
+        )
+    """)
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS statement_logs (
+            log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id INTEGER,
+            loan_id INTEGER,
+            generated_at TEXT,
+            filename TEXT,
+            FOREIGN KEY (customer_id) REFERENCES customers(customer_id),
+            FOREIGN KEY (loan_id) REFERENCES loans(loan_id)
+        )
+    """)
+
+
+def _repair_numpy_int_keys(conn):
+    # Older app versions bound numpy.int64 ids, which sqlite3 stored as 8-byte
+    # BLOBs that never match an INTEGER key in a join or index lookup.
+    for table, column in (
+        ("loans", "customer_id"),
+        ("transactions", "loan_id"),
+        ("statement_logs", "customer_id"),
+        ("statement_logs", "loan_id"),
+    ):
+        rows = conn.execute(
+            f"SELECT rowid, {column} FROM {table} WHERE typeof({column}) = 'blob' AND length({column}) = 8"
+        ).fetchall()
+        conn.executemany(
+            f"UPDATE {table} SET {column} = ? WHERE rowid = ?",
+            [(int.from_bytes(value, "little", signed=True), rowid) for rowid, value in rows],
+        )
+
+
+def _add_access_path_indexes(conn):
+    # transactions: "WHERE loan_id = ? ORDER BY date" and per-loan SUM(amount)
+    # are answered from the index alone
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_loan_date ON transactions (loan_id, date, amount)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_loans_customer ON loans (customer_id, loan_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_loans_status_due ON loans (loan_status, due_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_statement_logs_loan ON statement_logs (loan_id, generated_at)")
+    conn.execute("ANALYZE")
+
+
+def _add_loan_balances(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS loan_balances (
+            loan_id INTEGER PRIMARY KEY,
+            balance REAL NOT NULL DEFAULT 0,
+            total_charges REAL NOT NULL DEFAULT 0,
+            total_credits REAL NOT NULL DEFAULT 0,
+            last_transaction_date TEXT,
+            transaction_count INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (loan_id) REFERENCES loans(loan_id)
+        )
+    """)
+
+    # Every write to transactions is applied to the summary as a delta, so the
+    # cost per write is constant regardless of the loan's history length.
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_balance_insert
+        AFTER INSERT ON transactions
+        WHEN typeof(NEW.loan_id) = 'integer'
+        BEGIN
+            INSERT INTO loan_balances (loan_id, balance, total_charges, total_credits, last_transaction_date, transaction_count)
+            VALUES (NEW.loan_id, NEW.amount, MAX(NEW.amount, 0), MAX(-NEW.amount, 0), NEW.date, 1)
+            ON CONFLICT (loan_id) DO UPDATE SET
+                balance = balance + excluded.balance,
+                total_charges = total_charges + excluded.total_charges,
+                total_credits = total_credits + excluded.total_credits,
+                last_transaction_date = MAX(COALESCE(last_transaction_date, ''), excluded.last_transaction_date),
+                transaction_count = transaction_count + 1;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_balance_delete
+        AFTER DELETE ON transactions
+        WHEN typeof(OLD.loan_id) = 'integer'
+        BEGIN
+            UPDATE loan_balances SET
+                balance = balance - OLD.amount,
+                total_charges = total_charges - MAX(OLD.amount, 0),
+                total_credits = total_credits - MAX(-OLD.amount, 0),
+                last_transaction_date = (SELECT MAX(date) FROM transactions WHERE loan_id = OLD.loan_id),
+                transaction_count = transaction_count - 1
+            WHERE loan_id = OLD.loan_id;
+        END
+    """)
+    # An update is a delete of the old row followed by an insert of the new one
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_balance_update
+        AFTER UPDATE OF loan_id, date, amount ON transactions
+        BEGIN
+            UPDATE loan_balances SET
+                balance = balance - OLD.amount,
+                total_charges = total_charges - MAX(OLD.amount, 0),
+                total_credits = total_credits - MAX(-OLD.amount, 0),
+                last_transaction_date = (SELECT MAX(date) FROM transactions WHERE loan_id = OLD.loan_id),
+                transaction_count = transaction_count - 1
+            WHERE loan_id = OLD.loan_id AND typeof(OLD.loan_id) = 'integer';
+
+            INSERT INTO loan_balances (loan_id, balance, total_charges, total_credits, last_transaction_date, transaction_count)
+            SELECT NEW.loan_id, NEW.amount, MAX(NEW.amount, 0), MAX(-NEW.amount, 0), NEW.date, 1
+            WHERE typeof(NEW.loan_id) = 'integer'
+            ON CONFLICT (loan_id) DO UPDATE SET
+                balance = balance + excluded.balance,
+                total_charges = total_charges + excluded.total_charges,
+                total_credits = total_credits + excluded.total_credits,
+                last_transaction_date = MAX(COALESCE(last_transaction_date, ''), excluded.last_transaction_date),
+                transaction_count = transaction_count + 1;
+        END
+    """)
+
+    loan_balances.rebuild_loan_balances(conn, commit=False)
+
+
+def _add_statement_content_hash(conn):
+    # Archive key of the PDF a log entry refers to (see statement_archive.py)
+    conn.execute("ALTER TABLE statement_logs ADD COLUMN content_hash TEXT")
+
+
+def _add_statement_jobs(conn):
+    # Background render queue for the app (see statement_jobs.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS statement_jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id INTEGER NOT NULL,
+            loan_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            requested_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT,
+            filename TEXT,
+            content_hash TEXT,
+            reused INTEGER,
+            error TEXT,
+            FOREIGN KEY (customer_id) REFERENCES customers(customer_id),
+            FOREIGN KEY (loan_id) REFERENCES loans(loan_id)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_statement_jobs_status ON statement_jobs (status, job_id)")
+
+
+def _add_search_index(conn):
+    # SQLite builds without FTS5 skip this; search_index.search() then falls
+    # back to LIKE queries
+    if search_index.fts5_available(conn):
+        search_index.create_index(conn)
+
+
+def _add_statement_job_periods(conn):
+    # NULL for whole-history statements
+    conn.execute("ALTER TABLE statement_jobs ADD COLUMN period_start TEXT")
+    conn.execute("ALTER TABLE statement_jobs ADD COLUMN period_end TEXT")
+
+
+def _add_consolidated_statement_jobs(conn):
+    # A consolidated job covers all of a customer's loans and has no loan_id.
+    # SQLite cannot drop NOT NULL in place, so the table is rebuilt.
+    conn.execute("""
+        CREATE TABLE statement_jobs_new (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id INTEGER NOT NULL,
+            loan_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'queued',
+            requested_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT,
+            filename TEXT,
+            content_hash TEXT,
+            reused INTEGER,
+            error TEXT,
+            period_start TEXT,
+            period_end TEXT,
+            consolidated INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (customer_id) REFERENCES customers(customer_id),
+            FOREIGN KEY (loan_id) REFERENCES loans(loan_id)
+        )
+    """)
+    conn.execute("""
+        INSERT INTO statement_jobs_new (job_id, customer_id, loan_id, status, requested_at, started_at, finished_at,
+                                        filename, content_hash, reused, error, period_start, period_end)
+        SELECT job_id, customer_id, loan_id, status, requested_at, started_at, finished_at,
+               filename, content_hash, reused, error, period_start, period_end
+        FROM statement_jobs
+    """)
+    conn.execute("DROP TABLE statement_jobs")
+    conn.execute("ALTER TABLE statement_jobs_new RENAME TO statement_jobs")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_statement_jobs_status ON statement_jobs (status, job_id)")
+
+
+def _add_portfolio_rollups(conn):
+    # Summary tables behind the analytics dashboard (see portfolio.py)
+    portfolio.create_rollups(conn)
+
+
+def _add_accruals(conn):
+    # One row per charge made by accrual.py; the key makes each run idempotent
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS accruals (
+            loan_id INTEGER NOT NULL,
+            period TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            transaction_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            run_date TEXT NOT NULL,
+            PRIMARY KEY (loan_id, period, kind),
+            FOREIGN KEY (loan_id) REFERENCES loans(loan_id),
+            FOREIGN KEY (transaction_id) REFERENCES transactions(transaction_id)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_accruals_period ON accruals (period, kind)")
+
+
+def _add_loan_schedules(conn):
+    # Expected installments per loan, written by amortization.py
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS loan_schedules (
+            loan_id INTEGER NOT NULL,
+            installment INTEGER NOT NULL,
+            due_date TEXT NOT NULL,
+            payment REAL NOT NULL,
+            principal REAL NOT NULL,
+            finance_charge REAL NOT NULL,
+            fees REAL NOT NULL,
+            balance REAL NOT NULL,
+            PRIMARY KEY (loan_id, installment),
+            FOREIGN KEY (loan_id) REFERENCES loans(loan_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_loan_schedules_due_date ON loan_schedules (due_date)")
+
+
+def _add_statement_deliveries(conn):
+    # Emails sent by statement_delivery.py; each log row points at the email that carried it
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS statement_deliveries (
+            delivery_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id INTEGER NOT NULL,
+            email TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            content_hash TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            queued_at TEXT NOT NULL,
+            sent_at TEXT,
+            error TEXT,
+            FOREIGN KEY (customer_id) REFERENCES customers(customer_id)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_statement_deliveries_status ON statement_deliveries (status, delivery_id)")
+    conn.execute("ALTER TABLE statement_logs ADD COLUMN delivery_id INTEGER REFERENCES statement_deliveries(delivery_id)")
+
+
+def _build_loan_schedules(conn):
+    # Loans booked before loan_schedules existed have no schedule; add_loan
+    # only builds one for new loans, so backfill the open ones
+    amortization.build_schedules(conn, commit=False)
+
+
+def _add_transaction_ledger_index(conn):
+    # Ledger exports read each loan's rows in (date, transaction_id) order;
+    # this index hands them over in that order so nothing has to be sorted
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_transactions_loan_date_id ON transactions (loan_id, date, transaction_id)
+    """)
+
+
+MIGRATIONS = [
+    _create_base_tables,
+    _repair_numpy_int_keys,
+    _add_access_path_indexes,
+    _add_loan_balances,
+    _add_statement_content_hash,
+    _add_statement_jobs,
+    _add_search_index,
+    _add_statement_job_periods,
+    _add_consolidated_statement_jobs,
+    _add_portfolio_rollups,
+    _add_accruals,
+    _add_loan_schedules,
+    _add_statement_deliveries,
+    _build_loan_schedules,
+    _add_transaction_ledger_index,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_version(conn: sqlite3.Connection):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection):
+    """Apply any pending migrations and return the resulting schema version."""
+    if get_version(conn) >= SCHEMA_VERSION:
+        return SCHEMA_VERSION
+
+    conn.commit()
+    # IMMEDIATE takes the write lock up front so two sessions starting at the
+    # same time cannot both apply the same step
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = get_version(conn)
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return get_version(conn)
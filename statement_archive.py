@@ -0,0 +1,216 @@
+"""Content-addressed archive of rendered statements.
+
+A statement's key is a SHA-256 of everything that goes into it: the template
+version, the statement date, the loan terms and the loan's transactions. PDFs
+are stored once per key under a two-level sharded directory
+(statement_archive/ab/cd/abcd....pdf), so asking for an unchanged statement
+again returns the stored bytes instead of re-rendering. Reuse refreshes the
+file's mtime; prune() evicts by age and then least-recently-used until the
+archive fits its size budget. put() prunes to the archive's limits every
+PRUNE_EVERY new statements, and a batch run prunes once when it finishes, so
+the archive stays bounded without a separate job.
+
+Example:
+    python statement_archive.py prune --max-mb 500 --max-age-days 365
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import instrumentation
+from statement_pdf import TEMPLATE_VERSION, render_consolidated_pdf, render_pdf
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = "statement_archive"
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_MAX_AGE_DAYS = 365
+# put() prunes once per this many new statements
+PRUNE_EVERY = 100
+
+# The transaction columns a statement is rendered from, in key order
+KEY_COLUMNS = ["date", "description", "amount"]
+
+
+def statement_key(customer_name, account_number, transactions, company_name, loan_date, loan_amount, finance_charge,
+                  admin_fee, statement_date, period=None, opening_balance=0.0):
+    header = json.dumps([
+        TEMPLATE_VERSION, statement_date.strftime("%Y-%m-%d"), customer_name, str(account_number), company_name,
+        str(loan_date), float(loan_amount), float(finance_charge), float(admin_fee),
+        [day.strftime("%Y-%m-%d") for day in period] if period else None, round(float(opening_balance), 2),
+    ])
+    digest = hashlib.sha256(header.encode("utf-8"))
+    digest.update(transactions[KEY_COLUMNS].to_csv(index=False).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def consolidated_key(customer_name, loans, statement_date):
+    header = json.dumps([
+        TEMPLATE_VERSION, "consolidated", statement_date.strftime("%Y-%m-%d"), customer_name,
+        [[str(loan['account_number']), str(loan['loan_date']), float(loan['loan_amount'])] for loan in loans],
+    ])
+    digest = hashlib.sha256(header.encode("utf-8"))
+    for loan in loans:
+        digest.update(loan['transactions'][KEY_COLUMNS].to_csv(index=False).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class StatementArchive:
+    def __init__(self, root=ARCHIVE_DIR, max_bytes=DEFAULT_MAX_BYTES, max_age_days=DEFAULT_MAX_AGE_DAYS,
+                 prune_every=PRUNE_EVERY):
+        """prune_every=None leaves pruning to the caller."""
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.prune_every = prune_every
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    def path_for(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], f"{key}.pdf")
+
+    def get(self, key):
+        """Stored PDF bytes for key, or None."""
+        path = self.path_for(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # mtime doubles as last-used time for LRU eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Pruned since the read; the bytes are still good
+            pass
+        return data
+
+    def put(self, key, data):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Same key means same bytes, so concurrent writers can race safely as
+        # long as each (thread or process) writes its own uniquely named temp file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f"{key}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if self.prune_every:
+            with self._lock:
+                self._puts += 1
+                due = self._puts % self.prune_every == 0
+            if due:
+                self.prune(self.max_bytes, self.max_age_days)
+        return path
+
+    def get_or_render(self, customer_name, account_number, transactions, company_name, loan_date, loan_amount,
+                      finance_charge, admin_fee, on_warning=logger.warning, statement_date=None, period=None,
+                      opening_balance=0.0):
+        """Return (pdf_bytes, key, reused), rendering only when the key is new.
+
+        The statement date is part of the key, so an unchanged loan is reused
+        for the rest of the day and re-dated the next.
+        """
+        statement_date = statement_date or datetime.now().date()
+        with instrumentation.trace("archive", account=account_number) as trace:
+            with instrumentation.stage("key"):
+                key = statement_key(customer_name, account_number, transactions, company_name, loan_date,
+                                    loan_amount, finance_charge, admin_fee, statement_date, period, opening_balance)
+            with instrumentation.stage("lookup"):
+                data = self.get(key)
+            trace.set(reused=data is not None)
+            if data is not None:
+                return data, key, True
+            data = render_pdf(customer_name, account_number, transactions, company_name, loan_date, loan_amount,
+                              finance_charge, admin_fee, on_warning, statement_date, period, opening_balance)
+            with instrumentation.stage("store"):
+                self.put(key, data)
+        return data, key, False
+
+    def get_or_render_consolidated(self, customer_name, loans, on_warning=logger.warning, statement_date=None):
+        """get_or_render() for a consolidated statement (see consolidated_statements.py)."""
+        statement_date = statement_date or datetime.now().date()
+        with instrumentation.trace("archive", customer=customer_name) as trace:
+            with instrumentation.stage("key"):
+                key = consolidated_key(customer_name, loans, statement_date)
+            with instrumentation.stage("lookup"):
+                data = self.get(key)
+            trace.set(reused=data is not None)
+            if data is not None:
+                return data, key, True
+            data = render_consolidated_pdf(customer_name, loans, on_warning, statement_date)
+            with instrumentation.stage("store"):
+                self.put(key, data)
+        return data, key, False
+
+    def entries(self):
+        """(path, size, mtime) for every archived PDF."""
+        if not os.path.isdir(self.root):
+            return []
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(".pdf"):
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        # Removed by a concurrent prune
+                        continue
+                    entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def prune(self, max_bytes=DEFAULT_MAX_BYTES, max_age_days=DEFAULT_MAX_AGE_DAYS):
+        """Evict statements unused for max_age_days, then least-recently-used ones
+        until the archive is within max_bytes. Returns a summary dict.
+        """
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        cutoff = time.time() - max_age_days * 86400 if max_age_days is not None else None
+        total = sum(size for _, size, _ in entries)
+        removed, freed = 0, 0
+        for path, size, mtime in entries:
+            expired = cutoff is not None and mtime < cutoff
+            if not expired and (max_bytes is None or total <= max_bytes):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+            freed += size
+        return {"kept": len(entries) - removed, "removed": removed, "freed_bytes": freed, "archive_bytes": total}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or prune the statement archive.")
+    parser.add_argument("command", choices=["stats", "prune"])
+    parser.add_argument("--dir", default=ARCHIVE_DIR, help="Archive directory")
+    parser.add_argument("--max-mb", type=float, default=DEFAULT_MAX_BYTES / (1024 * 1024), help="Size budget")
+    parser.add_argument("--max-age-days", type=float, default=DEFAULT_MAX_AGE_DAYS,
+                        help="Evict statements not used for this long")
+    args = parser.parse_args(argv)
+
+    archive = StatementArchive(args.dir)
+    if args.command == "stats":
+        entries = archive.entries()
+        total = sum(size for _, size, _ in entries)
+        print(f"{len(entries)} statements, {total / (1024 * 1024):.1f} MB in {args.dir}")
+    else:
+        result = archive.prune(int(args.max_mb * 1024 * 1024), args.max_age_days)
+        print(f"Removed {result['removed']} statements ({result['freed_bytes'] / (1024 * 1024):.1f} MB), "
+              f"{result['kept']} kept ({result['archive_bytes'] / (1024 * 1024):.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
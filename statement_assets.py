@@ -0,0 +1,77 @@
+import hashlib
+import os
+import tempfile
+
+from PIL import Image
+
+ASSET_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(ASSET_DIR, ".asset_cache")
+
+# Print resolution for logos and icons; the faint watermark gets away with less
+DEFAULT_DPI = 200
+WATERMARK_DPI = 96
+
+MM_PER_INCH = 25.4
+
+# (source path, width_mm, height_mm, dpi) -> prepared path, for this process
+_prepared = {}
+
+
+def _source_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def _target_size(size, width_mm, height_mm, dpi):
+    src_w, src_h = size
+    if height_mm is None:
+        # Same rule as pdf.image(w=...): height follows the source aspect ratio
+        height_mm = width_mm * src_h / src_w
+    w = round(width_mm / MM_PER_INCH * dpi)
+    h = round(height_mm / MM_PER_INCH * dpi)
+    # Never upscale, the PDF viewer does that for free
+    return max(1, min(w, src_w)), max(1, min(h, src_h))
+
+
+def prepare_image(path, width_mm, height_mm=None, dpi=DEFAULT_DPI):
+    """Return a copy of the image sized for its printed dimensions.
+
+    Variants are written to CACHE_DIR under the source file's hash and the
+    target pixel size, so a changed source produces a new variant and an
+    unchanged one is only resampled once across all processes.
+    """
+    key = (os.path.abspath(path), width_mm, height_mm, dpi)
+    if key in _prepared:
+        return _prepared[key]
+
+    source_hash = _source_hash(path)
+    with Image.open(path) as img:
+        size = _target_size(img.size, width_mm, height_mm, dpi)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        variant = os.path.join(CACHE_DIR, f"{stem}-{source_hash}-{size[0]}x{size[1]}.png")
+
+        if not os.path.exists(variant):
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            if img.mode not in ("RGB", "RGBA", "L", "LA"):
+                img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+            # Area averaging keeps flat, few-colour artwork (the watermark) flat and
+            # compressible; Lanczos is reserved for photographic sources
+            resample = Image.BOX if img.getcolors(256) else Image.LANCZOS
+            resized = img.resize(size, resample) if size != img.size else img.copy()
+            # Write to a unique temp name first so parallel workers, threads
+            # included, never read a partial file or share a temp file
+            fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, prefix=f"{os.path.basename(variant)}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    resized.save(f, format="PNG", optimize=True)
+                os.replace(tmp_path, variant)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+    _prepared[key] = variant
+    return variant
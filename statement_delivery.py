@@ -0,0 +1,406 @@
+"""Email rendered statements to customers.
+
+Delivery is two steps. queue_deliveries() turns statement_logs rows that
+have not been sent yet into statement_deliveries rows: one email per
+customer and file, so a consolidated statement logged against five loans is
+sent once. Each log row then points at its delivery through
+statement_logs.delivery_id. send_deliveries() sends the queued emails.
+
+Sending uses a pool of worker threads that share a fixed set of SMTP
+connections. Each connection stays open for up to MESSAGES_PER_CONNECTION
+messages, so a month-end run pays for the TCP, TLS and login handshakes a
+few times instead of once per email. A token bucket holds the whole run to
+the relay's rate limit. Transient failures are retried with exponential
+backoff: 4xx replies, dropped connections and socket errors. Permanent 5xx
+replies fail the delivery at once. Results are written back in batches from
+the calling thread, so the workers never wait on SQLite. Delivery is at
+least once: a run killed before its last batch is written resends that
+batch.
+
+Statements come from the StatementArchive by content hash, or from
+--pdf-dir by file name for runs made without an archive. Try it locally
+against debug_smtp_server.py.
+
+Example:
+    python debug_smtp_server.py --port 1025 &
+    python statement_delivery.py send --queue --since 2025-06-30 --smtp-port 1025 --rate 600
+"""
+import argparse
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime
+from email.message import EmailMessage
+
+import pandas as pd
+
+import connections
+import instrumentation
+import schema
+from statement_archive import ARCHIVE_DIR, StatementArchive
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = "loan_statements_v2.db"
+
+SMTP_HOST = os.environ.get("LOAN_STATEMENT_SMTP_HOST", "localhost")
+SMTP_PORT = int(os.environ.get("LOAN_STATEMENT_SMTP_PORT", "1025"))
+SMTP_USER = os.environ.get("LOAN_STATEMENT_SMTP_USER")
+SMTP_PASSWORD = os.environ.get("LOAN_STATEMENT_SMTP_PASSWORD")
+SENDER = os.environ.get("LOAN_STATEMENT_SENDER", "statements@localhost")
+SMTP_TIMEOUT_S = 30
+
+DEFAULT_WORKERS = 4
+DEFAULT_RATE_PER_MINUTE = 600
+MESSAGES_PER_CONNECTION = 100
+MAX_ATTEMPTS = 4
+RETRY_BACKOFF_S = 2.0
+RESULT_BATCH_SIZE = 50
+
+QUEUE_QUERY = """
+    SELECT s.customer_id, c.email, s.filename, s.content_hash, GROUP_CONCAT(s.log_id) AS log_ids
+    FROM statement_logs s
+    JOIN customers c ON c.customer_id = s.customer_id
+    WHERE s.delivery_id IS NULL AND c.email LIKE '%_@_%' {filters}
+    GROUP BY s.customer_id, c.email, s.filename, s.content_hash
+    ORDER BY MIN(s.log_id)
+"""
+
+PENDING_QUERY = """
+    SELECT d.delivery_id, d.customer_id, c.customer_name, d.email, d.filename, d.content_hash, d.attempts
+    FROM statement_deliveries d
+    JOIN customers c ON c.customer_id = d.customer_id
+    WHERE d.status IN ({statuses}) {filters}
+    ORDER BY d.delivery_id
+"""
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def queue_deliveries(conn, since=None, customer_ids=None):
+    """Create a queued delivery for every unsent statement whose customer has an email address.
+
+    since limits it to statements generated on or after that date. Returns
+    the number of deliveries queued.
+    """
+    clauses, params = [], []
+    if since:
+        clauses.append("s.generated_at >= ?")
+        params.append(str(since))
+    if customer_ids is not None:
+        customer_ids = [int(customer_id) for customer_id in customer_ids]
+        clauses.append(f"s.customer_id IN ({', '.join('?' * len(customer_ids)) or 'NULL'})")
+        params.extend(customer_ids)
+    filters = "".join(f" AND {clause}" for clause in clauses)
+
+    rows = conn.execute(QUEUE_QUERY.format(filters=filters), params).fetchall()
+    queued_at = _now()
+    links = []
+    for customer_id, email, filename, content_hash, log_ids in rows:
+        delivery_id = conn.execute("""
+            INSERT INTO statement_deliveries (customer_id, email, filename, content_hash, status, queued_at)
+            VALUES (?, ?, ?, ?, 'queued', ?)
+        """, (customer_id, email.strip(), filename, content_hash, queued_at)).lastrowid
+        links.extend((delivery_id, int(log_id)) for log_id in log_ids.split(","))
+    conn.executemany("UPDATE statement_logs SET delivery_id = ? WHERE log_id = ?", links)
+    conn.commit()
+    return len(rows)
+
+
+def is_transient(exc):
+    """Whether a send that raised exc is worth retrying."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in exc.recipients.values())
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return 400 <= exc.smtp_code < 500
+    if isinstance(exc, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(exc, smtplib.SMTPException):
+        return False
+    # Refused, reset and timed-out sockets
+    return isinstance(exc, OSError)
+
+
+class RateLimiter:
+    """Token bucket shared by all workers: at most per_minute acquisitions a minute, in bursts of up to burst."""
+
+    def __init__(self, per_minute, burst=1):
+        self.interval = 60.0 / per_minute if per_minute else 0.0
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) / self.interval)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) * self.interval
+            time.sleep(wait)
+
+
+class SMTPPool:
+    """Up to size open SMTP connections, each reused for MESSAGES_PER_CONNECTION messages."""
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, username=SMTP_USER, password=SMTP_PASSWORD, starttls=False,
+                 size=DEFAULT_WORKERS, timeout=SMTP_TIMEOUT_S):
+        self.host, self.port = host, port
+        self.username, self.password = username, password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.connects = 0
+        # Idle (smtp, messages_sent) pairs; None marks a slot with no connection open yet
+        self._idle = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(None)
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password or "")
+        self.connects += 1
+        return smtp
+
+    @contextmanager
+    def connection(self):
+        """An open connection, returned to the pool afterwards or dropped if it failed."""
+        slot = self._idle.get()
+        try:
+            if slot is None:
+                slot = (self._connect(), 0)
+            smtp, sent = slot
+            try:
+                yield smtp
+            except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+                # The server answered, so the session can carry on once reset
+                if not _reset(smtp):
+                    slot = None
+                raise
+            except BaseException:
+                _close(smtp)
+                slot = None
+                raise
+            if sent + 1 >= MESSAGES_PER_CONNECTION:
+                _close(smtp, quit=True)
+                slot = None
+            else:
+                slot = (smtp, sent + 1)
+        finally:
+            self._idle.put(slot)
+
+    def close(self):
+        while True:
+            try:
+                slot = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            if slot is not None:
+                _close(slot[0], quit=True)
+
+
+def _reset(smtp):
+    try:
+        smtp.rset()
+        return True
+    except (smtplib.SMTPException, OSError):
+        smtp.close()
+        return False
+
+
+def _close(smtp, quit=False):
+    try:
+        if quit:
+            smtp.quit()
+        else:
+            smtp.close()
+    except (smtplib.SMTPException, OSError):
+        smtp.close()
+
+
+def build_message(delivery, pdf, sender=SENDER):
+    message = EmailMessage()
+    message["From"] = sender
+    message["To"] = delivery["email"]
+    consolidated = delivery["filename"].endswith("_all_loans.pdf")
+    message["Subject"] = "Your consolidated loan statement" if consolidated else "Your loan statement"
+    message.set_content(
+        f"Dear {delivery['customer_name']},\n\n"
+        f"Please find your {'consolidated ' if consolidated else ''}loan statement attached.\n\n"
+        "Kind regards,\nAccounts\n"
+    )
+    message.add_attachment(pdf, maintype="application", subtype="pdf", filename=delivery["filename"])
+    return message
+
+
+class StatementMailer:
+    """Sends deliveries through an SMTPPool, with retries, under a shared RateLimiter."""
+
+    def __init__(self, pool: SMTPPool, archive=None, pdf_dir=None, rate_per_minute=DEFAULT_RATE_PER_MINUTE,
+                 sender=SENDER, max_attempts=MAX_ATTEMPTS, backoff=RETRY_BACKOFF_S):
+        self.pool = pool
+        self.archive = archive
+        self.pdf_dir = pdf_dir
+        self.limiter = RateLimiter(rate_per_minute)
+        self.sender = sender
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    def load_pdf(self, delivery):
+        data = None
+        if self.archive is not None and delivery["content_hash"]:
+            data = self.archive.get(delivery["content_hash"])
+        if data is None and self.pdf_dir:
+            try:
+                with open(os.path.join(self.pdf_dir, delivery["filename"]), "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                pass
+        if data is None:
+            raise FileNotFoundError(f"{delivery['filename']} is neither in the archive nor in the PDF directory")
+        return data
+
+    def send(self, delivery):
+        """Deliver one statement; returns (status, attempts, error)."""
+        attempts = int(delivery.get("attempts") or 0)
+        try:
+            message = build_message(delivery, self.load_pdf(delivery), self.sender)
+        except Exception as exc:
+            return "failed", attempts, f"{type(exc).__name__}: {exc}"
+        for attempt in range(1, self.max_attempts + 1):
+            self.limiter.acquire()
+            attempts += 1
+            try:
+                with instrumentation.stage("smtp_send"):
+                    with self.pool.connection() as smtp:
+                        smtp.send_message(message)
+                return "sent", attempts, None
+            except Exception as exc:
+                error = f"{type(exc).__name__}: {exc}"
+                if not is_transient(exc) or attempt == self.max_attempts:
+                    return "failed", attempts, error
+                logger.info("Delivery %s attempt %s failed, retrying: %s", delivery["delivery_id"], attempt, error)
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+
+def send_deliveries(conn, mailer: StatementMailer, workers=DEFAULT_WORKERS, retry_failed=False, since=None,
+                    customer_ids=None):
+    """Send every queued delivery (and failed ones with retry_failed) and record the outcome.
+
+    since and customer_ids narrow it the same way as in queue_deliveries():
+    to deliveries carrying a statement generated on or after since, and to
+    those customers. Returns a summary dict with sent, failed, seconds and
+    per_minute.
+    """
+    statuses = ("queued", "failed") if retry_failed else ("queued",)
+    clauses, params = [], list(statuses)
+    if since:
+        clauses.append("d.delivery_id IN (SELECT delivery_id FROM statement_logs WHERE generated_at >= ?)")
+        params.append(str(since))
+    if customer_ids is not None:
+        customer_ids = [int(customer_id) for customer_id in customer_ids]
+        clauses.append(f"d.customer_id IN ({', '.join('?' * len(customer_ids)) or 'NULL'})")
+        params.extend(customer_ids)
+    filters = "".join(f" AND {clause}" for clause in clauses)
+    pending = pd.read_sql(PENDING_QUERY.format(statuses=", ".join("?" * len(statuses)), filters=filters), conn,
+                          params=params)
+    start = time.perf_counter()
+    counts = {"sent": 0, "failed": 0}
+    results = []
+
+    def flush():
+        conn.executemany("""
+            UPDATE statement_deliveries SET status = ?, attempts = ?, error = ?, sent_at = ? WHERE delivery_id = ?
+        """, results)
+        conn.commit()
+        results.clear()
+
+    with instrumentation.trace("send_deliveries", deliveries=len(pending)):
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="statement-mail") as pool:
+            futures = {pool.submit(mailer.send, delivery): delivery["delivery_id"]
+                       for delivery in pending.to_dict("records")}
+            for future in as_completed(futures):
+                status, attempts, error = future.result()
+                counts[status] += 1
+                results.append((status, attempts, error, _now() if status == "sent" else None, futures[future]))
+                if len(results) >= RESULT_BATCH_SIZE:
+                    flush()
+        flush()
+
+    elapsed = time.perf_counter() - start
+    return {**counts, "seconds": elapsed, "per_minute": 60 * len(pending) / elapsed if elapsed else 0.0}
+
+
+def delivery_status(conn, since=None):
+    """Deliveries per status, optionally only those queued on or after since."""
+    return pd.read_sql("""
+        SELECT status, COUNT(*) AS deliveries, SUM(attempts) AS attempts, MAX(sent_at) AS last_sent
+        FROM statement_deliveries
+        WHERE queued_at >= ?
+        GROUP BY status
+    """, conn, params=(str(since or ""),))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Email rendered statements to customers.")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    queue_parser = commands.add_parser("queue", help="Queue unsent statements for delivery")
+    send_parser = commands.add_parser("send", help="Send queued deliveries")
+    for command in (queue_parser, send_parser):
+        command.add_argument("--since", help="Only statements generated on or after YYYY-MM-DD")
+        command.add_argument("--customer", type=int, action="append", help="Only this customer id (repeatable)")
+    send_parser.add_argument("--queue", action="store_true", help="Queue unsent statements first")
+    send_parser.add_argument("--retry-failed", action="store_true", help="Also resend deliveries that failed")
+    send_parser.add_argument("--archive", default=ARCHIVE_DIR, help="Statement archive to read PDFs from")
+    send_parser.add_argument("--pdf-dir", help="Directory of statements rendered without an archive")
+    send_parser.add_argument("--smtp-host", default=SMTP_HOST)
+    send_parser.add_argument("--smtp-port", type=int, default=SMTP_PORT)
+    send_parser.add_argument("--smtp-user", default=SMTP_USER, help="Password from LOAN_STATEMENT_SMTP_PASSWORD")
+    send_parser.add_argument("--starttls", action="store_true")
+    send_parser.add_argument("--sender", default=SENDER)
+    send_parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Concurrent senders and connections")
+    send_parser.add_argument("--rate", type=int, default=DEFAULT_RATE_PER_MINUTE, help="Emails per minute, 0 for no limit")
+    status_parser = commands.add_parser("status", help="Deliveries per status")
+    status_parser.add_argument("--since", help="Only deliveries queued on or after YYYY-MM-DD")
+    args = parser.parse_args(argv)
+
+    conn = connections.connect(args.db)
+    schema.migrate(conn)
+    if args.command == "status":
+        print(delivery_status(conn, args.since).to_string(index=False))
+    elif args.command == "queue" or args.queue:
+        queued = queue_deliveries(conn, args.since, args.customer)
+        print(f"Queued {queued} deliveries")
+    if args.command == "send":
+        pool = SMTPPool(args.smtp_host, args.smtp_port, args.smtp_user, SMTP_PASSWORD, args.starttls, args.workers)
+        mailer = StatementMailer(pool, StatementArchive(args.archive), args.pdf_dir, args.rate, args.sender)
+        try:
+            result = send_deliveries(conn, mailer, args.workers, args.retry_failed, args.since, args.customer)
+        finally:
+            pool.close()
+        print(f"Sent {result['sent']}, failed {result['failed']} in {result['seconds']:.1f}s "
+              f"({result['per_minute']:.0f}/min over {pool.connects} connections)")
+    conn.close()
+    # Non-zero so a scheduler notices deliveries left failed
+    return 1 if args.command == "send" and result['failed'] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
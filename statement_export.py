@@ -0,0 +1,318 @@
+"""Streaming spreadsheet export of statements and ledger extracts.
+
+Rows are read from loan_statements_v2.db with a cursor in fixed-size chunks,
+given their charge/credit split and running balance per loan, and appended to
+the output before the next chunk is fetched: XLSX through openpyxl's
+write-only workbook, CSV through pandas, Parquet through a pyarrow
+ParquetWriter. Memory therefore stays at one chunk whatever the size of the
+extract. Rows come out in (loan_id, date, transaction_id) order, straight off
+idx_transactions_loan_date_id with no sort step, whatever the filters: a
+loan or customer filter seeks to those loans, and a date range is checked
+against each index entry as it is scanned. Each loan's running balance
+therefore only needs the previous row's; with a start date, every loan opens
+with its balance brought forward from one aggregate query.
+
+openpyxl writes a few thousand rows a second, so multi-million-row month-end
+extracts are best taken as CSV or Parquet; XLSX output rolls over to a new
+sheet at Excel's row limit.
+
+Example:
+    python statement_export.py ledger_2025-01.xlsx --from 2025-01-01 --to 2025-01-31
+"""
+import argparse
+import csv
+import io
+import os
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import connections
+import schema
+
+DB_PATH = "loan_statements_v2.db"
+CHUNK_SIZE = 50_000
+FORMATS = ("xlsx", "csv", "parquet")
+
+COLUMNS = [
+    "customer_id", "customer_name", "loan_id", "account_number", "transaction_id", "date", "description",
+    "transaction_type", "payment_method", "charge", "credit", "balance",
+]
+
+# CROSS JOIN keeps transactions as the outer loop and INDEXED BY holds it to
+# the ledger index, so the planner never swaps in idx_transactions_date for a
+# date range and then sorts the whole extract (in memory, with temp_store)
+EXPORT_QUERY = """
+    SELECT l.customer_id, c.customer_name, t.loan_id, l.account_number, t.transaction_id, t.date, t.description,
+           t.transaction_type, t.payment_method, t.amount
+    FROM transactions t INDEXED BY idx_transactions_loan_date_id
+    CROSS JOIN loans l ON l.loan_id = t.loan_id
+    LEFT JOIN customers c ON c.customer_id = l.customer_id
+    WHERE 1 = 1 {filters}
+    ORDER BY t.loan_id, t.date, t.transaction_id
+"""
+TEXT_COLUMNS = ["customer_name", "account_number", "date", "description", "transaction_type", "payment_method"]
+
+OPENING_BALANCES_QUERY = """
+    SELECT t.loan_id, SUM(t.amount)
+    FROM transactions t
+    JOIN loans l ON l.loan_id = t.loan_id
+    WHERE t.date < ? {filters}
+    GROUP BY t.loan_id
+"""
+
+# Excel display widths, in COLUMNS order
+XLSX_WIDTHS = [11, 32, 8, 14, 13, 11, 34, 16, 16, 14, 14, 14]
+# Excel shows the grouping comma as the reader's locale separator ("1 234,56R" in en-ZA)
+RAND_FORMAT = '#,##0.00"R"'
+# Excel's sheet limit less the header row; longer extracts continue on "Ledger 2", ...
+XLSX_MAX_ROWS = 1_048_575
+
+
+class ExportError(ValueError):
+    pass
+
+
+def export_format(target, fmt=None):
+    """fmt, or the format named by target's file extension."""
+    name = fmt or os.path.splitext(str(getattr(target, "name", target)))[1].lstrip(".").lower()
+    if name not in FORMATS:
+        raise ExportError(f"Unsupported export format: {name or target}. Use one of {', '.join(FORMATS)}.")
+    return name
+
+
+def build_filters(loan_ids=None, customer_id=None):
+    clauses, params = [], []
+    if loan_ids is not None:
+        loan_ids = [int(loan_id) for loan_id in loan_ids]
+        clauses.append(f"t.loan_id IN ({', '.join('?' * len(loan_ids)) or 'NULL'})")
+        params.extend(loan_ids)
+    if customer_id is not None:
+        # On t.loan_id rather than l.customer_id, so the export scan can seek to the customer's loans
+        clauses.append("t.loan_id IN (SELECT loan_id FROM loans WHERE customer_id = ?)")
+        params.append(int(customer_id))
+    return "".join(f" AND {clause}" for clause in clauses), params
+
+
+def iter_ledger_chunks(conn: sqlite3.Connection, loan_ids=None, customer_id=None, date_from=None, date_to=None,
+                       chunk_size=CHUNK_SIZE):
+    """Yield DataFrames of COLUMNS, chunk_size rows at a time, balances running per loan."""
+    filters, params = build_filters(loan_ids, customer_id)
+    opening = {}
+    if date_from:
+        opening = dict(conn.execute(OPENING_BALANCES_QUERY.format(filters=filters), [str(date_from), *params]))
+        filters += " AND t.date >= ?"
+        params.append(str(date_from))
+    if date_to:
+        filters += " AND t.date <= ?"
+        params.append(str(date_to))
+
+    cursor = conn.execute(EXPORT_QUERY.format(filters=filters), params)
+    names = [column[0] for column in cursor.description]
+    last_loan, last_balance = None, 0.0
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        chunk = pd.DataFrame.from_records(rows, columns=names)
+        amount = chunk.pop("amount").astype(float)
+        loan = chunk["loan_id"]
+        # Each loan starts from its brought-forward balance; a loan continued
+        # from the previous chunk starts from where that chunk left it
+        first = loan.ne(loan.shift()).to_numpy()
+        base = np.where(first, loan.map(opening).fillna(0.0).to_numpy(dtype=float), 0.0)
+        if loan.iloc[0] == last_loan:
+            base[0] = last_balance
+        balance = (amount + base).groupby(loan.to_numpy()).cumsum()
+        last_loan, last_balance = loan.iloc[-1], float(balance.iloc[-1])
+        chunk["balance"] = balance.round(2)
+        chunk["charge"] = amount.clip(lower=0).round(2)
+        chunk["credit"] = (-amount).clip(lower=0).round(2)
+        yield chunk[COLUMNS]
+
+
+class _XlsxWriter:
+    def __init__(self, target, sheet_title):
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font
+
+        self.target = target
+        self.sheet_title = sheet_title
+        self.cell = WriteOnlyCell
+        self.bold = Font(bold=True)
+        # Write-only: rows are serialised to a temp file as they are appended
+        self.workbook = Workbook(write_only=True)
+        self.sheets = 0
+        self._new_sheet()
+
+    def _new_sheet(self):
+        from openpyxl.utils import get_column_letter
+
+        self.sheets += 1
+        title = self.sheet_title if self.sheets == 1 else f"{self.sheet_title} {self.sheets}"
+        self.sheet = self.workbook.create_sheet(title)
+        for index, width in enumerate(XLSX_WIDTHS, start=1):
+            self.sheet.column_dimensions[get_column_letter(index)].width = width
+        self.sheet.freeze_panes = "A2"
+        header = []
+        for name in COLUMNS:
+            cell = self.cell(self.sheet, value=name.replace("_", " ").title())
+            cell.font = self.bold
+            header.append(cell)
+        self.sheet.append(header)
+        self.rows = 0
+
+    def write(self, chunk):
+        from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+        chunk = chunk.copy()
+        for column in TEXT_COLUMNS:
+            # Control characters are invalid in the XML openpyxl writes; NULLs become empty cells
+            text = chunk[column].astype("string").str.replace(ILLEGAL_CHARACTERS_RE, "", regex=True)
+            chunk[column] = text.astype(object).where(text.notna(), None)
+        money = len(COLUMNS) - 3
+        for row in chunk.itertuples(index=False, name=None):
+            if self.rows == XLSX_MAX_ROWS:
+                self._new_sheet()
+            cells = list(row[:money])
+            for value in row[money:]:
+                cell = self.cell(self.sheet, value=value)
+                cell.number_format = RAND_FORMAT
+                cells.append(cell)
+            self.sheet.append(cells)
+            self.rows += 1
+
+    def close(self):
+        self.workbook.save(self.target)
+
+
+class _CsvWriter:
+    def __init__(self, target):
+        self.target = target
+        self.header = True
+        if isinstance(target, (str, os.PathLike)):
+            self.file = open(target, "w", newline="", encoding="utf-8")
+        else:
+            self.file = io.TextIOWrapper(target, encoding="utf-8", newline="", write_through=True)
+
+    def write(self, chunk):
+        chunk.to_csv(self.file, header=self.header, index=False, quoting=csv.QUOTE_MINIMAL)
+        self.header = False
+
+    def close(self):
+        if self.header:
+            self.file.write(",".join(COLUMNS) + "\n")
+        if isinstance(self.target, (str, os.PathLike)):
+            self.file.close()
+        else:
+            # Leave the caller's binary stream open
+            self.file.flush()
+            self.file.detach()
+
+
+class _ParquetWriter:
+    def __init__(self, target):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema([
+            ("customer_id", pa.int64()), ("customer_name", pa.string()), ("loan_id", pa.int64()),
+            ("account_number", pa.string()), ("transaction_id", pa.int64()), ("date", pa.string()),
+            ("description", pa.string()), ("transaction_type", pa.string()), ("payment_method", pa.string()),
+            ("charge", pa.float64()), ("credit", pa.float64()), ("balance", pa.float64()),
+        ])
+        self.writer = pq.ParquetWriter(target, self.schema)
+
+    def write(self, chunk):
+        self.writer.write_table(self.pa.Table.from_pandas(chunk, schema=self.schema, preserve_index=False))
+
+    def close(self):
+        self.writer.close()
+
+
+def _open_writer(fmt, target, sheet_title):
+    if fmt == "xlsx":
+        return _XlsxWriter(target, sheet_title)
+    if fmt == "csv":
+        return _CsvWriter(target)
+    return _ParquetWriter(target)
+
+
+def export_ledger(conn: sqlite3.Connection, target, fmt=None, loan_ids=None, customer_id=None, date_from=None,
+                  date_to=None, chunk_size=CHUNK_SIZE, sheet_title="Ledger"):
+    """Stream the selected transactions to target (a path or a binary file object).
+
+    fmt defaults to target's extension. Paths are written under a temporary
+    name and moved into place when complete. Returns a summary dict with
+    rows, format, seconds and rows_per_sec.
+    """
+    fmt = export_format(target, fmt)
+    start = time.perf_counter()
+    is_path = isinstance(target, (str, os.PathLike))
+    if is_path:
+        # A unique temp name per call, with the real extension last so the
+        # writers recognise the format
+        fd, output = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(target)),
+                                      prefix=f"{os.path.basename(target)}.", suffix=f".tmp.{fmt}")
+        os.close(fd)
+    else:
+        output = target
+    writer = _open_writer(fmt, output, sheet_title)
+    rows = 0
+    try:
+        for chunk in iter_ledger_chunks(conn, loan_ids, customer_id, date_from, date_to, chunk_size):
+            writer.write(chunk)
+            rows += len(chunk)
+        writer.close()
+    except Exception:
+        if is_path and os.path.exists(output):
+            os.remove(output)
+        raise
+    if is_path:
+        os.replace(output, target)
+
+    elapsed = time.perf_counter() - start
+    return {"rows": rows, "format": fmt, "seconds": elapsed, "rows_per_sec": rows / elapsed if elapsed else 0.0}
+
+
+def export_statement(conn: sqlite3.Connection, loan_id, target, fmt=None, date_from=None, date_to=None):
+    """One loan's statement rows with their running balance (see export_ledger)."""
+    return export_ledger(conn, target, fmt, loan_ids=[loan_id], date_from=date_from, date_to=date_to,
+                         sheet_title="Statement")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export statements or a ledger extract to XLSX, CSV or Parquet.")
+    parser.add_argument("output", help="Output file; .xlsx, .csv or .parquet picks the format")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--format", choices=FORMATS, help="Override the format implied by the file name")
+    parser.add_argument("--loan", type=int, action="append", help="Only this loan id (repeatable)")
+    parser.add_argument("--customer", type=int, help="Only this customer id's loans")
+    parser.add_argument("--from", dest="date_from", help="Transactions on or after YYYY-MM-DD")
+    parser.add_argument("--to", dest="date_to", help="Transactions on or before YYYY-MM-DD")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Rows fetched and written per batch")
+    args = parser.parse_args(argv)
+
+    conn = connections.connect(args.db)
+    schema.migrate(conn)
+    try:
+        result = export_ledger(conn, args.output, args.format, args.loan, args.customer, args.date_from,
+                               args.date_to, args.chunk_size)
+    except ExportError as exc:
+        print(f"Error: {exc}")
+        return 1
+    finally:
+        conn.close()
+
+    print(f"Exported {result['rows']} rows to {args.output} in {result['seconds']:.2f}s - "
+          f"{result['rows_per_sec']:.0f} rows/sec")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
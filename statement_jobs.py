@@ -0,0 +1,207 @@
+"""Background statement rendering for the Streamlit app.
+
+The "Generate Statement" button only inserts a row into statement_jobs and
+hands the job to a thread pool; the page polls the job's status and picks the
+finished PDF up from the StatementArchive by its content hash. Jobs left
+queued or running by a previous server process are resubmitted on start-up.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+import pandas as pd
+
+import instrumentation
+from amortization import finance_charge
+from loan_repository import LoanRepository
+from statement_archive import StatementArchive
+from statement_pdf import consolidated_filename, statement_filename
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+PENDING_STATUSES = ("queued", "running")
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class StatementJobQueue:
+    def __init__(self, repo: LoanRepository, archive: StatementArchive, workers=DEFAULT_WORKERS):
+        self.repo = repo
+        self.db = repo.db
+        self.archive = archive
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="statement-job")
+        self._submitted = set()
+        self._lock = threading.Lock()
+        self.resume()
+
+    def resume(self):
+        """Resubmit jobs a previous process left unfinished."""
+        with self.db.reader() as conn:
+            rows = conn.execute("""
+                SELECT job_id, customer_id, loan_id, period_start, period_end FROM statement_jobs
+                WHERE status IN ('queued', 'running')
+                ORDER BY job_id
+            """).fetchall()
+        for job_id, customer_id, loan_id, period_start, period_end in rows:
+            # Consolidated jobs have no loan_id
+            period = (date.fromisoformat(period_start), date.fromisoformat(period_end)) if period_start else None
+            self._submit(job_id, customer_id, loan_id, period)
+        return len(rows)
+
+    def enqueue(self, customer_id, loan_id, period=None):
+        """Queue a statement for one loan and return its job_id.
+
+        period=(start, end) dates renders a period statement instead of the
+        whole history.
+        """
+        return self.enqueue_many(customer_id, [loan_id], period)[0]
+
+    def enqueue_many(self, customer_id, loan_ids, period=None):
+        """Queue one statement per loan and return their job_ids.
+
+        A loan that already has a queued or running job for the same period
+        gets that job's id back instead of a second render, so a double-click
+        on Generate costs one PDF.
+        """
+        customer_id = int(customer_id)
+        period_start, period_end = (day.strftime("%Y-%m-%d") for day in period) if period else (None, None)
+        job_ids = []
+        with self.db.write() as conn:
+            for loan_id in loan_ids:
+                row = conn.execute(f"""
+                    SELECT job_id FROM statement_jobs
+                    WHERE customer_id = ? AND loan_id = ? AND period_start IS ? AND period_end IS ?
+                      AND status IN ({", ".join("?" * len(PENDING_STATUSES))})
+                    ORDER BY job_id LIMIT 1
+                """, (customer_id, int(loan_id), period_start, period_end, *PENDING_STATUSES)).fetchone()
+                if row:
+                    job_ids.append(row[0])
+                    continue
+                cursor = conn.execute("""
+                    INSERT INTO statement_jobs (customer_id, loan_id, status, requested_at, period_start, period_end)
+                    VALUES (?, ?, 'queued', ?, ?, ?)
+                """, (customer_id, int(loan_id), _now(), period_start, period_end))
+                job_ids.append(cursor.lastrowid)
+        # Submitted after the commit so a worker always finds its row; jobs
+        # already in flight are skipped by _submit
+        for job_id, loan_id in zip(job_ids, loan_ids):
+            self._submit(job_id, customer_id, int(loan_id), period)
+        return job_ids
+
+    def enqueue_consolidated(self, customer_id):
+        """Queue one statement covering all of a customer's loans and return its job_id.
+
+        Returns the pending job's id if one is already queued or running.
+        """
+        customer_id = int(customer_id)
+        with self.db.write() as conn:
+            row = conn.execute(f"""
+                SELECT job_id FROM statement_jobs
+                WHERE customer_id = ? AND consolidated = 1
+                  AND status IN ({", ".join("?" * len(PENDING_STATUSES))})
+                ORDER BY job_id LIMIT 1
+            """, (customer_id, *PENDING_STATUSES)).fetchone()
+            if row:
+                job_id = row[0]
+            else:
+                job_id = conn.execute("""
+                    INSERT INTO statement_jobs (customer_id, loan_id, status, requested_at, consolidated)
+                    VALUES (?, NULL, 'queued', ?, 1)
+                """, (customer_id, _now())).lastrowid
+        self._submit(job_id, customer_id, None)
+        return job_id
+
+    def jobs(self, job_ids):
+        """Current rows of the given jobs, newest first."""
+        job_ids = [int(job_id) for job_id in job_ids]
+        if not job_ids:
+            return pd.DataFrame(columns=["job_id", "customer_id", "loan_id", "status", "requested_at", "started_at",
+                                         "finished_at", "filename", "content_hash", "reused", "error", "period_start",
+                                         "period_end", "consolidated"])
+        placeholders = ", ".join("?" * len(job_ids))
+        with self.db.reader() as conn:
+            return pd.read_sql(f"""
+                SELECT * FROM statement_jobs WHERE job_id IN ({placeholders}) ORDER BY job_id DESC
+            """, conn, params=job_ids)
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+    def _submit(self, job_id, customer_id, loan_id, period=None):
+        with self._lock:
+            if job_id in self._submitted:
+                return
+            self._submitted.add(job_id)
+        # Timings go to the requesting session's diagnostics, if it has them on
+        self._pool.submit(self._run, job_id, customer_id, loan_id, period, instrumentation.current_sink())
+
+    def _run(self, job_id, customer_id, loan_id, period=None, sink=None):
+        instrumentation.record_to(sink)
+        try:
+            self._run_job(job_id, customer_id, loan_id, period)
+        finally:
+            instrumentation.record_to(None)
+
+    def _run_job(self, job_id, customer_id, loan_id, period):
+        with self.db.write() as conn:
+            conn.execute("UPDATE statement_jobs SET status = 'running', started_at = ? WHERE job_id = ?",
+                         (_now(), job_id))
+        try:
+            if loan_id is None:
+                filename, content_hash, reused = self._render_consolidated(customer_id)
+            else:
+                filename, content_hash, reused = self._render_loan(customer_id, loan_id, period)
+        except Exception as exc:
+            logger.exception("Statement job %s for customer %s, loan %s failed", job_id, customer_id, loan_id)
+            with self.db.write() as conn:
+                conn.execute("""
+                    UPDATE statement_jobs SET status = 'failed', finished_at = ?, error = ? WHERE job_id = ?
+                """, (_now(), f"{type(exc).__name__}: {exc}", job_id))
+            return
+        with self.db.write() as conn:
+            conn.execute("""
+                UPDATE statement_jobs
+                SET status = 'done', finished_at = ?, filename = ?, content_hash = ?, reused = ?
+                WHERE job_id = ?
+            """, (_now(), filename, content_hash, int(reused), job_id))
+
+    def _render_loan(self, customer_id, loan_id, period):
+        customers = self.repo.customers()
+        customer_name = customers.loc[customers['customer_id'] == customer_id, 'customer_name'].iloc[0]
+        loans = self.repo.loans_for_customer(customer_id)
+        loans = loans[loans['loan_id'] == loan_id]
+        if loans.empty:
+            raise LookupError(f"loan {loan_id} does not belong to customer {customer_id}")
+        loan = loans.iloc[0]
+        if period:
+            opening, transactions = self.repo.statement_period(loan_id, *period)
+        else:
+            opening, transactions = 0.0, self.repo.transactions_for_loan(loan_id)
+        _, content_hash, reused = self.archive.get_or_render(
+            customer_name,
+            loan['account_number'],
+            transactions,
+            customer_name,
+            loan['loan_date'],
+            loan['loan_amount'],
+            finance_charge(loan['loan_amount'], loan['interest_rate']),
+            loan['admin_fee'],
+            period=period,
+            opening_balance=opening,
+        )
+        filename = statement_filename(customer_name, loan['account_number'], period)
+        self.repo.log_statement(customer_id, loan_id, filename, content_hash)
+        return filename, content_hash, reused
+
+    def _render_consolidated(self, customer_id):
+        customer_name, loans = self.repo.customer_statement(customer_id)
+        if not loans:
+            raise LookupError(f"customer {customer_id} has no loans")
+        _, content_hash, reused = self.archive.get_or_render_consolidated(customer_name, loans)
+        filename = consolidated_filename(customer_name)
+        self.repo.log_statements(customer_id, [loan['loan_id'] for loan in loans], filename, content_hash)
+        return filename, content_hash, reused
@@ -0,0 +1,395 @@
+import copy
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime
+
+import pandas as pd
+from fpdf import FPDF
+from fpdf.image_datastructures import ImageCache
+from fpdf.image_parsing import preload_image
+
+import instrumentation
+from statement_assets import DEFAULT_DPI, WATERMARK_DPI, prepare_image
+
+logger = logging.getLogger(__name__)
+
+# Resolve images next to this module so headless runs work from any directory
+ASSET_DIR = os.path.dirname(os.path.abspath(__file__))
+LOGO_PATH = os.path.join(ASSET_DIR, "logo.png")
+WATERMARK_PATH = os.path.join(ASSET_DIR, "transparent_watermark.png")
+
+# Bump whenever the statement layout changes
+TEMPLATE_VERSION = 2
+
+
+# PDF generation function
+class PDF(FPDF):
+    def header(self):
+        self.set_font('Helvetica', 'B', 12)
+        self.cell(200, 10, "Loan Statement", ln=True, align='C')
+
+    def footer(self):
+        self.set_y(-15)
+        self.set_font('Helvetica', 'I', 8)
+        self.cell(0, 10, f"Page {self.page_no()}", 0, 0, 'C')
+
+
+class StatementTemplate:
+    """Static statement chrome, built once per process and stamped onto every PDF.
+
+    The logo and watermark are decoded and compressed a single time; each new
+    document receives a copy of the parsed image cache so pdf.image() finds
+    them already loaded. The fixed text blocks are laid out here as plain
+    (width, height, text) tuples and only replayed per statement.
+    """
+
+    address_lines = (
+        (0, 6, "98 Spaanriet Street, The Reeds Ext 45, 0156"),
+        (0, 6, "(012) 006 0019"),
+        (0, 6, "info@ntirhisano.com"),
+    )
+    columns = (
+        (30, "Date"),
+        (65, "Description"),
+        (30, "Charges"),
+        (30, "Credits"),
+        (35, "Balance"),
+    )
+    summary_columns = (
+        (45, "Account"),
+        (35, "Loan Date"),
+        (40, "Loan Amount"),
+        (30, "Transactions"),
+        (40, "Balance"),
+    )
+    penalty_note = "*Penalty fee charged at 10% per month of the total outstanding"
+    payment_lines = (
+        "Bank: First National Bank",
+        "Account number: 62875263221",
+        "Branch number: 255355",
+    )
+
+    def __init__(self, logo_path=LOGO_PATH, watermark_path=WATERMARK_PATH):
+        self.images = ImageCache()
+        # Set when an image that exists could not be loaded
+        self.incomplete = False
+        self.logo = self._preload(logo_path, 50, 15)
+        self.watermark = self._preload(watermark_path, 150, 150, WATERMARK_DPI) if os.path.exists(watermark_path) else None
+
+    def _preload(self, path, width_mm, height_mm, dpi=DEFAULT_DPI):
+        if not os.path.exists(path):
+            logger.warning("Could not load %s: file not found", path)
+            return False
+        try:
+            # Embed a copy downscaled to the printed size rather than the source file
+            path = prepare_image(path, width_mm, height_mm, dpi)
+            name, _, _ = preload_image(self.images, path)
+        except Exception as exc:
+            logger.warning("Could not load %s: %s", path, exc)
+            self.incomplete = True
+            return False
+        # preload_image() counts the load as a use; documents start from zero
+        self.images.images[name]["usages"] = 0
+        return name
+
+    def new_document(self):
+        pdf = PDF()
+        # Share the decoded image data; only the per-document usage counters differ
+        pdf.image_cache = ImageCache(
+            images={name: copy.copy(info) for name, info in self.images.images.items()},
+            icc_profiles=dict(self.images.icc_profiles),
+            image_filter=self.images.image_filter,
+        )
+        pdf.add_page()
+        pdf.set_auto_page_break(auto=True, margin=15)
+        pdf.set_font("Helvetica", size=10)
+        return pdf
+
+    def draw_letterhead(self, pdf, account_number, statement_date, on_warning=logger.warning):
+        if self.logo:
+            pdf.image(self.logo, x=10, y=8, w=50, h=15)
+        else:
+            on_warning("Logo not found.")
+
+        pdf.cell(0, 5, f"Account Number: {account_number}", ln=True, align='R')
+        pdf.cell(0, 5, f"Statement Date: {statement_date}", ln=True, align='R')
+        pdf.ln(12)
+
+        for w, h, text in self.address_lines:
+            pdf.cell(w, h, text, ln=True)
+        pdf.ln(10)
+
+        if self.watermark:
+            pdf.image(self.watermark, x=30, y=60, w=150, h=150)
+        elif self.watermark is False:
+            on_warning("Watermark unreadable.")
+
+    def draw_title(self, pdf, customer_name):
+        pdf.set_font("Helvetica", "B", 16)
+        pdf.cell(200, 12, "STATEMENT OF ACCOUNT", ln=True, align='C')
+        pdf.set_draw_color(204, 85, 0)
+        pdf.set_line_width(1.0)
+        pdf.line(10, pdf.get_y(), 200, pdf.get_y())
+
+        pdf.set_font("Helvetica", size=12)
+        pdf.cell(200, 10, customer_name, ln=True, align='C')
+        pdf.ln(10)
+
+    def draw_period(self, pdf, start, end):
+        pdf.set_font("Helvetica", size=10)
+        pdf.cell(200, 6, f"Statement period: {start:%Y/%m/%d} to {end:%Y/%m/%d}", ln=True, align='C')
+        pdf.ln(4)
+
+    def draw_table_header(self, pdf):
+        pdf.set_font("Helvetica", "B", 11)
+        pdf.set_fill_color(220, 220, 220)
+        pdf.set_draw_color(0, 0, 0)
+        pdf.set_line_width(0.25)
+        for w, text in self.columns:
+            pdf.cell(w, 10, text, border=1, align='C', fill=True)
+        pdf.ln()
+
+    def draw_summary(self, pdf, loans, total):
+        """Summary table of a consolidated statement: one row per loan and the total owed."""
+        pdf.set_font("Helvetica", "B", 11)
+        pdf.set_fill_color(220, 220, 220)
+        pdf.set_draw_color(0, 0, 0)
+        pdf.set_line_width(0.25)
+        for w, text in self.summary_columns:
+            pdf.cell(w, 10, text, border=1, align='C', fill=True)
+        pdf.ln()
+
+        pdf.set_font("Helvetica", size=10)
+        for account_number, loan_date, loan_amount, transaction_count, balance in loans:
+            pdf.cell(45, 8, str(account_number), border=1)
+            pdf.cell(35, 8, loan_date, border=1)
+            pdf.cell(40, 8, format_rand(loan_amount), border=1, align='R')
+            pdf.cell(30, 8, str(transaction_count), border=1, align='R')
+            pdf.cell(40, 8, format_rand(balance), border=1, align='R')
+            pdf.ln()
+
+        pdf.set_font("Helvetica", "B", 10)
+        pdf.cell(150, 8, "Total Outstanding", border=1, align='R', fill=True)
+        pdf.cell(40, 8, format_rand(total), border=1, align='R', fill=True)
+        pdf.ln(12)
+
+    def draw_section_title(self, pdf, account_number, loan_date):
+        pdf.set_font("Helvetica", "B", 12)
+        pdf.cell(0, 10, f"Loan {account_number} - taken out {loan_date}", ln=True)
+        pdf.ln(2)
+
+    def draw_closing(self, pdf):
+        pdf.set_font("Helvetica", "I", 9)
+        pdf.multi_cell(0, 5, self.penalty_note)
+
+        pdf.ln(5)
+        pdf.set_font("Helvetica", "B", size=10)
+        pdf.cell(0, 8, "Payment Instruction", ln=True)
+
+        pdf.set_font("Helvetica", size=10)
+        for text in self.payment_lines:
+            pdf.set_x(15)
+            pdf.cell(0, 8, text, ln=True)
+
+
+# South African style: space as thousands separator, comma as decimal mark
+_RAND_SEPARATORS = str.maketrans({",": " ", ".": ","})
+
+
+def format_rand(value):
+    return f"{value:,.2f}R".translate(_RAND_SEPARATORS)
+
+
+def format_rand_series(values: pd.Series):
+    return values.map("{:,.2f}R".format).str.translate(_RAND_SEPARATORS)
+
+
+def prepare_statement_rows(transactions: pd.DataFrame, opening_balance=0.0):
+    """Turn raw transaction rows into the strings drawn in the statement table.
+
+    Dates, the charge/credit split, the running balance (starting from
+    opening_balance) and the "1 234,56R" amounts are computed for the whole
+    frame at once. Returns the prepared frame (date, description, charge,
+    credit, balance columns) and the closing balance.
+    """
+    if transactions.empty:
+        return pd.DataFrame(columns=["date", "description", "charge", "credit", "balance"]), opening_balance
+
+    amount = transactions['amount'].astype(float)
+    running = opening_balance + amount.cumsum()
+    rows = pd.DataFrame({
+        "date": pd.to_datetime(transactions['date'], format="mixed").dt.strftime('%Y/%m/%d'),
+        "description": transactions['description'].astype(str).str[:32],
+        "charge": format_rand_series(amount.clip(lower=0)).where(amount > 0, ""),
+        "credit": format_rand_series(-amount.clip(upper=0)).where(amount < 0, ""),
+        "balance": format_rand_series(running),
+    })
+    return rows, running.iloc[-1]
+
+
+_template = None
+_template_lock = threading.Lock()
+
+
+def get_template():
+    """The shared StatementTemplate, built once even when workers ask at the same time.
+
+    A template whose images failed to load is used for that statement but not
+    kept, so the next statement tries again instead of staying logo-less.
+    """
+    global _template
+    if _template is None:
+        with _template_lock:
+            if _template is None:
+                template = StatementTemplate()
+                if template.incomplete:
+                    return template
+                _template = template
+    return _template
+
+
+def _draw_brought_forward(pdf, start, opening_balance):
+    pdf.cell(30, 8, start.strftime('%Y/%m/%d'), border=1)
+    pdf.cell(125, 8, "Balance brought forward", border=1)
+    pdf.cell(35, 8, format_rand(opening_balance), border=1, align='R')
+    pdf.ln()
+
+
+def _draw_rows(pdf, rows, total_label, balance):
+    for date, desc, charge, credit, running in rows.itertuples(index=False, name=None):
+        pdf.cell(30, 8, date, border=1)
+        pdf.cell(65, 8, desc, border=1)
+        pdf.cell(30, 8, charge, border=1, align='R')
+        pdf.cell(30, 8, credit, border=1, align='R')
+        pdf.cell(35, 8, running, border=1, align='R')
+        pdf.ln()
+
+    pdf.set_font("Helvetica", "B", 10)
+    pdf.set_fill_color(220, 220, 220)
+    pdf.cell(155, 8, total_label, border=1, align='R', fill=True)
+    pdf.cell(35, 8, format_rand(balance), border=1, align='R', fill=True)
+    pdf.ln(10)
+
+
+def statement_filename(customer_name, account_number, period=None):
+    suffix = f"_{period[0]:%Y%m%d}-{period[1]:%Y%m%d}" if period else ""
+    return f"Statement_{customer_name.replace(' ', '_')}_{account_number}{suffix}.pdf"
+
+
+def render_pdf(customer_name, account_number, transactions, company_name, loan_date, loan_amount, finance_charge, admin_fee,
+               on_warning=logger.warning, statement_date=None, period=None, opening_balance=0.0):
+    """Render a statement and return the PDF as bytes, without touching disk.
+
+    statement_date (a date, default today) is printed in the letterhead. For a
+    period statement pass period=(start, end) with only that period's
+    transactions and the balance brought forward as opening_balance (see
+    statement_periods.py).
+    """
+    with instrumentation.trace("render_pdf", account=account_number):
+        with instrumentation.stage("template"):
+            template = get_template()
+            pdf = template.new_document()
+
+        with instrumentation.stage("letterhead"):
+            statement_date = (statement_date or datetime.now()).strftime("%Y/%m/%d")
+            template.draw_letterhead(pdf, account_number, statement_date, on_warning)
+            template.draw_title(pdf, customer_name)
+            if period:
+                template.draw_period(pdf, *period)
+            template.draw_table_header(pdf)
+
+        with instrumentation.stage("prepare_rows") as stage:
+            pdf.set_font("Helvetica", size=10)
+            rows, balance = prepare_statement_rows(transactions, opening_balance)
+            stage.set(rows=len(rows))
+
+        with instrumentation.stage("table") as stage:
+            if period:
+                _draw_brought_forward(pdf, period[0], opening_balance)
+            _draw_rows(pdf, rows, "Closing Balance" if period else "Outstanding Balance", balance)
+            template.draw_closing(pdf)
+            stage.set(rows=len(rows), pages=pdf.page_no())
+
+        with instrumentation.stage("output") as stage:
+            data = bytes(pdf.output())
+            stage.set(bytes=len(data))
+    return data
+
+
+def consolidated_filename(customer_name):
+    return f"Statement_{customer_name.replace(' ', '_')}_all_loans.pdf"
+
+
+def render_consolidated_pdf(customer_name, loans, on_warning=logger.warning, statement_date=None):
+    """Render one statement covering all of a customer's loans and return the PDF bytes.
+
+    loans is a list of dicts with account_number, loan_date, loan_amount and
+    transactions (see consolidated_statements.py). The first page summarises
+    every loan's balance; each loan then gets its own section with the full
+    transaction table. The template, images and fonts are set up once for
+    the whole document instead of once per loan.
+    """
+    with instrumentation.trace("render_consolidated_pdf", customer=customer_name, loans=len(loans)):
+        with instrumentation.stage("template"):
+            template = get_template()
+            pdf = template.new_document()
+
+        with instrumentation.stage("prepare_rows") as stage:
+            sections = [prepare_statement_rows(loan['transactions']) for loan in loans]
+            stage.set(rows=sum(len(rows) for rows, _ in sections))
+
+        with instrumentation.stage("letterhead"):
+            statement_date = (statement_date or datetime.now()).strftime("%Y/%m/%d")
+            template.draw_letterhead(pdf, f"{len(loans)} loans, see summary", statement_date, on_warning)
+            template.draw_title(pdf, customer_name)
+            summary = [
+                (loan['account_number'], str(loan['loan_date']), loan['loan_amount'], len(rows), balance)
+                for loan, (rows, balance) in zip(loans, sections)
+            ]
+            template.draw_summary(pdf, summary, sum(balance for _, balance in sections))
+            template.draw_closing(pdf)
+
+        with instrumentation.stage("table") as stage:
+            for loan, (rows, balance) in zip(loans, sections):
+                pdf.add_page()
+                template.draw_section_title(pdf, loan['account_number'], loan['loan_date'])
+                template.draw_table_header(pdf)
+                pdf.set_font("Helvetica", size=10)
+                _draw_rows(pdf, rows, "Outstanding Balance", balance)
+            stage.set(rows=sum(len(rows) for rows, _ in sections), pages=pdf.page_no())
+
+        with instrumentation.stage("output") as stage:
+            data = bytes(pdf.output())
+            stage.set(bytes=len(data))
+    return data
+
+
+def save_pdf(data, pdf_filename, output_dir="."):
+    """Write rendered PDF bytes to output_dir/pdf_filename and return the path."""
+    path = os.path.join(output_dir, pdf_filename)
+    # Write to a unique temp name first so a concurrent reader never sees a
+    # partial file and concurrent writers never share one
+    fd, tmp_path = tempfile.mkstemp(dir=output_dir, prefix=f"{pdf_filename}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def generate_pdf(customer_name, account_number, transactions, company_name, loan_date, loan_amount, finance_charge, admin_fee,
+                 pdf_filename=None, output_dir=".", on_warning=logger.warning, period=None, opening_balance=0.0):
+    """Render a statement and write it to disk; returns the file name."""
+    with instrumentation.trace("generate_pdf", account=account_number):
+        data = render_pdf(customer_name, account_number, transactions, company_name, loan_date, loan_amount,
+                          finance_charge, admin_fee, on_warning, period=period, opening_balance=opening_balance)
+        with instrumentation.stage("write"):
+            pdf_filename = pdf_filename or statement_filename(customer_name, account_number, period)
+            save_pdf(data, pdf_filename, output_dir)
+    return pdf_filename
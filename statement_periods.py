@@ -0,0 +1,73 @@
+"""Period statements: opening balance, the period's rows and carry-forward.
+
+A period statement shows only the transactions dated inside [start, end].
+The balance brought forward is one aggregate over the loan's earlier rows,
+answered from idx_transactions_loan_date (loan_id, date, amount) without
+touching the table. Each closing balance is the next period's opening
+balance, so a run of consecutive statements reads the loan's rows only once.
+"""
+import sqlite3
+from datetime import timedelta
+
+import pandas as pd
+
+OPENING_BALANCE_QUERY = """
+    SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE loan_id = ? AND date < ?
+"""
+
+PERIOD_QUERY = """
+    SELECT * FROM transactions
+    WHERE loan_id = ? AND date >= ? AND date <= ?
+    ORDER BY date
+"""
+
+
+def _iso(day):
+    return day if isinstance(day, str) else day.strftime("%Y-%m-%d")
+
+
+def opening_balance(conn: sqlite3.Connection, loan_id, start):
+    """Balance of the loan at the start of the day start."""
+    return float(conn.execute(OPENING_BALANCE_QUERY, (int(loan_id), _iso(start))).fetchone()[0])
+
+
+def period_transactions(conn: sqlite3.Connection, loan_id, start, end):
+    return pd.read_sql(PERIOD_QUERY, conn, params=(int(loan_id), _iso(start), _iso(end)))
+
+
+def month_periods(start, end):
+    """Calendar months overlapping [start, end], clipped to it, as (start, end) dates."""
+    periods = []
+    month_start = start
+    while month_start <= end:
+        next_month = (month_start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        periods.append((month_start, min(next_month - timedelta(days=1), end)))
+        month_start = next_month
+    return periods
+
+
+def iter_period_statements(conn: sqlite3.Connection, loan_id, periods):
+    """Yield one dict per consecutive (start, end) period with start, end,
+    opening_balance, transactions and closing_balance.
+
+    The first opening balance is one aggregate query and all periods' rows
+    come from a single range scan; later openings are carried forward.
+    """
+    periods = list(periods)
+    if not periods:
+        return
+    balance = opening_balance(conn, loan_id, periods[0][0])
+    rows = period_transactions(conn, loan_id, periods[0][0], periods[-1][1])
+    days = rows['date'].astype(str)
+    for start, end in periods:
+        in_period = rows[(days >= _iso(start)) & (days <= _iso(end))].reset_index(drop=True)
+        closing = balance + float(in_period['amount'].sum())
+        yield {
+            "start": start,
+            "end": end,
+            "opening_balance": balance,
+            "transactions": in_period,
+            "closing_balance": closing,
+        }
+        balance = closing
+
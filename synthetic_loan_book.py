@@ -0,0 +1,156 @@
+"""Generate synthetic loan books with the loan_statements_v2.db schema.
+
+Transaction counts per loan follow a heavy-tailed distribution, so most loans
+have a handful of rows while a few long-lived accounts have thousands, as in
+the real book. Generation is deterministic for a given seed.
+
+Example:
+    python synthetic_loan_book.py --loans 100000 --out bench_100k.db
+"""
+import argparse
+import os
+import sqlite3
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+import portfolio
+import schema
+import search_index
+
+BATCH_SIZE = 50_000
+START_DATE = date(2020, 1, 1)
+DAYS = 5 * 365
+
+DESCRIPTIONS = np.array(["Repayment", "Interest", "Penalty", "EFT Payment", "Cash Deposit", "Debit Order"])
+TYPES = np.array(["Repayment", "Interest", "Penalty", "Repayment", "Repayment", "Repayment"])
+METHODS = np.array(["Bank Transfer", "Cash", "Cheque"])
+FREQUENCIES = np.array(["Monthly", "Quarterly", "Annually"])
+
+
+def _iso_dates(day_offsets):
+    base = np.datetime64(START_DATE.isoformat())
+    return np.datetime_as_string(base + day_offsets.astype("timedelta64[D]"), unit="D")
+
+
+def transaction_counts(rng, loans, mean_transactions=12, max_transactions=5000):
+    # Pareto tail: a few accounts accumulate very long histories
+    counts = np.floor((rng.pareto(1.5, loans) + 1) * mean_transactions / 3).astype(np.int64)
+    return np.clip(counts, 1, max_transactions)
+
+
+def generate(db_path, loans, seed=0, mean_transactions=12, max_transactions=5000, customers=None):
+    """Create db_path with a synthetic book; returns a dict of row counts."""
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    rng = np.random.default_rng(seed)
+    customers = customers or max(1, loans // 3)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    schema.migrate(conn)
+
+    # The file is private to this process until generate() returns, so the
+    # search index and portfolio rollups are filled in one pass at the end
+    # instead of row by row
+    with search_index.deferred_indexing(conn), portfolio.deferred_rollups(conn):
+        conn.executemany(
+            "INSERT INTO customers (customer_id, customer_name, email, address, company_registration) VALUES (?, ?, ?, ?, ?)",
+            ((i, f"Customer {i:07d} (Pty) Ltd", f"customer{i}@example.co.za", f"{i} Main Road, Pretoria",
+              f"20{i % 25:02d}/{i % 1000000:06d}/07") for i in range(1, customers + 1)),
+        )
+
+        counts = transaction_counts(rng, loans, mean_transactions, max_transactions)
+        total_transactions = 0
+
+        for start in range(0, loans, BATCH_SIZE):
+            stop = min(start + BATCH_SIZE, loans)
+            n = stop - start
+            loan_ids = np.arange(start + 1, stop + 1)
+            customer_ids = rng.integers(1, customers + 1, n)
+            amounts = np.round(rng.uniform(1_000, 250_000, n), 2)
+            # Percentages, as entered in the app and booked by LoanRepository.add_loan
+            rates = rng.choice([15.0, 20.0, 23.0, 30.0], n)
+            fees = rng.choice([0.0, 250.0, 500.0], n)
+            loan_days = rng.integers(0, DAYS - 60, n)
+            loan_dates = _iso_dates(loan_days)
+            due_dates = _iso_dates(loan_days + 45)
+
+            conn.executemany("""
+                INSERT INTO loans (loan_id, customer_id, account_number, loan_amount, loan_date, due_date, loan_status,
+                                   interest_rate, admin_fee, payment_frequency, collateral, disbursement_method)
+                VALUES (?, ?, ?, ?, ?, ?, 'Active', ?, ?, ?, '', 'Bank Transfer')
+            """, zip(
+                loan_ids.tolist(), customer_ids.tolist(), [f"8432{i:07d}" for i in loan_ids.tolist()],
+                amounts.tolist(), loan_dates.tolist(), due_dates.tolist(), rates.tolist(), fees.tolist(),
+                rng.choice(FREQUENCIES, n).tolist(),
+            ))
+
+            # Disbursement, finance charge and admin fee first, then repayments that
+            # tend to pay the loan off over the loan's transaction count.
+            batch_counts = counts[start:stop]
+            repayments = np.maximum(batch_counts - 3, 0)
+            txn_loan = np.repeat(loan_ids, repayments)
+            txn_index = np.repeat(np.arange(n), repayments)
+            offsets = rng.integers(1, 720, txn_loan.size) + loan_days[txn_index]
+            share = (amounts * (1 + rates / 100) + fees)[txn_index] / np.maximum(repayments[txn_index], 1)
+            txn_amounts = -np.round(share * rng.uniform(0.6, 1.3, txn_loan.size), 2)
+            kind = rng.integers(0, len(DESCRIPTIONS), txn_loan.size)
+
+            opening = [
+                (loan_id, loan_date, "Loan Disbursed", amount, "disbursal", "bank transfer")
+                for loan_id, loan_date, amount in zip(loan_ids.tolist(), loan_dates.tolist(), amounts.tolist())
+            ] + [
+                (loan_id, loan_date, "Finance Charge", round(amount * rate / 100, 2), "finance charge", "bank transfer")
+                for loan_id, loan_date, amount, rate in zip(loan_ids.tolist(), loan_dates.tolist(), amounts.tolist(), rates.tolist())
+            ] + [
+                (loan_id, loan_date, "Admin Fee", fee, "fees", "bank transfer")
+                for loan_id, loan_date, fee in zip(loan_ids.tolist(), loan_dates.tolist(), fees.tolist())
+            ]
+            conn.executemany("""
+                INSERT INTO transactions (loan_id, date, description, amount, transaction_type, payment_method)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, opening)
+            conn.executemany("""
+                INSERT INTO transactions (loan_id, date, description, amount, transaction_type, payment_method)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, zip(
+                txn_loan.tolist(), _iso_dates(offsets).tolist(), DESCRIPTIONS[kind].tolist(), txn_amounts.tolist(),
+                TYPES[kind].tolist(), rng.choice(METHODS, txn_loan.size).tolist(),
+            ))
+            conn.commit()
+            total_transactions += len(opening) + txn_loan.size
+
+        # A statement history for roughly a tenth of the book
+        logged = rng.choice(np.arange(1, loans + 1), max(1, loans // 10), replace=False)
+        conn.executemany(
+            "INSERT INTO statement_logs (customer_id, loan_id, generated_at, filename) "
+            "SELECT customer_id, loan_id, ?, 'Statement_' || account_number || '.pdf' FROM loans WHERE loan_id = ?",
+            ((f"{(START_DATE + timedelta(days=int(d))).isoformat()} 08:00:00", int(loan_id))
+             for loan_id, d in zip(logged, rng.integers(0, DAYS, logged.size))),
+        )
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    return {"customers": customers, "loans": loans, "transactions": int(total_transactions), "statement_logs": int(logged.size)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic loan book database.")
+    parser.add_argument("--loans", type=int, default=1000, help="Number of loans (1k to 1M)")
+    parser.add_argument("--out", default="synthetic_loan_book.db", help="Database path to create (overwritten)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mean-transactions", type=int, default=12, help="Typical transactions per loan")
+    parser.add_argument("--max-transactions", type=int, default=5000, help="Cap for the longest histories")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    counts = generate(args.out, args.loans, args.seed, args.mean_transactions, args.max_transactions)
+    print(f"Wrote {args.out}: " + ", ".join(f"{v} {k}" for k, v in counts.items())
+          + f" in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
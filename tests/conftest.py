@@ -0,0 +1,63 @@
+"""Shared fixtures: a migrated database in a temp directory with a small loan book.
+
+Run from the repository root with: python -m pytest tests
+"""
+import os
+import sys
+from datetime import date
+
+import pytest
+
+# The modules live at the repository root rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import connections  # noqa: E402
+import schema  # noqa: E402
+from loan_repository import LoanRepository  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "loans.db")
+    conn = connections.connect(path)
+    schema.migrate(conn)
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def conn(db_path):
+    conn = connections.connect(db_path)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def db(db_path):
+    manager = connections.ConnectionManager(db_path)
+    yield manager
+    manager.close()
+
+
+@pytest.fixture
+def repo(db):
+    return LoanRepository(db)
+
+
+@pytest.fixture
+def book(repo):
+    """Two customers and three loans, one past due; returns their ids by name."""
+    repo.add_customer("Acme Trading", "accounts@acme.example", "1 Main Road", "2001/000001/07")
+    repo.add_customer("Baobab Holdings", "finance@baobab.example", "2 Side Street", "2002/000002/07")
+    customers = repo.customers().set_index("customer_name")["customer_id"]
+    acme, baobab = int(customers["Acme Trading"]), int(customers["Baobab Holdings"])
+
+    overdue = repo.add_loan(acme, "ACC-001", 10_000.0, 12.0, 150.0, date(2024, 1, 15), date(2024, 4, 15),
+                            "Monthly", "Vehicle", "EFT")
+    current = repo.add_loan(acme, "ACC-002", 5_000.0, 24.0, 100.0, date(2024, 3, 1), date(2099, 3, 1),
+                            "Quarterly", "None", "EFT")
+    other = repo.add_loan(baobab, "BAO-001", 20_000.0, 18.0, 250.0, date(2024, 2, 1), date(2099, 2, 1),
+                          "Monthly", "Property", "EFT")
+    repo.add_transaction(overdue, date(2024, 2, 15), "Repayment", -1_000.0, "payment", "EFT")
+    repo.add_transaction(other, date(2024, 3, 1), "Repayment", -2_500.0, "payment", "EFT")
+    return {"acme": acme, "baobab": baobab, "overdue": overdue, "current": current, "other": other}
@@ -0,0 +1,57 @@
+from datetime import date
+
+import accrual
+import loan_balances
+import loan_status
+
+
+def charges(conn, loan_id):
+    return conn.execute("""
+        SELECT date, transaction_type, amount FROM transactions
+        WHERE loan_id = ? AND payment_method = ? ORDER BY transaction_id
+    """, (loan_id, accrual.PAYMENT_METHOD)).fetchall()
+
+
+def test_first_run_charges_penalty_or_interest(conn, book):
+    result = accrual.run_accruals(conn, date(2024, 5, 31))
+    assert (result["penalties"], result["interest"]) == (1, 2)
+    # Past due: 10% of the balance
+    assert charges(conn, book["overdue"]) == [("2024-05-31", "Penalty", 1_035.0)]
+    # Not yet due: interest_rate is an annual percentage, charged monthly
+    assert charges(conn, book["current"]) == [("2024-05-31", "Interest", round(6_300.0 * 24 / 100 / 12, 2))]
+    assert charges(conn, book["other"]) == [("2024-05-31", "Interest", round(21_350.0 * 18 / 100 / 12, 2))]
+    assert loan_balances.find_drift(conn) == []
+
+
+def test_rerun_in_the_same_month_charges_nothing(conn, book):
+    accrual.run_accruals(conn, date(2024, 5, 31))
+    balances = conn.execute("SELECT loan_id, balance FROM loan_balances ORDER BY loan_id").fetchall()
+
+    again = accrual.run_accruals(conn, date(2024, 5, 31))
+    later = accrual.run_accruals(conn, date(2024, 5, 15))
+    assert (again["penalties"], again["interest"], later["penalties"], later["interest"]) == (0, 0, 0, 0)
+    assert conn.execute("SELECT loan_id, balance FROM loan_balances ORDER BY loan_id").fetchall() == balances
+    assert conn.execute("SELECT COUNT(*) FROM accruals").fetchone()[0] == 3
+
+
+def test_penalties_are_not_compounded(conn, book):
+    accrual.run_accruals(conn, date(2024, 5, 31), kinds=("penalty",))
+    accrual.run_accruals(conn, date(2024, 6, 30), kinds=("penalty",))
+    accrual.run_accruals(conn, date(2024, 7, 31), kinds=("penalty",))
+    assert [amount for _, _, amount in charges(conn, book["overdue"])] == [1_035.0] * 3
+
+
+def test_back_dated_run_leaves_current_statuses(conn, book):
+    # Before its due date the loan accrues interest, but today it is overdue
+    accrual.run_accruals(conn, date(2024, 3, 31))
+    assert charges(conn, book["overdue"])[0][1] == "Interest"
+    loan_ids = [book["overdue"], book["current"], book["other"]]
+    assert loan_status.compute_status_changes(conn, loan_ids) == []
+    assert conn.execute("SELECT loan_status FROM loans WHERE loan_id = ?", (book["overdue"],)).fetchone()[0] == "Overdue"
+
+
+def test_dry_run_writes_nothing(conn, book):
+    result = accrual.run_accruals(conn, date(2024, 5, 31), dry_run=True)
+    assert result["penalties"] == 1
+    assert conn.execute("SELECT COUNT(*) FROM accruals").fetchone()[0] == 0
+    assert charges(conn, book["overdue"]) == []
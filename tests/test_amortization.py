@@ -0,0 +1,20 @@
+import amortization
+
+
+def test_loan_without_finance_charge_row_uses_percent_rate(conn, book):
+    loan_id = book["other"]
+    conn.execute("DELETE FROM transactions WHERE loan_id = ? AND transaction_type = 'finance charge'", (loan_id,))
+    conn.commit()
+
+    loan = amortization.load_loans(conn, [loan_id]).iloc[0]
+    # 18% of 20 000, as add_loan would have booked it
+    assert loan["finance_charge"] == amortization.finance_charge(20_000.0, 18.0) == 3_600.0
+
+    schedule = amortization.schedule_for(conn, loan_id)
+    assert round(schedule["finance_charge"].sum(), 2) == 3_600.0
+    assert round(schedule["payment"].sum(), 2) == 20_000.0 + 3_600.0 + 250.0
+
+
+def test_booked_finance_charge_is_used_as_is(conn, book):
+    loan = amortization.load_loans(conn, [book["current"]]).iloc[0]
+    assert loan["finance_charge"] == 1_200.0
@@ -0,0 +1,46 @@
+from datetime import date
+
+import loan_balances
+
+
+def stored(conn, loan_id):
+    return conn.execute("""
+        SELECT ROUND(balance, 2), ROUND(total_charges, 2), ROUND(total_credits, 2), last_transaction_date,
+               transaction_count
+        FROM loan_balances WHERE loan_id = ?
+    """, (loan_id,)).fetchone()
+
+
+def test_add_loan_books_summary(conn, book):
+    # Disbursal + 12% finance charge + admin fee, less one repayment
+    assert stored(conn, book["overdue"]) == (10_350.0, 11_350.0, 1_000.0, "2024-02-15", 4)
+    assert loan_balances.find_drift(conn) == []
+
+
+def test_update_and_delete_keep_summary_in_step(repo, conn, book):
+    loan_id = book["overdue"]
+    transactions = repo.transactions_for_loan(loan_id)
+    repayment = int(transactions.loc[transactions["description"] == "Repayment", "transaction_id"].iloc[0])
+
+    repo.update_transaction(repayment, loan_id, date(2024, 5, 1), "Repayment", -3_000.0, "payment", "EFT")
+    assert stored(conn, loan_id) == (8_350.0, 11_350.0, 3_000.0, "2024-05-01", 4)
+
+    repo.delete_transaction(repayment, loan_id)
+    assert stored(conn, loan_id) == (11_350.0, 11_350.0, 0.0, "2024-01-15", 3)
+    assert loan_balances.find_drift(conn) == []
+
+
+def test_moving_a_transaction_between_loans(conn, book):
+    transaction_id = conn.execute("SELECT transaction_id FROM transactions WHERE loan_id = ? AND amount < 0",
+                                  (book["other"],)).fetchone()[0]
+    conn.execute("UPDATE transactions SET loan_id = ? WHERE transaction_id = ?", (book["current"], transaction_id))
+    conn.commit()
+    assert loan_balances.find_drift(conn) == []
+    assert stored(conn, book["current"])[0] == 5_000.0 + 1_200.0 + 100.0 - 2_500.0
+
+
+def test_rebuild_matches_triggers(conn, book):
+    loan_ids = [book[name] for name in ("overdue", "current", "other")]
+    before = [stored(conn, loan_id) for loan_id in loan_ids]
+    loan_balances.rebuild_loan_balances(conn)
+    assert [stored(conn, loan_id) for loan_id in loan_ids] == before
@@ -0,0 +1,61 @@
+from datetime import date
+
+import pytest
+
+import loan_status
+import portfolio
+import transaction_import
+
+
+def test_rollups_follow_writes(repo, conn, book):
+    assert portfolio.find_drift(conn) == []
+
+    loan_id = book["current"]
+    repo.add_transaction(loan_id, date(2024, 6, 1), "Repayment", -800.0, "payment", "EFT")
+    transactions = repo.transactions_for_loan(loan_id)
+    repayment = int(transactions.loc[transactions["description"] == "Repayment", "transaction_id"].iloc[0])
+    repo.update_transaction(repayment, loan_id, date(2024, 7, 1), "Repayment", -900.0, "refund", "EFT")
+    assert portfolio.find_drift(conn) == []
+
+    repo.delete_transaction(repayment, loan_id)
+    assert portfolio.find_drift(conn) == []
+
+
+def test_status_changes_move_outstanding_between_buckets(conn, book):
+    loan_status.update_loan_statuses(conn, today=date(2099, 6, 1))
+    assert portfolio.find_drift(conn) == []
+    by_status = portfolio.outstanding_by_status(conn).set_index("loan_status")["loans"]
+    assert by_status.get("Overdue", 0) == 3
+
+
+def test_deferred_rollups_match_triggers(db, conn, book, tmp_path):
+    export = tmp_path / "bank.csv"
+    export.write_text("Company,Account,Date,Amount,Description,Transaction Type\n"
+                      "Acme Trading,ACC-001,2024-05-01,-400,Repayment,payment\n"
+                      "Acme Trading,ACC-002,2024-05-01,-300,Repayment,payment\n"
+                      "Baobab Holdings,,2024-06-01,120,Late fee,fees\n")
+    with db.write() as writer:
+        transaction_import.import_transactions(writer, str(export), chunk_size=2)
+    assert conn.execute("SELECT COUNT(*) FROM portfolio_suspended").fetchone()[0] == 0
+    assert portfolio.find_drift(conn) == []
+
+    # And a rebuild from scratch gives the same totals
+    monthly = conn.execute("SELECT * FROM portfolio_monthly WHERE transaction_count != 0 ORDER BY 1, 2").fetchall()
+    portfolio.rebuild_rollups(conn)
+    assert conn.execute("SELECT * FROM portfolio_monthly ORDER BY 1, 2").fetchall() == monthly
+
+
+def test_status_change_rolls_back_with_a_failed_write(repo, db, conn, book):
+    loan_id = book["current"]
+    with pytest.raises(RuntimeError):
+        with db.write() as writer:
+            # Pays the loan off, so its status flips to Paid inside the write
+            writer.execute("""
+                INSERT INTO transactions (loan_id, date, description, amount, transaction_type, payment_method)
+                VALUES (?, '2024-06-01', 'Settlement', -6300, 'payment', 'EFT')
+            """, (loan_id,))
+            repo._transactions_changed(writer, loan_id)
+            assert writer.execute("SELECT loan_status FROM loans WHERE loan_id = ?", (loan_id,)).fetchone()[0] == "Paid"
+            raise RuntimeError("write failed after the status update")
+    assert conn.execute("SELECT loan_status FROM loans WHERE loan_id = ?", (loan_id,)).fetchone()[0] == "Active"
+    assert portfolio.find_drift(conn) == []
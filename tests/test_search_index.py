@@ -0,0 +1,75 @@
+from datetime import date
+
+import search_index
+import transaction_import
+
+
+def indexed(conn):
+    return conn.execute("""
+        SELECT rowid, kind, title, body, ref_id, customer_id, loan_id FROM search_index ORDER BY rowid
+    """).fetchall()
+
+
+def assert_in_step(conn):
+    # The trigger-maintained rows must equal a rebuild from the source tables
+    before = indexed(conn)
+    search_index.rebuild_index(conn)
+    conn.commit()
+    assert indexed(conn) == before
+
+
+def titles(repo, text, kinds=None):
+    return set(repo.search(text, kinds)["title"])
+
+
+def test_new_rows_are_searchable(repo, conn, book):
+    assert titles(repo, "acm tra") == {"Acme Trading"}
+    assert titles(repo, "BAO", kinds=("loan",)) == {"BAO-001"}
+    assert [name for _, name in repo.suggest_customers("baob")] == ["Baobab Holdings"]
+    assert_in_step(conn)
+
+
+def test_update_and_delete_reindex(repo, conn, book):
+    loan_id = book["other"]
+    repo.add_transaction(loan_id, date(2024, 4, 1), "Quarterly levy", 75.0, "fees", "EFT")
+    transactions = repo.transactions_for_loan(loan_id)
+    levy = int(transactions.loc[transactions["description"] == "Quarterly levy", "transaction_id"].iloc[0])
+    assert titles(repo, "levy") == {"Quarterly levy"}
+
+    repo.update_transaction(levy, loan_id, date(2024, 4, 1), "Insurance premium", 75.0, "fees", "EFT")
+    assert titles(repo, "levy") == set()
+    assert titles(repo, "insurance") == {"Insurance premium"}
+
+    repo.delete_transaction(levy, loan_id)
+    assert titles(repo, "insurance") == set()
+    assert_in_step(conn)
+
+
+def test_bulk_import_indexes_in_one_pass(db, repo, conn, book, tmp_path):
+    export = tmp_path / "bank.csv"
+    export.write_text("Company,Account,Date,Amount,Description\n"
+                      "Acme Trading,ACC-002,2024-04-01,-500,Debit order April\n"
+                      "Baobab Holdings,,2024-04-02,-750,Debit order April\n")
+    # One row per chunk, so the deferred pass covers several executemany batches
+    with db.write() as writer:
+        result = transaction_import.import_transactions(writer, str(export), chunk_size=1)
+    assert result["inserted"] == 2
+    assert len(repo.search("debit april", kinds=("transaction",))) == 2
+    assert conn.execute("SELECT COUNT(*) FROM search_index_suspended").fetchone()[0] == 0
+    assert_in_step(conn)
+
+
+def test_transaction_search_pages_newest_first(repo, book):
+    loan_id = book["other"]
+    for month in range(4, 8):
+        repo.add_transaction(loan_id, date(2024, month, 1), f"Repayment {month:02d}", -100.0, "payment", "EFT")
+    repo.add_transaction(loan_id, date(2024, 8, 1), "Fee 100% waived", 0.0, "fees", "EFT")
+
+    first = repo.search_transactions(loan_id, "payment", limit=3)
+    assert first["description"].tolist() == ["Repayment 07", "Repayment 06", "Repayment 05"]
+    last = first.iloc[-1]
+    older = repo.search_transactions(loan_id, "payment", limit=3, before=(last["date"], last["transaction_id"]))
+    # The booking-day repayment on 2024-03-01 is on the second page too
+    assert older["description"].tolist() == ["Repayment 04", "Repayment"]
+    # % is matched literally, not as a wildcard
+    assert repo.search_transactions(loan_id, "0%")["description"].tolist() == ["Fee 100% waived"]
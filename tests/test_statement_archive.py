@@ -0,0 +1,102 @@
+import os
+import threading
+import time
+from datetime import date
+
+import pandas as pd
+
+import batch_statements
+from statement_archive import StatementArchive, statement_key
+from statement_jobs import StatementJobQueue
+
+TRANSACTIONS = pd.DataFrame({
+    "date": ["2024-01-15", "2024-01-15", "2024-02-15"],
+    "description": ["Loan Disbursed", "Finance Charge", "Repayment"],
+    "amount": [10_000.0, 1_200.0, -1_000.0],
+})
+
+
+def key_for(transactions=TRANSACTIONS, statement_date=date(2024, 6, 30), **overrides):
+    fields = dict(customer_name="Acme Trading", account_number="ACC-001", company_name="Acme Trading",
+                  loan_date="2024-01-15", loan_amount=10_000.0, finance_charge=1_200.0, admin_fee=150.0)
+    fields.update(overrides)
+    return statement_key(transactions=transactions, statement_date=statement_date, **fields)
+
+
+def test_key_depends_on_statement_content():
+    assert key_for() == key_for(transactions=TRANSACTIONS.copy())
+    changed = TRANSACTIONS.assign(amount=[10_000.0, 1_200.0, -1_500.0])
+    assert key_for(transactions=changed) != key_for()
+    assert key_for(statement_date=date(2024, 7, 1)) != key_for()
+    assert key_for(period=(date(2024, 1, 1), date(2024, 1, 31))) != key_for()
+
+
+def test_put_get_roundtrip(tmp_path):
+    archive = StatementArchive(str(tmp_path))
+    key = key_for()
+    assert archive.get(key) is None
+    path = archive.put(key, b"%PDF-1.4 statement")
+    assert path == archive.path_for(key)
+    assert archive.get(key) == b"%PDF-1.4 statement"
+
+
+def test_concurrent_puts_of_one_key(tmp_path):
+    archive = StatementArchive(str(tmp_path))
+    key = key_for()
+    data = b"%PDF-1.4 " + b"x" * 200_000
+    errors = []
+
+    def writer():
+        try:
+            for _ in range(25):
+                archive.put(key, data)
+                # A reader never sees a partial file
+                assert archive.get(key) == data
+        except Exception as exc:  # collected so a failure in a thread fails the test
+            errors.append(exc)
+
+    threads = [threading.Thread(target=writer) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    # Only the finished PDF is left; no temp files
+    assert [name for _, _, names in os.walk(tmp_path) for name in names] == [f"{key}.pdf"]
+
+
+def archive_bytes(archive):
+    return sum(size for _, size, _ in archive.entries())
+
+
+def test_put_prunes_to_the_size_budget(tmp_path):
+    archive = StatementArchive(str(tmp_path), max_bytes=250, prune_every=2)
+    for n in range(6):
+        archive.put(key_for(account_number=f"ACC-{n:03d}"), b"x" * 100)
+        if n % 2:
+            assert archive_bytes(archive) <= 250
+    assert len(archive.entries()) == 2
+
+
+def test_job_queue_keeps_the_archive_within_budget(repo, book, tmp_path):
+    # A budget smaller than one PDF: every put is followed by a prune that empties the archive
+    archive = StatementArchive(str(tmp_path / "archive"), max_bytes=1, prune_every=1)
+    queue = StatementJobQueue(repo, archive, workers=2)
+    job_ids = queue.enqueue_many(book["acme"], [book["overdue"], book["current"]])
+    queue.shutdown()
+    assert set(queue.jobs(job_ids)["status"]) == {"done"}
+    assert archive.entries() == []
+
+
+def test_batch_run_prunes_expired_statements(db_path, book, tmp_path):
+    archive = StatementArchive(str(tmp_path / "archive"))
+    stale = archive.put(key_for(account_number="OLD-001"), b"%PDF-1.4 stale")
+    long_ago = time.time() - 400 * 86400
+    os.utime(stale, (long_ago, long_ago))
+
+    rendered, failed, _ = batch_statements.run_batch(db_path, str(tmp_path / "pdfs"), workers=1,
+                                                     archive_dir=archive.root)
+    assert (rendered, failed) == (3, 0)
+    assert not os.path.exists(stale)
+    assert len(archive.entries()) == 3
@@ -0,0 +1,102 @@
+import pytest
+
+import statement_delivery
+from debug_smtp_server import DebugSMTPServer
+
+
+@pytest.fixture
+def smtp_server():
+    # Port 0 picks a free port
+    server = DebugSMTPServer("localhost", 0)
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def statements(repo, book, tmp_path):
+    """Three single-loan statements and one consolidated one, with their PDFs in a directory."""
+    pdf_dir = tmp_path / "pdfs"
+    pdf_dir.mkdir()
+    files = {
+        "Statement_Acme_ACC-001.pdf": (book["acme"], [book["overdue"]]),
+        "Statement_Acme_ACC-002.pdf": (book["acme"], [book["current"]]),
+        "Statement_Baobab_BAO-001.pdf": (book["baobab"], [book["other"]]),
+        "Statement_Acme_all_loans.pdf": (book["acme"], [book["overdue"], book["current"]]),
+    }
+    for filename, (customer_id, loan_ids) in files.items():
+        (pdf_dir / filename).write_bytes(b"%PDF-1.4 " + filename.encode())
+        repo.log_statements(customer_id, loan_ids, filename)
+    return pdf_dir
+
+
+def mailer(server, pdf_dir, workers=2):
+    pool = statement_delivery.SMTPPool("localhost", server.server_address[1], size=workers)
+    return statement_delivery.StatementMailer(pool, pdf_dir=str(pdf_dir), rate_per_minute=0, backoff=0)
+
+
+def statuses(conn):
+    return dict(conn.execute("SELECT filename, status FROM statement_deliveries"))
+
+
+def test_queue_sends_each_file_once(conn, statements):
+    assert statement_delivery.queue_deliveries(conn) == 4
+    # The consolidated file covers two log rows but is one email
+    unlinked = conn.execute("SELECT COUNT(*) FROM statement_logs WHERE delivery_id IS NULL").fetchone()[0]
+    assert unlinked == 0
+    assert statement_delivery.queue_deliveries(conn) == 0
+
+
+def test_transient_failures_are_retried(conn, statements, smtp_server):
+    smtp_server.fail_every = 2
+    statement_delivery.queue_deliveries(conn)
+    sender = mailer(smtp_server, statements)
+    result = statement_delivery.send_deliveries(conn, sender, workers=2)
+    sender.pool.close()
+
+    assert (result["sent"], result["failed"]) == (4, 0)
+    assert smtp_server.messages == 4 and smtp_server.failures > 0
+    attempts = conn.execute("SELECT SUM(attempts) FROM statement_deliveries").fetchone()[0]
+    assert attempts == smtp_server.messages + smtp_server.failures
+
+
+def test_missing_pdf_fails_without_retrying(conn, statements, smtp_server):
+    (statements / "Statement_Baobab_BAO-001.pdf").unlink()
+    statement_delivery.queue_deliveries(conn)
+    sender = mailer(smtp_server, statements)
+    result = statement_delivery.send_deliveries(conn, sender)
+    sender.pool.close()
+
+    assert (result["sent"], result["failed"]) == (3, 1)
+    row = conn.execute("""
+        SELECT status, attempts, error FROM statement_deliveries WHERE filename = 'Statement_Baobab_BAO-001.pdf'
+    """).fetchone()
+    assert row[:2] == ("failed", 0) and row[2].startswith("FileNotFoundError")
+
+
+def test_send_filters_by_customer_and_date(conn, book, statements, smtp_server):
+    statement_delivery.queue_deliveries(conn)
+    conn.execute("UPDATE statement_logs SET generated_at = '2024-01-31 09:00:00' WHERE filename LIKE '%ACC-001%'")
+    conn.commit()
+    sender = mailer(smtp_server, statements)
+
+    result = statement_delivery.send_deliveries(conn, sender, customer_ids=[book["baobab"]])
+    assert result["sent"] == 1
+    assert statuses(conn)["Statement_Acme_ACC-002.pdf"] == "queued"
+
+    result = statement_delivery.send_deliveries(conn, sender, since="2024-06-01")
+    sender.pool.close()
+    assert result["sent"] == 2
+    assert [name for name, status in statuses(conn).items() if status == "queued"] == ["Statement_Acme_ACC-001.pdf"]
+
+
+def test_cli_exits_non_zero_when_deliveries_fail(db_path, statements, smtp_server, capsys):
+    (statements / "Statement_Acme_ACC-002.pdf").unlink()
+    port = str(smtp_server.server_address[1])
+    args = ["--db", db_path, "send", "--queue", "--pdf-dir", str(statements), "--smtp-port", port, "--rate", "0"]
+    assert statement_delivery.main(args) == 1
+    assert "Sent 3, failed 1" in capsys.readouterr().out
+
+    # Nothing left to send, so nothing failed this time
+    assert statement_delivery.main(args) == 0
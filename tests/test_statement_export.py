@@ -0,0 +1,81 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+import statement_export
+
+
+def ledger(conn, **filters):
+    return pd.concat(list(statement_export.iter_ledger_chunks(conn, **filters)), ignore_index=True)
+
+
+def test_same_day_rows_keep_entry_order(conn, book):
+    rows = ledger(conn, loan_ids=[book["overdue"]])
+    # All three booking rows share the loan date; the index alone would order them by amount
+    assert rows["description"].tolist() == ["Loan Disbursed", "Finance Charge", "Admin Fee", "Repayment"]
+    assert rows["balance"].tolist() == [10_000.0, 11_200.0, 11_350.0, 10_350.0]
+    assert rows["transaction_id"].is_monotonic_increasing
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 1_000])
+def test_balances_run_per_loan_across_chunks(conn, book, chunk_size):
+    rows = ledger(conn, chunk_size=chunk_size)
+    closing = rows.groupby("loan_id")["balance"].last()
+    stored = dict(conn.execute("SELECT loan_id, ROUND(balance, 2) FROM loan_balances"))
+    assert closing.to_dict() == stored
+    assert (rows["charge"] - rows["credit"]).groupby(rows["loan_id"]).cumsum().round(2).tolist() == \
+           rows["balance"].tolist()
+
+
+def test_date_from_brings_balance_forward(conn, book):
+    rows = ledger(conn, customer_id=book["acme"], date_from=date(2024, 2, 1))
+    overdue = rows[rows["loan_id"] == book["overdue"]]
+    # Opening 11 350 from the January rows, less the February repayment
+    assert overdue["balance"].tolist() == [10_350.0]
+    assert set(rows["loan_id"]) == {book["overdue"], book["current"]}
+
+
+@pytest.mark.parametrize("fmt", statement_export.FORMATS)
+def test_export_formats_write_every_row(conn, book, tmp_path, fmt):
+    out_dir = tmp_path / "exports"
+    out_dir.mkdir()
+    target = out_dir / f"ledger.{fmt}"
+    result = statement_export.export_ledger(conn, str(target))
+    assert result["rows"] == conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+    # Written under a temp name and moved into place
+    assert [path.name for path in out_dir.iterdir()] == [target.name]
+    if fmt == "csv":
+        assert len(pd.read_csv(target)) == result["rows"]
+    elif fmt == "parquet":
+        assert len(pd.read_parquet(target)) == result["rows"]
+
+
+@pytest.mark.parametrize("filters", [
+    {},
+    {"date_from": "2024-02-01", "date_to": "2024-02-29"},
+    {"customer_id": 1},
+    {"customer_id": 1, "date_from": "2024-02-01"},
+    {"loan_ids": [1, 3], "date_to": "2024-03-31"},
+])
+def test_export_query_streams_without_sorting(conn, book, filters):
+    where, params = statement_export.build_filters(filters.get("loan_ids"), filters.get("customer_id"))
+    for key, op in (("date_from", ">="), ("date_to", "<=")):
+        if key in filters:
+            where += f" AND t.date {op} ?"
+            params.append(filters[key])
+    plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {statement_export.EXPORT_QUERY.format(filters=where)}",
+                                           params)]
+    assert not any("TEMP B-TREE" in step for step in plan), plan
+    assert any("idx_transactions_loan_date_id" in step for step in plan), plan
+
+
+def test_xlsx_amounts_use_a_grouping_format(conn, book, tmp_path):
+    from openpyxl import load_workbook
+
+    target = tmp_path / "ledger.xlsx"
+    statement_export.export_ledger(conn, str(target), loan_ids=[book["overdue"]])
+    sheet = load_workbook(target).active
+    balance = sheet.cell(row=2, column=statement_export.COLUMNS.index("balance") + 1)
+    assert balance.value == 10_000.0
+    assert balance.number_format == '#,##0.00"R"'
@@ -0,0 +1,220 @@
+"""Streaming bulk import of bank exports into loan_statements_v2.db.
+
+Files are read in fixed-size chunks (CSV through pandas, XLSX through
+openpyxl's read-only mode) and every chunk is written with executemany inside
+a single database transaction, so a failed import leaves nothing behind and a
+million-row export never needs to fit in memory.
+
+Example:
+    python transaction_import.py bank_export.csv
+"""
+import argparse
+import os
+import sqlite3
+import time
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+import connections
+import loan_status
+import portfolio
+import schema
+import search_index
+
+DB_PATH = "loan_statements_v2.db"
+CHUNK_SIZE = 50_000
+
+REQUIRED_COLUMNS = ['Company', 'Date', 'Amount', 'Description']
+# Optional columns and the value used when a file does not have them
+OPTIONAL_COLUMNS = {
+    'Account': None,
+    'Transaction Type': "imported",
+    'Payment Method': "bank transfer",
+}
+
+
+class TransactionImportError(ValueError):
+    pass
+
+
+def _read_csv_chunks(source, chunk_size):
+    reader = pd.read_csv(source, chunksize=chunk_size, dtype=str, keep_default_na=False, na_values=[""])
+    for chunk in reader:
+        chunk.columns = [str(column).strip() for column in chunk.columns]
+        yield chunk
+
+
+def _read_xlsx_chunks(source, chunk_size):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(column).strip() if column is not None else "" for column in next(rows, ())]
+        while True:
+            batch = list(islice(rows, chunk_size))
+            if not batch:
+                break
+            yield pd.DataFrame(batch, columns=header)
+    finally:
+        workbook.close()
+
+
+def read_chunks(source, filename=None, chunk_size=CHUNK_SIZE):
+    """Yield DataFrame chunks from a CSV or XLSX path or uploaded file object."""
+    name = (filename or getattr(source, "name", None) or str(source)).lower()
+    if name.endswith(".csv"):
+        return _read_csv_chunks(source, chunk_size)
+    if name.endswith((".xlsx", ".xlsm")):
+        return _read_xlsx_chunks(source, chunk_size)
+    raise TransactionImportError(f"Unsupported file type: {name}. Upload a .csv or .xlsx file.")
+
+
+class _LoanResolver:
+    """Maps Company (and Account, when present) to loan ids, one lookup per distinct key."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.customers = {}
+        self.loans = {}
+
+    def customer_id(self, company):
+        if company not in self.customers:
+            row = self.conn.execute(
+                "SELECT customer_id FROM customers WHERE customer_name = ? ORDER BY customer_id LIMIT 1", (company,)
+            ).fetchone()
+            self.customers[company] = row[0] if row else None
+        return self.customers[company]
+
+    def loan_id(self, company, account):
+        key = (company, account)
+        if key not in self.loans:
+            customer_id = self.customer_id(company)
+            row = None
+            if customer_id is not None:
+                if account:
+                    row = self.conn.execute("""
+                        SELECT loan_id FROM loans WHERE customer_id = ? AND account_number = ?
+                        ORDER BY loan_date DESC, loan_id DESC LIMIT 1
+                    """, (customer_id, account)).fetchone()
+                else:
+                    # Without an account column, post to the customer's latest loan
+                    row = self.conn.execute("""
+                        SELECT loan_id FROM loans WHERE customer_id = ?
+                        ORDER BY loan_date DESC, loan_id DESC LIMIT 1
+                    """, (customer_id,)).fetchone()
+            self.loans[key] = row[0] if row else None
+        return self.loans[key]
+
+
+def _prepare_chunk(chunk, resolver):
+    missing = [column for column in REQUIRED_COLUMNS if column not in chunk.columns]
+    if missing:
+        raise TransactionImportError(f"The file must contain the following columns: {', '.join(REQUIRED_COLUMNS)}. "
+                                     f"Missing: {', '.join(missing)}.")
+    for column, default in OPTIONAL_COLUMNS.items():
+        if column not in chunk.columns:
+            chunk[column] = default
+
+    company = chunk['Company'].astype("string").str.strip()
+    account = chunk['Account'].astype("string").str.strip().fillna("")
+    dates = pd.to_datetime(chunk['Date'], errors='coerce', format="mixed").dt.strftime("%Y-%m-%d")
+    amounts = pd.to_numeric(chunk['Amount'], errors='coerce')
+
+    # Resolve each distinct (company, account) once, then broadcast to the rows
+    keys = list(zip(company.fillna("").tolist(), account.tolist()))
+    lookup = {key: resolver.loan_id(*key) if key[0] else None for key in set(keys)}
+    loan_ids = np.array([lookup[key] for key in keys], dtype="float64")
+
+    valid = dates.notna().to_numpy() & amounts.notna().to_numpy() & ~np.isnan(loan_ids)
+    if not valid.any():
+        return [], set(), len(chunk)
+
+    description = chunk['Description'].fillna("").astype(str)
+    transaction_type = chunk['Transaction Type'].fillna(OPTIONAL_COLUMNS['Transaction Type']).astype(str)
+    payment_method = chunk['Payment Method'].fillna(OPTIONAL_COLUMNS['Payment Method']).astype(str)
+
+    loan_ids = loan_ids[valid].astype("int64")
+    records = list(zip(
+        loan_ids.tolist(),
+        dates[valid].tolist(),
+        description[valid].tolist(),
+        amounts[valid].astype(float).tolist(),
+        transaction_type[valid].tolist(),
+        payment_method[valid].tolist(),
+    ))
+    return records, set(loan_ids.tolist()), int((~valid).sum())
+
+
+def import_transactions(conn: sqlite3.Connection, source, filename=None, chunk_size=CHUNK_SIZE):
+    """Stream a CSV/XLSX export into the transactions table in one transaction.
+
+    Rows with an unparseable Date or Amount, or whose Company/Account does not
+    match an existing customer's loan, are skipped and counted as rejected.
+    Rows are inserted in file order. Returns a summary dict with inserted and
+    rejected counts, the touched loan ids, elapsed seconds and rows_per_sec.
+    """
+    start = time.perf_counter()
+    resolver = _LoanResolver(conn)
+    inserted, rejected, touched = 0, 0, set()
+
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        with search_index.deferred_indexing(conn), portfolio.deferred_rollups(conn):
+            for chunk in read_chunks(source, filename, chunk_size):
+                records, loan_ids, chunk_rejected = _prepare_chunk(chunk, resolver)
+                conn.executemany("""
+                    INSERT INTO transactions (loan_id, date, description, amount, transaction_type, payment_method)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, records)
+                inserted += len(records)
+                rejected += chunk_rejected
+                touched |= loan_ids
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    if touched:
+        loan_status.update_loan_statuses(conn, touched)
+
+    elapsed = time.perf_counter() - start
+    return {
+        "inserted": inserted,
+        "rejected": rejected,
+        "loan_ids": touched,
+        "seconds": elapsed,
+        "rows_per_sec": (inserted + rejected) / elapsed if elapsed else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import transactions from a CSV or XLSX bank export.")
+    parser.add_argument("file", help="CSV or XLSX file with Company, Date, Amount and Description columns")
+    parser.add_argument("--db", default=DB_PATH, help="SQLite database path")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Rows read and inserted per batch")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.file):
+        parser.error(f"{args.file} does not exist")
+
+    conn = connections.connect(args.db)
+    schema.migrate(conn)
+    try:
+        result = import_transactions(conn, args.file, chunk_size=args.chunk_size)
+    except TransactionImportError as exc:
+        print(f"Error: {exc}")
+        return 1
+    finally:
+        conn.close()
+
+    print(f"Imported {result['inserted']} transactions for {len(result['loan_ids'])} loans, "
+          f"rejected {result['rejected']} rows in {result['seconds']:.2f}s - {result['rows_per_sec']:.0f} rows/sec")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())